@@ -0,0 +1,90 @@
+import pandas as pd
+
+# Grouped aggregations shared by the chart builders.
+# Everything here is computed with grouped sums over the whole frame, never with per-group Python calls.
+# Every function also accepts a sqlite_backend.SqliteBookings, the group-by then runs as SQL.
+
+
+def weighted_sums(df, value_col, weight_col, by):
+    """
+    Computes sum(weight * value) and sum(weight) per group, ignoring rows where either is missing.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame or sqlite_backend.SqliteBookings
+        DataFrame containing the data
+    value_col : str
+        Column to average (e.g. 'AVG CONTRIBUTION')
+    weight_col : str
+        Column holding the weights (e.g. 'TOTAL TEU')
+    by : str or list
+        Column(s) to group by
+
+    Returns:
+    --------
+    pandas.DataFrame
+        Indexed by the group keys, with columns 'WEIGHTED_SUM' and 'WEIGHT_SUM'
+    """
+    if not isinstance(df, pd.DataFrame):
+        return df.weighted_sums(value_col, weight_col, by)
+    by = [by] if isinstance(by, str) else list(by)
+
+    valid = df[value_col].notna() & df[weight_col].notna()
+    weights = df.loc[valid, weight_col]
+
+    sums = pd.DataFrame({
+        'WEIGHTED_SUM': df.loc[valid, value_col] * weights,
+        'WEIGHT_SUM': weights,
+    })
+    return sums.groupby([df.loc[valid, key] for key in by], observed=True).sum()
+
+
+def group_mean(df, value_col, by):
+    """
+    Computes the mean of `value_col` per group, ignoring missing values.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame or sqlite_backend.SqliteBookings
+        DataFrame containing the data
+    value_col : str
+        Column to average (e.g. 'AVG CONTRIBUTION')
+    by : str or list
+        Column(s) to group by
+
+    Returns:
+    --------
+    pandas.Series
+        Mean indexed by the group keys
+    """
+    if not isinstance(df, pd.DataFrame):
+        return df.mean(value_col, by)
+    return df.groupby(by, observed=True)[value_col].mean()
+
+
+def weighted_average(df, value_col, weight_col, by):
+    """
+    Computes the weighted average sum(weight * value) / sum(weight) per group in a single pass.
+
+    Gives the same numbers as np.average(values, weights=weights) applied group by group.
+    Rows with a missing value or weight are ignored, and groups whose weights sum to zero
+    get NaN instead of raising.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame or sqlite_backend.SqliteBookings
+        DataFrame containing the data
+    value_col : str
+        Column to average (e.g. 'AVG CONTRIBUTION')
+    weight_col : str
+        Column holding the weights (e.g. 'TOTAL TEU')
+    by : str or list
+        Column(s) to group by
+
+    Returns:
+    --------
+    pandas.Series
+        Weighted average indexed by the group keys
+    """
+    sums = weighted_sums(df, value_col, weight_col, by)
+    return sums['WEIGHTED_SUM'] / sums['WEIGHT_SUM'].where(sums['WEIGHT_SUM'] != 0)
@@ -0,0 +1,257 @@
+import datetime
+import gc
+import importlib
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+import pandas as pd
+
+from data_loader import load_dataset
+from report_runner import weekly_pack_specs
+from synthetic_data import DEFAULT_YEARS, SCALES, write_dataset
+
+# Times every figure builder of the weekly pack on synthetic datasets of growing size.
+# For each scale the synthetic CSV is generated once (kept in the data folder for later runs),
+# then the stages are measured one after the other:
+#   load_dataset (cold)   parse the CSV and rebuild the columnar cache
+#   load_dataset (warm)   read the columnar cache
+#   materialize_cubes     build (or read) the weekly cubes
+#   <figure name>         one entry per spec of report_runner.weekly_pack_specs
+# Wall time is the best of `repeat` plain runs; peak memory comes from one extra run under
+# tracemalloc (bytes allocated by Python and numpy on top of what was already held). Buffers
+# allocated by pyarrow are not traced, the peak resident size of the process after each scale
+# is recorded as well where the platform reports it.
+
+DEFAULT_DATA_DIR = ".vol_bench"
+DEFAULT_WEEK = 20
+
+
+def _measure(function, repeat=1, memory=True):
+    # Returns (best wall time, peak traced bytes or None, error or None)
+    seconds = []
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            seconds.append(time.perf_counter() - start)
+        peak = None
+        if memory:
+            gc.collect()
+            tracemalloc.start()
+            try:
+                function()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        return min(seconds), peak, None
+    except Exception as e:
+        return (min(seconds) if seconds else None), None, f"{type(e).__name__}: {e}"
+
+
+def _max_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, in kilobytes on Linux
+    return max_rss if platform.system() == 'Darwin' else max_rss * 1024
+
+
+def _render(builder, df, kwargs):
+    from plotting import plt
+
+    try:
+        builder(df, **kwargs)
+    finally:
+        plt.close('all')
+
+
+def _forget_datasets():
+    # Drops the in-memory datasets and cubes so every scale starts from the same state
+    import data_loader
+    import weekly_cube
+
+    data_loader._datasets.clear()
+    data_loader._dataset_info.clear()
+    weekly_cube._cubes.clear()
+    gc.collect()
+
+
+def benchmark_scale(csv_path, trades, current_year, current_week=DEFAULT_WEEK, repeat=1, memory=True):
+    """
+    Runs the stages described in the module comment on one dataset.
+
+    Returns:
+    --------
+    list
+        One dict per stage: {'name': str, 'seconds': float, 'peak_bytes': int or None, 'error': str or None}
+    """
+    from weekly_cube import materialize_cubes
+
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    _forget_datasets()
+
+    results = []
+
+    def record(name, function):
+        seconds, peak, error = _measure(function, repeat, memory)
+        results.append({'name': name, 'seconds': seconds, 'peak_bytes': peak, 'error': error})
+
+    record('load_dataset (cold)', lambda: load_dataset(csv_path, reload=True, rebuild=True))
+    record('load_dataset (warm)', lambda: load_dataset(csv_path, reload=True))
+    df = load_dataset(csv_path)
+    record('materialize_cubes', lambda: materialize_cubes(df))
+
+    for spec in weekly_pack_specs(current_year, current_week, trades):
+        module_name, function_name = spec['builder'].split(':')
+        builder = getattr(importlib.import_module(module_name), function_name)
+        record(spec['name'], lambda: _render(builder, df, spec['kwargs']))
+
+    _forget_datasets()
+    return results
+
+
+def run_benchmarks(scales=('100k', '1M'), output_path=None, data_dir=DEFAULT_DATA_DIR, years=None,
+                   current_week=DEFAULT_WEEK, repeat=1, memory=True, seed=0):
+    """
+    Benchmarks the weekly pack on synthetic datasets and saves the results as JSON.
+
+    Parameters:
+    -----------
+    scales : list
+        Keys of synthetic_data.SCALES ('100k', '1M', '10M', '50M') or row counts
+    output_path : str, optional
+        JSON file the results are written to (default: benchmark_<timestamp>.json in data_dir)
+    data_dir : str
+        Folder of the synthetic CSVs and their caches (default: .vol_bench)
+    years : list, optional
+        Years of the synthetic data (default: synthetic_data.DEFAULT_YEARS); the last one is
+        compared with the one before it
+    current_week : int
+        Week cutoff of the figures (default: 20)
+    repeat : int
+        Timed runs per stage, the best one is kept (default: 1)
+    memory : bool
+        Also measure the peak memory of each stage (default: True)
+    seed : int
+        Seed of the synthetic data
+
+    Returns:
+    --------
+    dict
+        The saved results: run metadata plus, per scale, the rows, the generation time and
+        the stage results of benchmark_scale and the peak resident size of the process so far
+    """
+    from variables import trades
+
+    if years is None:
+        years = DEFAULT_YEARS
+    os.makedirs(data_dir, exist_ok=True)
+    created = datetime.datetime.now()
+    if output_path is None:
+        output_path = os.path.join(data_dir, f"benchmark_{created:%Y%m%d_%H%M%S}.json")
+
+    report = {
+        'created': created.isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'machine': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'current_week': current_week,
+        'repeat': repeat,
+        'scales': {},
+    }
+
+    for scale in scales:
+        n_rows = SCALES[scale] if scale in SCALES else int(scale)
+        csv_path = os.path.join(data_dir, f"synthetic_{scale}_{seed}.csv")
+        generate_seconds = None
+        if not os.path.exists(csv_path):
+            start = time.perf_counter()
+            write_dataset(csv_path, n_rows, years=years, seed=seed)
+            generate_seconds = time.perf_counter() - start
+
+        report['scales'][str(scale)] = {
+            'rows': n_rows,
+            'generate_seconds': generate_seconds,
+            'results': benchmark_scale(csv_path, trades, max(years), current_week, repeat, memory),
+            'max_rss_bytes': _max_rss_bytes(),
+        }
+        # Saved after every scale so that a run killed on a big scale keeps the smaller ones
+        with open(output_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        os.replace(output_path + ".tmp", output_path)
+
+    return report
+
+
+def compare_runs(baseline_path, candidate_path):
+    """
+    Compares two saved benchmark runs stage by stage.
+
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per (scale, stage) found in both runs, with the times and peaks of both and
+        the candidate / baseline time ratio (below 1 means faster)
+    """
+    rows = []
+    runs = []
+    for path in (baseline_path, candidate_path):
+        with open(path, encoding="utf-8") as f:
+            runs.append(json.load(f))
+
+    for scale, baseline_scale in runs[0]['scales'].items():
+        candidate_scale = runs[1]['scales'].get(scale)
+        if candidate_scale is None:
+            continue
+        candidate_results = {result['name']: result for result in candidate_scale['results']}
+        for baseline in baseline_scale['results']:
+            candidate = candidate_results.get(baseline['name'])
+            if candidate is None:
+                continue
+            rows.append({
+                'scale': scale,
+                'stage': baseline['name'],
+                'baseline_seconds': baseline['seconds'],
+                'candidate_seconds': candidate['seconds'],
+                'baseline_peak_bytes': baseline['peak_bytes'],
+                'candidate_peak_bytes': candidate['peak_bytes'],
+            })
+
+    comparison = pd.DataFrame(rows, columns=['scale', 'stage', 'baseline_seconds', 'candidate_seconds',
+                                             'baseline_peak_bytes', 'candidate_peak_bytes'])
+    comparison['time_ratio'] = comparison['candidate_seconds'] / comparison['baseline_seconds']
+    return comparison
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the weekly report figures on synthetic data.")
+    parser.add_argument("--scales", nargs="+", default=['100k', '1M'],
+                        help=f"dataset sizes, among {', '.join(SCALES)} or row counts")
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    parser.add_argument("--week", type=int, default=DEFAULT_WEEK)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak memory runs")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"),
+                        help="compare two saved runs instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        print(compare_runs(*args.compare).to_string(index=False))
+    else:
+        report = run_benchmarks(args.scales, args.output, args.data_dir, current_week=args.week,
+                                repeat=args.repeat, memory=not args.no_memory)
+        for scale, scale_report in report['scales'].items():
+            print(f"{scale} ({scale_report['rows']:,} rows)")
+            for result in scale_report['results']:
+                seconds = f"{result['seconds']:.3f}s" if result['seconds'] is not None else "-"
+                peak = f"{result['peak_bytes'] / 2**20:.1f} MiB" if result['peak_bytes'] is not None else "-"
+                print(f"  {result['name']:<30} {seconds:>10} {peak:>12}  {result['error'] or ''}")
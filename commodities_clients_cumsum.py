@@ -1,10 +1,38 @@
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
-import matplotlib.gridspec as gridspec
 
-import df, current_week, current_year from variables
+from plotting import plt, gridspec
+from variables import current_week, current_year
+from weekly_cube import get_cube
+from rankings import top_n_series
+from instrumentation import instrumented, stage
 
+def commodity_cumulative_data(df, current_year, previous_year, current_week, num_commodities=12):
+    """
+    Ranks the commodities by weighted contribution YTD in the current year and returns the
+    cumulative weekly weighted contribution of the top `num_commodities` for both years.
+    
+    Returns:
+    --------
+    tuple
+        (top_commodities, current_data, previous_data): the ranked commodity list and two
+        WEEK x COMMODITY HS CHAPTER tables
+    """
+    # Weekly sums by commodity come from the precomputed cube (see weekly_cube.py).
+    # The weighted contribution is the sum of TOTAL TEU x AVG CONTRIBUTION.
+    stage('aggregate')
+    cube = get_cube(df, 'COMMODITY HS CHAPTER')
+    
+    # Rank the commodities on the current year YTD and take the weekly series of the top ones
+    # in the same pass over the cube (see rankings.py)
+    top_commodities, series = top_n_series(cube, 'COMMODITY HS CHAPTER', 'WEIGHTED', num_commodities, 
+                                           current_year, current_week, 
+                                           years=[current_year, previous_year], cumulative=True)
+    current_data, previous_data = series[current_year], series[previous_year]
+    
+    return top_commodities, current_data, previous_data
+
+@instrumented
 def plot_commodity_cumulative_comparison(df, current_year, previous_year, current_week, num_commodities=12):
     """
     Creates charts comparing cumulative evolution of the top commodities between current and previous year.
@@ -27,42 +55,12 @@ def plot_commodity_cumulative_comparison(df, current_year, previous_year, curren
     fig : matplotlib.figure.Figure
         Figure with subplots (3 rows, 4 columns for 12 commodities)
     """
-    # Ensure we have the weighted contribution column
-    if 'WEIGHTED_CONTRIB' not in df.columns:
-        df['WEIGHTED_CONTRIB'] = df['TEU'] * df['AVG CONTRIBUTION']
-    
-    # Filter data for current year up to current week
-    df_current_ytd = df[(df['YEAR'] == current_year) & 
-                        (df['WEEK'] <= current_week)]
-    
-    # Identify top commodities based on weighted contribution YTD
-    top_commodities = df_current_ytd.groupby('COMMODITY HS CHAPTER')['WEIGHTED_CONTRIB'].sum().nlargest(num_commodities).index.tolist()
-    
-    # Filter data for current and previous year
-    df_current = df[(df['YEAR'] == current_year) & 
-                   (df['WEEK'] <= current_week) & 
-                   (df['COMMODITY HS CHAPTER'].isin(top_commodities))]
-    
-    df_previous = df[(df['YEAR'] == previous_year) & 
-                    (df['WEEK'] <= current_week) & 
-                    (df['COMMODITY HS CHAPTER'].isin(top_commodities))]
-    
-    # Create pivot tables with weekly sums for each commodity
-    current_weekly = df_current.pivot_table(index='WEEK', 
-                                           values='WEIGHTED_CONTRIB', 
-                                           columns='COMMODITY HS CHAPTER', 
-                                           aggfunc='sum')
-    
-    previous_weekly = df_previous.pivot_table(index='WEEK', 
-                                             values='WEIGHTED_CONTRIB', 
-                                             columns='COMMODITY HS CHAPTER', 
-                                             aggfunc='sum')
-    
-    # Convert to cumulative sums
-    current_data = current_weekly.cumsum()
-    previous_data = previous_weekly.cumsum()
+    # Cumulative weighted contribution of the top commodities for both years
+    top_commodities, current_data, previous_data = commodity_cumulative_data(df, current_year, previous_year, 
+                                                                             current_week, num_commodities)
     
     # Create figure with 3x4 subplots for 12 commodities
+    stage('plot')
     fig = plt.figure(figsize=(20, 15))
     gs = gridspec.GridSpec(3, 4, figure=fig)  # 3 rows, 4 columns grid
     
@@ -78,8 +76,8 @@ def plot_commodity_cumulative_comparison(df, current_year, previous_year, curren
         previous_series = previous_data.get(commodity, pd.Series()).reindex(range(1, current_week+1))
         
         # Forward fill missing values for cumulative data
-        current_series = current_series.fillna(method='ffill').fillna(0)
-        previous_series = previous_series.fillna(method='ffill').fillna(0)
+        current_series = current_series.ffill().fillna(0)
+        previous_series = previous_series.ffill().fillna(0)
         
         # Plot the lines
         weeks = range(1, current_week+1)
@@ -111,16 +109,37 @@ def plot_commodity_cumulative_comparison(df, current_year, previous_year, curren
         # Format y-axis with commas for thousands
         ax.get_yaxis().set_major_formatter(plt.matplotlib.ticker.StrMethodFormatter('{x:,.0f}'))
     
+    stage('layout')
     plt.tight_layout()
     plt.suptitle(f'Top {num_commodities} Commodities: Cumulative Weighted Contribution\n{current_year} vs {previous_year}', 
                 fontsize=16, y=1.02)
     return fig
 
-  import pandas as pd
-import matplotlib.pyplot as plt
-import numpy as np
-import matplotlib.gridspec as gridspec
+def client_cumulative_data(df, current_year, previous_year, current_week, num_clients=21):
+    """
+    Ranks the clients by weighted contribution YTD in the current year and returns the
+    cumulative weekly weighted contribution of the top `num_clients` for both years.
+    
+    Returns:
+    --------
+    tuple
+        (top_clients, current_data, previous_data): the ranked client list and two
+        WEEK x CLEAN BUSINESS PARTNER tables
+    """
+    # Weekly sums by client come from the precomputed cube (see weekly_cube.py)
+    stage('aggregate')
+    cube = get_cube(df, 'CLEAN BUSINESS PARTNER')
+    
+    # Rank the clients on the current year YTD and take the weekly series of the top ones
+    # in the same pass over the cube (see rankings.py)
+    top_clients, series = top_n_series(cube, 'CLEAN BUSINESS PARTNER', 'WEIGHTED CONTRIB', num_clients, 
+                                       current_year, current_week, 
+                                       years=[current_year, previous_year], cumulative=True)
+    current_data, previous_data = series[current_year], series[previous_year]
+    
+    return top_clients, current_data, previous_data
 
+@instrumented
 def plot_client_cumulative_comparison(df, current_year, previous_year, current_week, num_clients=21):
     """
     Creates charts comparing cumulative evolution of the top clients between current and previous year.
@@ -143,37 +162,11 @@ def plot_client_cumulative_comparison(df, current_year, previous_year, current_w
     fig : matplotlib.figure.Figure
         Figure with subplots (3 rows, 7 columns for 21 clients)
     """
-    # Filter data for current year up to current week
-    df_current_ytd = df[(df['YEAR'] == current_year) & 
-                        (df['WEEK'] <= current_week)]
-    
-    # Identify top clients based on weighted contribution YTD
-    top_clients = df_current_ytd.groupby('CLEAN BUSINESS PARTNER')['WEIGHTED CONTRIB'].sum().nlargest(num_clients).index.tolist()
-    
-    # Filter data for current and previous year
-    df_current = df[(df['YEAR'] == current_year) & 
-                   (df['WEEK'] <= current_week) & 
-                   (df['CLEAN BUSINESS PARTNER'].isin(top_clients))]
-    
-    df_previous = df[(df['YEAR'] == previous_year) & 
-                    (df['WEEK'] <= current_week) & 
-                    (df['CLEAN BUSINESS PARTNER'].isin(top_clients))]
-    
-    # Create pivot tables with weekly sums for each client
-    current_weekly = df_current.pivot_table(index='WEEK', 
-                                           values='WEIGHTED CONTRIB', 
-                                           columns='CLEAN BUSINESS PARTNER', 
-                                           aggfunc='sum')
-    
-    previous_weekly = df_previous.pivot_table(index='WEEK', 
-                                             values='WEIGHTED CONTRIB', 
-                                             columns='CLEAN BUSINESS PARTNER', 
-                                             aggfunc='sum')
-    
-    # Convert to cumulative sums
-    current_data = current_weekly.cumsum()
-    previous_data = previous_weekly.cumsum()
+    # Cumulative weighted contribution of the top clients for both years
+    top_clients, current_data, previous_data = client_cumulative_data(df, current_year, previous_year, 
+                                                                      current_week, num_clients)
     
+    stage('plot')
     # Calculate the new width while maintaining the same height
     # Original was 20x15 for 15 items (3x5 grid)
     # For 21 items (3x7 grid), increase width proportionally
@@ -199,8 +192,8 @@ def plot_client_cumulative_comparison(df, current_year, previous_year, current_w
         previous_series = previous_data.get(client, pd.Series()).reindex(range(1, current_week+1))
         
         # Forward fill missing values for cumulative data
-        current_series = current_series.fillna(method='ffill').fillna(0)
-        previous_series = previous_series.fillna(method='ffill').fillna(0)
+        current_series = current_series.ffill().fillna(0)
+        previous_series = previous_series.ffill().fillna(0)
         
         # Plot the lines
         weeks = range(1, current_week+1)
@@ -234,6 +227,7 @@ def plot_client_cumulative_comparison(df, current_year, previous_year, current_w
         # Format y-axis with commas for thousands
         ax.get_yaxis().set_major_formatter(plt.matplotlib.ticker.StrMethodFormatter('{x:,.0f}'))
     
+    stage('layout')
     plt.tight_layout()
     plt.suptitle(f'Top {num_clients} Clients: Cumulative Weighted Contribution', 
                 fontsize=16, y=1.02)
@@ -241,4 +235,4 @@ def plot_client_cumulative_comparison(df, current_year, previous_year, current_w
 
 
 # Example usage:
-# fig = plot_client_cumulative_comparison(df, current_year, current_year-1, current_week)
+# fig = plot_client_cumulative_comparison(config.dataset, current_year, current_year-1, current_week)
@@ -0,0 +1,117 @@
+import pandas as pd
+
+from weekly_cube import measure_column
+
+# Comparison of any number of years on the weekly cube (see weekly_cube.py):
+#
+#     cube = get_cube(df)
+#     series = year_matrices(cube, [2025, 2024, 2023], 20, 'TEU', cumulative=True, total='TOTAL')
+#     series[2025]['EUR-US']                     # YTD TEU of EUR-US in 2025, weeks 1 to 20
+#     deltas = year_deltas(series)               # deltas[2025] = series[2025] - series[2024]
+#
+# All the years come out of one grouped pass over the cube rows keyed by YEAR, then are split
+# into WEEK x category matrices sharing the same weeks (1 to max_week) and the same columns,
+# so they overlay and subtract directly. Asking for more years only adds rows to that pass.
+
+# Measures computed as the ratio of two cube sums, e.g. the TEU-weighted average contribution
+RATIO_MEASURES = {'WEIGHTED AVG': ('WEIGHTED_SUM', 'WEIGHT_SUM')}
+
+
+def year_matrices(cube, years, max_week, measure, columns='TRADE', keys=None, cumulative=False, total=None):
+    """
+    Returns WEEK x `columns` matrices of `measure` for each year of `years`.
+
+    Parameters:
+    -----------
+    cube : pandas.DataFrame
+        Cube returned by get_cube, already filtered on anything else (e.g. OUT OF SCOPE)
+    years : list
+        Years to compare, in any number
+    max_week : int
+        Last week of the matrices
+    measure : str
+        Cube column or alias (see weekly_cube.MEASURE_ALIASES), or a ratio of RATIO_MEASURES
+    columns : str
+        Cube column spread across the matrix columns (default: 'TRADE')
+    keys : list, optional
+        Columns to keep, in this order (default: every value of `columns` found in any year)
+    cumulative : bool
+        Return YTD values instead of weekly ones (default: False); ratios are then computed
+        on the YTD sums
+    total : str, optional
+        Label of an extra column holding the total over all the values of `columns` (the
+        overall ratio for ratio measures), including the ones not in `keys`
+
+    Returns:
+    --------
+    dict
+        year -> DataFrame indexed by WEEK from 1 to `max_week`, with the same columns (as str)
+        for every year. Weekly values are NaN for weeks without data; YTD values carry the
+        last value forward (0 before the first week with data).
+    """
+    years = list(dict.fromkeys(int(year) for year in years))
+    parts = RATIO_MEASURES.get(measure, (measure_column(measure),))
+
+    rows = cube[cube['YEAR'].isin(years) & (cube['WEEK'] <= max_week)]
+    grouped = rows.groupby(['YEAR', 'WEEK', columns], observed=True)[list(parts)].sum(min_count=1)
+    wide = grouped.unstack(columns)
+    # Every year gets every week, in the order asked for
+    wide = wide.reindex(pd.MultiIndex.from_product([years, range(1, max_week + 1)], names=['YEAR', 'WEEK']))
+
+    sums = {}
+    for part in parts:
+        values = wide[part] if part in wide.columns.get_level_values(0) else pd.DataFrame(index=wide.index)
+        values.columns = values.columns.astype(str)
+        if total is not None:
+            values = values.assign(**{total: values.sum(axis=1, min_count=1)})
+        if keys is not None:
+            values = values.reindex(columns=list(keys) + ([total] if total is not None else []))
+        if cumulative:
+            by_year = values.groupby(level='YEAR', sort=False)
+            values = by_year.cumsum().groupby(level='YEAR', sort=False).ffill().fillna(0)
+        sums[part] = values
+
+    if len(parts) == 2:
+        numerator, denominator = sums[parts[0]], sums[parts[1]]
+        values = numerator / denominator.where(denominator != 0)
+    else:
+        values = sums[parts[0]]
+    values.columns.name = columns
+
+    return {year: values.xs(year, level='YEAR') for year in years}
+
+
+def year_deltas(matrices, relative=False):
+    """
+    Returns the year-over-year differences of matrices returned by year_matrices.
+
+    Parameters:
+    -----------
+    matrices : dict
+        year -> WEEK x category matrix, all aligned
+    relative : bool
+        Return the change in % of the previous year instead of the difference (default:
+        False); NaN where the previous year is 0
+
+    Returns:
+    --------
+    dict
+        year -> matrix of the year minus the one of the year before it, for every year but the
+        earliest
+    """
+    years = sorted(matrices)
+    deltas = {}
+    for previous, year in zip(years, years[1:]):
+        delta = matrices[year] - matrices[previous]
+        if relative:
+            delta = delta / matrices[previous].where(matrices[previous] != 0) * 100
+        deltas[year] = delta
+    return deltas
+
+
+def stack_years(matrices):
+    """
+    Puts the matrices of year_matrices or year_deltas side by side in one table, with
+    (YEAR, category) columns.
+    """
+    return pd.concat(matrices, axis=1, names=['YEAR'])
@@ -1,10 +1,36 @@
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
-import matplotlib.gridspec as gridspec
 
-from variables import trades, current_year, current_week, df
+from plotting import plt, gridspec
+from variables import trades, current_year, current_week, config
+from weekly_cube import get_cube
+from comparisons import RATIO_MEASURES, year_matrices, year_deltas, stack_years
+from instrumentation import instrumented, stage
 
+def cumulative_comparison_data(df, current_year, previous_year, current_week, metric_type='TEU'):
+    """
+    Returns the cumulative weekly sums of `metric_type` ('TEU', 'TONS' or 'WEIGHTED', see
+    plot_cumulative_comparison) by trade of both years, plus a TOTAL column.
+    
+    Returns:
+    --------
+    tuple
+        (current_data, previous_data), WEEK x TRADE tables
+    """
+    # Weekly sums by trade come from the precomputed cube (see weekly_cube.py).
+    # For WEIGHTED the cube holds the sum of TOTAL TEU x AVG CONTRIBUTION.
+    stage('aggregate')
+    cube = get_cube(df)
+    cube = cube[cube['TRADE'] != "OUT OF SCOPE"]
+    
+    # Cumulative sums of both years in one pass, with the total over all trades (see comparisons.py)
+    series = year_matrices(cube, [current_year, previous_year], current_week, metric_type, 
+                           cumulative=True, total='TOTAL')
+    current_data, previous_data = series[current_year], series[previous_year]
+    
+    return current_data, previous_data
+
+@instrumented
 def plot_cumulative_comparison(df, current_year, previous_year, current_week, trades, metric_type='TEU'):
     """
     Creates 6 charts comparing cumulative evolution between current and previous year.
@@ -23,64 +49,24 @@ def plot_cumulative_comparison(df, current_year, previous_year, current_week, tr
         List of trade names to analyze
     metric_type : str
         Type of metric to analyze:
-        - 'TEU': Cumulative sum of TEUs
+        - 'TEU': Cumulative sum of TEUs (TOTAL TEU)
         - 'TONS': Cumulative sum of tons
-        - 'WEIGHTED': Weighted contribution (TEU x AVG CONTRIBUTION)
+        - 'WEIGHTED': Weighted contribution (TOTAL TEU x AVG CONTRIBUTION)
     
     Returns:
     --------
     fig : matplotlib.figure.Figure
         Figure with 6 subplots (5 trades + total)
     """
-    # Determine the column(s) based on metric type
-    if metric_type == 'WEIGHTED':
-        # For weighted contribution, we'll need both TEU and AVG CONTRIBUTION
-        value_col = 'WEIGHTED_CONTRIB'
-        # Create weighted contribution if it doesn't exist
-        if 'WEIGHTED_CONTRIB' not in df.columns:
-            df['WEIGHTED_CONTRIB'] = df['TEU'] * df['AVG CONTRIBUTION']
-    else:
-        # For TEU or TONS, use the column directly
-        value_col = metric_type
-    
-    # Filter data for current and previous year
-    df_current = df[(df['YEAR'] == current_year) & 
-                   (df['WEEK'] <= current_week) & 
-                   (df['TRADE'] != "OUT OF SCOPE")]
-    
-    df_previous = df[(df['YEAR'] == previous_year) & 
-                    (df['WEEK'] <= current_week) & 
-                    (df['TRADE'] != "OUT OF SCOPE")]
-    
-    # Create pivot tables with weekly sums
-    current_weekly = df_current.pivot_table(index='WEEK', 
-                                           values=value_col, 
-                                           columns='TRADE', 
-                                           aggfunc='sum')
-    
-    previous_weekly = df_previous.pivot_table(index='WEEK', 
-                                             values=value_col, 
-                                             columns='TRADE', 
-                                             aggfunc='sum')
-    
-    # Convert to cumulative sums
-    current_data = current_weekly.cumsum()
-    previous_data = previous_weekly.cumsum()
-    
-    # Create a total column for both years if not already present
-    if 'TOTAL' not in current_data.columns and not current_data.empty:
-        # For total, sum across trades for each week
-        current_total = current_weekly.sum(axis=1).cumsum()
-        current_data['TOTAL'] = current_total
-    
-    if 'TOTAL' not in previous_data.columns and not previous_data.empty:
-        previous_total = previous_weekly.sum(axis=1).cumsum()
-        previous_data['TOTAL'] = previous_total
+    # Cumulative sums by trade for both years
+    current_data, previous_data = cumulative_comparison_data(df, current_year, previous_year, current_week, 
+                                                             metric_type)
     
     # Add TOTAL to the list of trades for plotting
     all_categories = trades + ['TOTAL']
     
     # Create figure with 6 subplots (5 trades + total)
+    stage('plot')
     fig = plt.figure(figsize=(20, 15))
     gs = gridspec.GridSpec(3, 2, figure=fig)  # 3 rows, 2 columns grid
     
@@ -99,8 +85,8 @@ def plot_cumulative_comparison(df, current_year, previous_year, current_week, tr
         previous_series = previous_data.get(trade, pd.Series()).reindex(range(1, current_week+1))
         
         # Forward fill missing values for cumulative data (more appropriate than interpolation)
-        current_series = current_series.fillna(method='ffill').fillna(0)
-        previous_series = previous_series.fillna(method='ffill').fillna(0)
+        current_series = current_series.ffill().fillna(0)
+        previous_series = previous_series.ffill().fillna(0)
         
         # Plot the lines
         weeks = range(1, current_week+1)
@@ -131,6 +117,7 @@ def plot_cumulative_comparison(df, current_year, previous_year, current_week, tr
         # Format y-axis with commas for thousands
         ax.get_yaxis().set_major_formatter(plt.matplotlib.ticker.StrMethodFormatter('{x:,.0f}'))
     
+    stage('layout')
     plt.tight_layout()
     plt.suptitle(f'Cumulative {title_metric} by Trade: {current_year} vs {previous_year}', 
                 fontsize=16, y=1.02)
@@ -138,16 +125,19 @@ def plot_cumulative_comparison(df, current_year, previous_year, current_week, tr
 
 # Example usage for TEU or TONS
 """
+# Only the two compared years up to the current week are read from the partitioned cache
+ytd_df = config.use(years=[current_year, current_year-1], max_week=current_week).dataset
+
 # For TEU cumulative analysis
-fig_teu = plot_cumulative_comparison(df, current_year, current_year-1, current_week, trades, 'TEU')
+fig_teu = plot_cumulative_comparison(ytd_df, current_year, current_year-1, current_week, trades, 'TEU')
 plt.show()
 
 # For TONS cumulative analysis
-fig_tons = plot_cumulative_comparison(df, current_year, current_year-1, current_week, trades, 'TONS')
+fig_tons = plot_cumulative_comparison(ytd_df, current_year, current_year-1, current_week, trades, 'TONS')
 plt.show()
 
 # For weighted contribution analysis (TEU × AVG CONTRIBUTION)
-fig_weighted = plot_cumulative_comparison(df, current_year, current_year-1, current_week, trades, 'WEIGHTED')
+fig_weighted = plot_cumulative_comparison(ytd_df, current_year, current_year-1, current_week, trades, 'WEIGHTED')
 plt.show()
 """
 
@@ -162,3 +152,107 @@ def plot_weighted_contribution(df, current_year, previous_year, current_week, tr
     return plot_cumulative_comparison(df, current_year, previous_year, current_week, trades, 'WEIGHTED')
 
   
+# Colors of the years in the multi-year charts, latest year first (then cycled)
+year_colors = ['#0D173F', '#FF0000', '#48A6A7', '#7886C7', '#F2A900']
+
+def multi_year_comparison_data(df, years, current_week, metric_type='TEU', cumulative=True):
+    """
+    Returns the weekly (or cumulative) `metric_type` by trade of every year of `years`, plus a
+    TOTAL column, and the year-over-year deltas, computed in one pass over the cube.
+    
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        DataFrame containing the trade data
+    years : list
+        Years to compare, e.g. [2025, 2024, 2023]
+    current_week : int
+        Maximum week number to include in analysis
+    metric_type : str
+        'TEU', 'TONS', 'WEIGHTED' (see plot_cumulative_comparison) or 'WEIGHTED AVG' (TEU-weighted
+        average contribution)
+    cumulative : bool
+        YTD values instead of weekly ones (default: True)
+    
+    Returns:
+    --------
+    tuple
+        (values, deltas), WEEK x (YEAR, TRADE) tables; deltas holds each year minus the year
+        before it
+    """
+    stage('aggregate')
+    cube = get_cube(df)
+    cube = cube[cube['TRADE'] != "OUT OF SCOPE"]
+    
+    series = year_matrices(cube, years, current_week, metric_type, cumulative=cumulative, total='TOTAL')
+    return stack_years(series), stack_years(year_deltas(series))
+
+@instrumented
+def plot_multi_year_comparison(df, years, current_week, trades, metric_type='TEU', cumulative=True):
+    """
+    Creates 6 charts overlaying the weekly (or cumulative) evolution of any number of years.
+    
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        DataFrame containing the trade data
+    years : list
+        Years to overlay, e.g. [2025, 2024, 2023]
+    current_week : int
+        Maximum week number to include in analysis
+    trades : list
+        List of trade names to analyze
+    metric_type : str
+        See multi_year_comparison_data
+    cumulative : bool
+        YTD values instead of weekly ones (default: True)
+    
+    Returns:
+    --------
+    fig : matplotlib.figure.Figure
+        Figure with 6 subplots (5 trades + total)
+    """
+    values, _ = multi_year_comparison_data(df, years, current_week, metric_type, cumulative)
+    years = sorted(values.columns.get_level_values('YEAR').unique(), reverse=True)
+    
+    if metric_type == 'WEIGHTED':
+        title_metric = 'Weighted Contribution (TEU × Contribution)'
+    elif metric_type == 'WEIGHTED AVG':
+        title_metric = 'Weighted Avg Contribution'
+    else:
+        title_metric = metric_type
+    if cumulative:
+        title_metric = f'Cumulative {title_metric}'
+    # Ratios such as the weighted average contribution are in the tens, keep their decimals
+    tick_format = '{x:,.2f}' if metric_type in RATIO_MEASURES else '{x:,.0f}'
+    
+    stage('plot')
+    fig = plt.figure(figsize=(20, 15))
+    gs = gridspec.GridSpec(3, 2, figure=fig)
+    weeks = values.index
+    
+    for i, trade in enumerate(trades + ['TOTAL']):
+        ax = fig.add_subplot(gs[i//2, i%2])
+        
+        # Latest year on top
+        for year_idx, year in reversed(list(enumerate(years))):
+            series = values[year].get(trade, pd.Series(index=weeks, dtype=float))
+            ax.plot(weeks, series, marker='o', markersize=3, linewidth=2 if year_idx == 0 else 1.5, 
+                    label=f'{year}', color=year_colors[year_idx % len(year_colors)])
+        
+        ax.set_title(f'{trade} - {title_metric}', fontsize=12, fontweight='bold')
+        ax.grid(True, alpha=0.3)
+        ax.legend(loc='best')
+        ax.set_xticks(range(1, current_week+1, 2))
+        ax.set_xlabel('Week')
+        ax.set_ylabel(title_metric)
+        ax.get_yaxis().set_major_formatter(plt.matplotlib.ticker.StrMethodFormatter(tick_format))
+    
+    stage('layout')
+    plt.tight_layout()
+    plt.suptitle(f'{title_metric} by Trade: {", ".join(str(year) for year in years)}', fontsize=16, y=1.02)
+    return fig
+
+if __name__ == "__main__":
+    fig = plot_multi_year_comparison(config.dataset, [current_year, current_year-1, current_year-2], current_week, trades)
+    plt.show()
@@ -0,0 +1,714 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+from instrumentation import measure
+
+# Shared loader for vol_contrib_data.csv.
+# The extract is parsed once per process and every analysis function receives the same DataFrame.
+# After the first parse a typed columnar copy is kept next to the CSV and reused until the CSV
+# changes. The copy is a hive-style Parquet directory partitioned by YEAR and WEEK
+# (YEAR=2024/WEEK=5/...), so year/week filters only read the partitions they need.
+# When the CSV changes, only the partitions whose content changed are rewritten.
+# The string columns are dictionary-encoded (categoricals) against code tables kept in the cache
+# folder, so a label keeps the same integer code in every extract and aggregates of different
+# extracts line up by code. Labels are only looked up when a chart or a table shows them.
+
+COLUMN_NAMES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "column_names.txt")
+
+# Columns that are grouped or filtered on in the charts, stored as categoricals
+CATEGORICAL_COLUMNS = ['TRADE', 'EQUIPMENT', 'COMMODITY HS CHAPTER', 'CLEAN BUSINESS PARTNER']
+
+# Columns dictionary-encoded against persistent code tables (see encode_columns): the grouped
+# columns above plus the identifiers, which otherwise hold one string per row
+ENCODED_COLUMNS = CATEGORICAL_COLUMNS + ['BUSINESS PARTNER', 'POL', 'POD', 'ZOL', 'ZOD', 'VESSEL',
+                                         'VOYAGE REFERENCE', 'COMMODITY', 'BOOKING REFERENCE']
+
+# Folder of the code tables, inside the cache folder
+CODE_TABLES_DIR_NAME = "code_tables"
+
+# Period columns fit in small integers (years < 32768, weeks <= 53)
+INTEGER_COLUMNS = {'YEAR': 'int16', 'WEEK': 'int8'}
+
+# Partition keys of the columnar cache, outermost first
+PARTITION_COLUMNS = ['YEAR', 'WEEK']
+
+# Numeric measures
+FLOAT_COLUMNS = ['TEU (WITHOUT LS)', 'TOTAL TEU', 'TONS', 'AVG CONTRIBUTION', 'WEIGHTED CONTRIB']
+
+# Default location of the columnar cache, relative to the CSV's folder
+CACHE_DIR_NAME = ".vol_cache"
+
+# Set to 1 to rebuild the columnar cache on the next load
+REBUILD_ENV_VAR = "VOL_CACHE_REBUILD"
+
+# Process-wide datasets, keyed by (absolute CSV path, partition selection)
+_datasets = {}
+
+# Version and cache folder of each loaded dataset, same keys as _datasets
+_dataset_info = {}
+
+# Code tables read in this process, keyed by (code table folder or None, column)
+_code_tables = {}
+
+
+def read_column_names(path=COLUMN_NAMES_PATH):
+    """
+    Returns the list of columns of the extract, as listed in column_names.txt.
+    """
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def build_schema(columns=None):
+    """
+    Builds the dtype mapping passed to pd.read_csv.
+
+    Parameters:
+    -----------
+    columns : list, optional
+        Column names of the extract (default: read from column_names.txt)
+
+    Returns:
+    --------
+    dict
+        Column name -> dtype for every typed column present in `columns`
+    """
+    if columns is None:
+        columns = read_column_names()
+
+    schema = {}
+    for column in columns:
+        if column in ENCODED_COLUMNS:
+            schema[column] = 'category'
+        elif column in INTEGER_COLUMNS:
+            schema[column] = INTEGER_COLUMNS[column]
+        elif column in FLOAT_COLUMNS:
+            schema[column] = 'float64'
+    return schema
+
+
+def file_fingerprint(path, block_size=1 << 20, known=None):
+    """
+    Returns the size, modification time and SHA-256 of a file.
+
+    Parameters:
+    -----------
+    path : str
+        File to fingerprint
+    block_size : int
+        Number of bytes hashed at a time (default: 1 MiB)
+    known : dict, optional
+        Earlier fingerprint of the file; its SHA-256 is reused without reading the file when
+        the size and modification time are unchanged
+
+    Returns:
+    --------
+    dict
+        {'size': int, 'mtime_ns': int, 'sha256': str}
+    """
+    stat = os.stat(path)
+    if known and known.get('size') == stat.st_size and known.get('mtime_ns') == stat.st_mtime_ns \
+            and known.get('sha256'):
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': known['sha256']}
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+
+
+@contextmanager
+def cache_lock(path, shared=False):
+    """
+    Holds an advisory lock on `path` (created if needed) while the block runs.
+
+    Processes sharing a cache folder take the lock exclusively to write the cache and shared to
+    read it, so a reader never sees a half-written cache. Shared locks are only available on
+    POSIX systems; on Windows every lock is exclusive.
+    """
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    # Blocks for up to 10 s, then raises, try again
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def cache_paths(csv_path, cache_dir=None):
+    """
+    Returns the (partitioned data folder, metadata file) paths of the columnar cache for `csv_path`.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(csv_path)), CACHE_DIR_NAME)
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(cache_dir, stem), os.path.join(cache_dir, stem + ".json")
+
+
+def read_csv_typed(csv_path):
+    """
+    Parses the CSV extract with the dtype schema.
+    """
+    return pd.read_csv(csv_path, encoding="latin1", dtype=build_schema())
+
+
+def _code_table_path(tables_dir, column):
+    return os.path.join(tables_dir, column.lower().replace(" ", "_") + ".json")
+
+
+def _tables_dir(cache_dir):
+    return os.path.join(os.path.abspath(cache_dir), CODE_TABLES_DIR_NAME) if cache_dir is not None else None
+
+
+def _read_code_table(tables_dir, column):
+    if tables_dir is not None:
+        try:
+            with open(_code_table_path(tables_dir, column), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+    return []
+
+
+def code_dtype(column, cache_dir=None, min_size=0):
+    """
+    Returns the categorical dtype of `column`, whose categories are its code table: the label
+    of code i is code_dtype(column).categories[i].
+
+    Parameters:
+    -----------
+    column : str
+        One of ENCODED_COLUMNS
+    cache_dir : str, optional
+        Cache folder holding the code tables (default: no folder, the table only lives in
+        this process)
+    min_size : int
+        Number of labels the table must have; a shorter table known to this process is read
+        again from the cache folder, where another process may have extended it (default: 0)
+
+    Returns:
+    --------
+    pandas.CategoricalDtype
+        Labels seen so far, none for a new table. The same object is returned until the table
+        grows, so columns encoded with it are recognised without comparing the labels.
+    """
+    tables_dir = _tables_dir(cache_dir)
+    key = (tables_dir, column)
+    if key not in _code_tables or len(_code_tables[key].categories) < min_size:
+        labels = _read_code_table(tables_dir, column)
+        if key not in _code_tables or len(labels) > len(_code_tables[key].categories):
+            _code_tables[key] = pd.CategoricalDtype(pd.Index(labels, dtype=str))
+    return _code_tables[key]
+
+
+def _extend_code_table(column, cache_dir, new_labels):
+    # Appends labels at the end of the table, so existing codes never change. The table is read
+    # again first so the labels added by other processes are kept
+    tables_dir = _tables_dir(cache_dir)
+    known = code_dtype(column, cache_dir).categories
+    on_disk = _read_code_table(tables_dir, column)
+    if len(on_disk) > len(known):
+        known = pd.Index(on_disk, dtype=str)
+    new_labels = [label for label in new_labels if label not in known]
+    if not new_labels:
+        return code_dtype(column, cache_dir, min_size=len(known))
+    labels = known.append(pd.Index(new_labels, dtype=str))
+    if tables_dir is not None:
+        os.makedirs(tables_dir, exist_ok=True)
+        path = _code_table_path(tables_dir, column)
+        with open(path + f".{os.getpid()}.tmp", "w", encoding="utf-8") as f:
+            json.dump(labels.tolist(), f)
+        os.replace(path + f".{os.getpid()}.tmp", path)
+    _code_tables[(tables_dir, column)] = pd.CategoricalDtype(labels)
+    return _code_tables[(tables_dir, column)]
+
+
+def encode_columns(df, cache_dir=None, columns=ENCODED_COLUMNS):
+    """
+    Dictionary-encodes the string columns of `df` against their code tables, in place.
+
+    Each column becomes a categorical whose categories are the whole code table of the column,
+    so the integer codes (df[column].cat.codes) are the same in every dataset encoded with the
+    same tables. Labels not seen before are added at the end of the table (in sorted order)
+    and the table is saved.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        DataFrame with some of `columns`, as strings or categoricals
+    cache_dir : str, optional
+        Cache folder holding the code tables (see code_dtype)
+    columns : list
+        Columns to encode (default: ENCODED_COLUMNS)
+
+    Returns:
+    --------
+    df : pandas.DataFrame
+        The same DataFrame
+    """
+    for column in columns:
+        if column not in df.columns:
+            continue
+        values = df[column]
+        dtype = code_dtype(column, cache_dir)
+        if values.dtype is dtype:
+            continue
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            present = values.cat.categories
+        else:
+            present = pd.Index(values.dropna().unique())
+        new_labels = present.difference(dtype.categories, sort=False)
+        if len(new_labels):
+            dtype = _extend_code_table(column, cache_dir, sorted(new_labels.astype(str)))
+        df[column] = pd.Categorical(values, dtype=dtype)
+    return df
+
+
+def _encoded_as_codes(df):
+    # Replaces the encoded columns by their integer codes (-1 for missing) for storage
+    codes = {column: df[column].cat.codes.astype('int32') for column in ENCODED_COLUMNS
+             if column in df.columns and isinstance(df[column].dtype, pd.CategoricalDtype)}
+    return df.assign(**codes) if codes else df
+
+
+def _decode_codes(df, cache_dir):
+    # Turns the integer codes stored by write_partitioned back into categoricals. Codes beyond the
+    # table known to this process were added by another one, the table is then read again
+    for column in ENCODED_COLUMNS:
+        if column in df.columns and pd.api.types.is_integer_dtype(df[column].dtype):
+            codes = df[column].to_numpy()
+            size = int(codes.max()) + 1 if len(codes) else 0
+            dtype = code_dtype(column, cache_dir, min_size=size)
+            if len(dtype.categories) < size:
+                raise ValueError(f"Code table of {column} has {len(dtype.categories)} labels, "
+                                 f"the cache uses code {size - 1}; rebuild the cache")
+            df[column] = pd.Categorical.from_codes(codes, dtype=dtype)
+    return df
+
+
+def read_cache_metadata(csv_path, cache_dir=None):
+    """
+    Returns the metadata recorded with the columnar cache of `csv_path`, or None.
+
+    Returns:
+    --------
+    dict or None
+        {'fingerprint': dict, 'partitions': dict of partition key -> fingerprint}
+    """
+    return _read_cache_metadata(cache_paths(csv_path, cache_dir)[1])
+
+
+def _read_cache_metadata(meta_path):
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _partitioning():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    return ds.partitioning(pa.schema([(column, pa.from_numpy_dtype(INTEGER_COLUMNS[column]))
+                                      for column in PARTITION_COLUMNS]), flavor="hive")
+
+
+def partition_filter(years=None, min_week=None, max_week=None):
+    """
+    Builds the pyarrow filter expression matching the requested YEAR/WEEK partitions.
+
+    Returns None when no restriction is requested.
+    """
+    import pyarrow.dataset as ds
+
+    expression = None
+    conditions = []
+    if years is not None:
+        conditions.append(ds.field('YEAR').isin([int(year) for year in years]))
+    if min_week is not None:
+        conditions.append(ds.field('WEEK') >= int(min_week))
+    if max_week is not None:
+        conditions.append(ds.field('WEEK') <= int(max_week))
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def partition_key(year, week):
+    """
+    Returns the key used for the YEAR/WEEK partition in partition hashes, e.g. '2024-05'.
+    """
+    return f"{int(year)}-{int(week):02d}"
+
+
+def partition_hashes(df):
+    """
+    Fingerprints the content of every YEAR/WEEK partition of `df`.
+
+    The fingerprint of a partition is its row count plus the sum of the row hashes, so it does
+    not depend on the row order.
+
+    Returns:
+    --------
+    dict
+        Partition key (see partition_key) -> fingerprint string
+    """
+    row_hashes = pd.util.hash_pandas_object(df, index=False)
+    grouped = row_hashes.groupby([df['YEAR'], df['WEEK']]).agg(['count', 'sum'])
+    return {partition_key(year, week): f"{count}:{total:016x}"
+            for (year, week), count, total in zip(grouped.index, grouped['count'], grouped['sum'])}
+
+
+def changed_partitions(old_hashes, new_hashes):
+    """
+    Compares two partition_hashes results.
+
+    Returns:
+    --------
+    changed : list
+        Keys of partitions that are new or whose content changed
+    removed : list
+        Keys of partitions that no longer exist
+    """
+    changed = sorted(key for key, value in new_hashes.items() if old_hashes.get(key) != value)
+    removed = sorted(key for key in old_hashes if key not in new_hashes)
+    return changed, removed
+
+
+def partition_mask(df, keys):
+    """
+    Returns the boolean mask of the rows of `df` belonging to the partitions in `keys`.
+    """
+    period = df['YEAR'].astype('int32') * 100 + df['WEEK'].astype('int32')
+    wanted = [int(key.split("-")[0]) * 100 + int(key.split("-")[1]) for key in keys]
+    return period.isin(wanted)
+
+
+def write_partitioned(df, root, partitions=None, removed=()):
+    """
+    Writes `df` as a YEAR/WEEK hive-partitioned Parquet directory.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Typed DataFrame of the whole extract, its ENCODED_COLUMNS encoded (see encode_columns)
+        with the code tables of the cache folder holding `root`
+    root : str
+        Destination folder
+    partitions : list, optional
+        Keys of the only partitions to (re)write, keeping the others in place
+        (default: replace the whole directory)
+    removed : list
+        Keys of partitions to delete, used with `partitions`
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    # Encoded columns are stored as their codes, the labels stay in the code tables
+    df = _encoded_as_codes(df)
+
+    if partitions is not None:
+        table = pa.Table.from_pandas(df[partition_mask(df, partitions)], preserve_index=False)
+        ds.write_dataset(table, root, format="parquet", partitioning=_partitioning(),
+                         basename_template="part-{i}.parquet", preserve_order=True,
+                         existing_data_behavior="delete_matching")
+        for key in removed:
+            year, week = key.split("-")
+            shutil.rmtree(os.path.join(root, f"YEAR={int(year)}", f"WEEK={int(week)}"), ignore_errors=True)
+        return
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    # Write next to the target first so an interrupted build never looks like a valid cache.
+    # Temporary names are per process, in case a cache is written without holding cache_lock
+    tmp_root = f"{root}.{os.getpid()}.tmp"
+    old_root = f"{root}.{os.getpid()}.old"
+    shutil.rmtree(tmp_root, ignore_errors=True)
+    ds.write_dataset(table, tmp_root, format="parquet", partitioning=_partitioning(),
+                     basename_template="part-{i}.parquet", preserve_order=True)
+    if os.path.isdir(root):
+        os.replace(root, old_root)
+    os.replace(tmp_root, root)
+    shutil.rmtree(old_root, ignore_errors=True)
+
+
+def read_partitioned(root, years=None, min_week=None, max_week=None, columns=None, memory_map=True):
+    """
+    Reads the requested YEAR/WEEK partitions of a partitioned Parquet directory.
+
+    Parameters:
+    -----------
+    root : str
+        Folder written by write_partitioned
+    years : list, optional
+        Years to read (default: all)
+    min_week, max_week : int, optional
+        Inclusive week range to read (default: all weeks)
+    columns : list, optional
+        Columns to read (default: all, in the extract's order)
+    memory_map : bool
+        Memory-map the Parquet files (default: True)
+
+    Returns:
+    --------
+    df : pandas.DataFrame
+        Typed DataFrame with the rows of the selected partitions only, the encoded columns
+        decoded with the code tables of the cache folder holding `root`
+    """
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    dataset = ds.dataset(root, format="parquet", partitioning=_partitioning(),
+                         filesystem=fs.LocalFileSystem(use_mmap=memory_map))
+    if columns is None:
+        # Partition keys come last in the dataset schema, restore the extract's column order
+        columns = [name for name in read_column_names() if name in dataset.schema.names]
+        columns += [name for name in dataset.schema.names if name not in columns]
+    table = dataset.to_table(columns=columns, filter=partition_filter(years, min_week, max_week))
+    return _decode_codes(table.to_pandas(), os.path.dirname(os.path.abspath(root)))
+
+
+def load_cached(csv_path, cache_dir=None, rebuild=False, years=None, min_week=None, max_week=None,
+                memory_map=True, fingerprint=None):
+    """
+    Loads the extract from its columnar cache, (re)building the cache from the CSV when needed.
+
+    The cache is rebuilt when it does not exist, when `rebuild` is True, or when the CSV's
+    size, modification time or content hash differ from the ones recorded at build time.
+    Unless `rebuild` is True, only the partitions whose content changed are rewritten.
+    Only the YEAR/WEEK partitions matching `years`, `min_week` and `max_week` are read.
+    Several processes can share the cache: it is built under an exclusive cache_lock (the
+    first process builds it, the others find it built) and read under a shared one.
+
+    Parameters:
+    -----------
+    csv_path : str
+        Path to the CSV file with contribution data
+    cache_dir : str, optional
+        Folder holding the cache (default: .vol_cache next to the CSV)
+    rebuild : bool
+        Force a rebuild from the CSV (default: False)
+    years : list, optional
+        Years to load (default: all)
+    min_week, max_week : int, optional
+        Inclusive week range to load (default: all weeks)
+    memory_map : bool
+        Memory-map the Parquet files instead of reading them into buffers (default: True)
+    fingerprint : dict, optional
+        Fingerprint of the CSV if already computed (see file_fingerprint)
+
+    Returns:
+    --------
+    df : pandas.DataFrame
+        Typed DataFrame
+    """
+    data_root, meta_path = cache_paths(csv_path, cache_dir)
+    if fingerprint is None:
+        fingerprint = file_fingerprint(csv_path)
+    fingerprint = dict(fingerprint, schema=build_schema())
+
+    lock_path = data_root + ".lock"
+    os.makedirs(os.path.dirname(data_root), exist_ok=True)
+
+    def stale(metadata):
+        return not os.path.isdir(data_root) or metadata.get('fingerprint') != fingerprint
+
+    if rebuild or stale(_read_cache_metadata(meta_path) or {}):
+        with cache_lock(lock_path):
+            # Another process may have built it while this one waited for the lock
+            metadata = _read_cache_metadata(meta_path) or {}
+            if rebuild or stale(metadata):
+                df = encode_columns(read_csv_typed(csv_path), os.path.dirname(data_root))
+                hashes = partition_hashes(df)
+
+                if rebuild or not os.path.isdir(data_root) or 'partitions' not in metadata:
+                    write_partitioned(df, data_root)
+                else:
+                    changed, removed = changed_partitions(metadata['partitions'], hashes)
+                    # Drop the metadata first: an interrupted update then triggers a full rebuild
+                    os.remove(meta_path)
+                    write_partitioned(df, data_root, partitions=changed, removed=removed)
+
+                tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({'fingerprint': fingerprint, 'partitions': hashes}, f, indent=2)
+                os.replace(tmp_path, meta_path)
+                if years is None and min_week is None and max_week is None:
+                    return df
+
+    with cache_lock(lock_path, shared=True):
+        return read_partitioned(data_root, years=years, min_week=min_week, max_week=max_week,
+                                memory_map=memory_map)
+
+
+def load_dataset(csv_path, reload=False, use_cache=True, rebuild=False, cache_dir=None,
+                 years=None, min_week=None, max_week=None):
+    """
+    Returns the process-wide dataset for `csv_path`, loading it only on first use.
+
+    Passing `years` / `min_week` / `max_week` loads only those YEAR/WEEK partitions, e.g. a
+    current-vs-prior-year YTD report needs years=[current_year, current_year-1] and
+    max_week=current_week. Each distinct selection is loaded once and shared.
+
+    Parameters:
+    -----------
+    csv_path : str
+        Path to the CSV file with contribution data
+    reload : bool
+        Load the file again even if it was already loaded (default: False)
+    use_cache : bool
+        Go through the columnar cache when pyarrow is installed (default: True)
+    rebuild : bool
+        Force a rebuild of the columnar cache (default: False, or the VOL_CACHE_REBUILD
+        environment variable)
+    cache_dir : str, optional
+        Folder holding the cache (default: .vol_cache next to the CSV)
+    years : list, optional
+        Years to load (default: all)
+    min_week, max_week : int, optional
+        Inclusive week range to load (default: all weeks)
+
+    Returns:
+    --------
+    df : pandas.DataFrame
+        Typed DataFrame shared by all the analysis functions, with the ENCODED_COLUMNS
+        dictionary-encoded (see encode_columns). Rows are sorted by YEAR and WEEK, in CSV
+        order within a week, whether they come from the CSV or from the cache. Treat it as
+        read-only.
+    """
+    selection = (tuple(sorted(years)) if years is not None else None, min_week, max_week)
+    key = (os.path.abspath(csv_path), selection)
+    if reload or rebuild or key not in _datasets:
+        rebuild = rebuild or os.environ.get(REBUILD_ENV_VAR, "") == "1"
+        with measure('read'):
+            if cache_dir is None:
+                cache_dir = os.path.dirname(cache_paths(csv_path)[0])
+            metadata = read_cache_metadata(csv_path, cache_dir) if use_cache else None
+            # Only hash the CSV when its size or modification time changed since the cache build
+            fingerprint = file_fingerprint(csv_path, known=(metadata or {}).get('fingerprint'))
+
+            df = None
+            if use_cache:
+                try:
+                    df = load_cached(csv_path, cache_dir=cache_dir, rebuild=rebuild, years=years,
+                                     min_week=min_week, max_week=max_week, fingerprint=fingerprint)
+                except ImportError:
+                    # pyarrow is optional, without it we always parse the CSV and filter in memory
+                    pass
+            if df is None:
+                df = select_partitions(read_csv_typed(csv_path), years, min_week, max_week)
+            df = _partition_order(df)
+            encode_columns(df, cache_dir if use_cache else None)
+
+        info = {
+            'version': _dataset_version(fingerprint, selection),
+            'cache_dir': cache_dir if use_cache else None,
+            'source': os.path.abspath(csv_path),
+        }
+        metadata = read_cache_metadata(csv_path, cache_dir) if use_cache else None
+        if metadata is not None and metadata.get('fingerprint', {}).get('sha256') == fingerprint['sha256']:
+            info['partitions'] = _select_partition_hashes(metadata['partitions'], years, min_week, max_week)
+
+        _datasets[key] = df
+        _dataset_info[key] = info
+    return _datasets[key]
+
+
+def _partition_order(df):
+    # Stable sort by YEAR/WEEK, the order of the cache partitions, skipped when already sorted
+    order = df['YEAR'].to_numpy(dtype='int64') * 64 + df['WEEK'].to_numpy(dtype='int64')
+    if len(order) < 2 or (order[1:] >= order[:-1]).all():
+        return df
+    return df.take(order.argsort(kind='stable')).reset_index(drop=True)
+
+
+def _select_partition_hashes(hashes, years=None, min_week=None, max_week=None):
+    selected = {}
+    for key, value in hashes.items():
+        year, week = (int(part) for part in key.split("-"))
+        if years is not None and year not in years:
+            continue
+        if (min_week is not None and week < min_week) or (max_week is not None and week > max_week):
+            continue
+        selected[key] = value
+    return selected
+
+
+def _dataset_version(fingerprint, selection):
+    version = fingerprint['sha256'][:16]
+    if selection != (None, None, None):
+        version += "-" + hashlib.sha256(repr(selection).encode()).hexdigest()[:8]
+    return version
+
+
+def dataset_info(df):
+    """
+    Returns the version and cache folder of a DataFrame returned by load_dataset.
+
+    The version changes whenever the CSV content changes, so it can be used to key anything
+    derived from the dataset. Returns None for DataFrames that did not come from load_dataset
+    (including filtered copies of a loaded dataset).
+
+    Returns:
+    --------
+    dict or None
+        {'version': str, 'cache_dir': str or None, 'source': path of the CSV}, plus
+        'partitions' once known
+        (see dataset_partitions)
+    """
+    for key, dataset in _datasets.items():
+        if dataset is df:
+            return _dataset_info[key]
+    return None
+
+
+def dataset_partitions(df):
+    """
+    Returns the partition hashes (see partition_hashes) of `df`.
+
+    For datasets returned by load_dataset they come from the cache metadata, or are computed
+    once and remembered.
+    """
+    info = dataset_info(df)
+    if info is None:
+        return partition_hashes(df)
+    if 'partitions' not in info:
+        info['partitions'] = partition_hashes(df)
+    return info['partitions']
+
+
+def select_partitions(df, years=None, min_week=None, max_week=None):
+    """
+    In-memory equivalent of the partition pruning done by read_partitioned.
+    """
+    mask = pd.Series(True, index=df.index)
+    if years is not None:
+        mask &= df['YEAR'].isin(years)
+    if min_week is not None:
+        mask &= df['WEEK'] >= min_week
+    if max_week is not None:
+        mask &= df['WEEK'] <= max_week
+    return df if mask.all() else df[mask].reset_index(drop=True)
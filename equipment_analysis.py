@@ -1,27 +1,79 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import numpy as np
 
-from variables import trades, current_year, current_week, csv_path, equipment_colors
+from plotting import plt
+from variables import trades, current_year, current_week, config, equipment_colors
+from weekly_cube import get_cube
+from instrumentation import instrumented, stage
 
-# Doughnut showing the distribution of equipment types
-def equipment_doughnut_single_plot(ax, csv_path, year, week, title=None):
-    df = pd.read_csv(csv_path, encoding="latin1")
-    df = df[(df['YEAR']==year)&(df['WEEK']<=week)&(df['TRADE']!="OUT OF SCOPE")&(df['TOTAL TEU'].notna())]
-
-    grouped = df.groupby('EQUIPMENT')['TOTAL TEU'].sum().reset_index()
-    top_categories = grouped.sort_values('TOTAL TEU', ascending=False).head(5)['EQUIPMENT'].tolist()
-
-    # Function that maps categories to either themselves or 'Other'
-    def map_category(cat):
-        return cat if cat in top_categories else 'Other'
+def equipment_mix_data(df, years, week, trades=None, top_n=5):
+    """
+    Returns the YTD equipment mix of every (year, trade) cell and of the yearly TOTAL (all
+    trades but OUT OF SCOPE), with the equipment after the `top_n` of each cell collapsed into
+    'Other'.
+    
+    All the cells come from one grouped computation on the equipment cube: the TEU by year,
+    trade and equipment is ranked within each cell and relabelled in a vectorized step, no
+    per-row mapping and no loop over the cells.
     
-    df['MAPPED EQUIPMENT'] = df['EQUIPMENT'].apply(map_category)
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        DataFrame containing the trade data
+    years : list
+        Years to include
+    week : int
+        Maximum week number to include
+    trades : list, optional
+        Trades to include (default: every trade but OUT OF SCOPE); the TOTAL always covers them all
+    top_n : int
+        Number of equipment types shown per cell (default: 5)
     
-    plot_data = df.groupby('MAPPED EQUIPMENT')['TOTAL TEU'].sum().reset_index().sort_values('TOTAL TEU', ascending=False)
-    wedges, texts, autotexts = ax.pie(x=plot_data['TOTAL TEU'], labels=plot_data['MAPPED EQUIPMENT'], 
-                                     autopct='%1.1f%%', colors=equipment_colors)
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per YEAR, TRADE ('TOTAL' for the totals) and EQUIPMENT (or 'Other'), by
+        decreasing TEU within each cell, with TOTAL TEU and SHARE (% of the cell)
+    """
+    # Weekly TEU by equipment come from the precomputed cube (see weekly_cube.py)
+    stage('aggregate')
+    cube = get_cube(df, 'EQUIPMENT')
+    cube = cube[(cube['YEAR'].isin(years)) & (cube['WEEK'] <= week) & (cube['TRADE'] != "OUT OF SCOPE") & 
+                (cube['TOTAL TEU'].notna())]
+    
+    by_trade = cube.groupby(['YEAR', 'TRADE', 'EQUIPMENT'], observed=True)['TOTAL TEU'].sum().reset_index()
+    total = by_trade.groupby(['YEAR', 'EQUIPMENT'], observed=True)['TOTAL TEU'].sum().reset_index()
+    total['TRADE'] = 'TOTAL'
+    by_trade['TRADE'] = by_trade['TRADE'].astype(str)
+    if trades is not None:
+        by_trade = by_trade[by_trade['TRADE'].isin(trades)]
+    
+    # Keep the trades in cube order, the totals last
+    trade_order = list(dict.fromkeys(by_trade['TRADE'])) + ['TOTAL']
+    mix = pd.concat([by_trade, total], ignore_index=True)
+    mix['EQUIPMENT'] = mix['EQUIPMENT'].astype(str)
+    mix['TRADE'] = pd.Categorical(mix['TRADE'], categories=trade_order)
+    
+    # Rank the equipment within each cell and collapse the tail into 'Other'
+    mix = mix.sort_values(['YEAR', 'TRADE', 'TOTAL TEU'], ascending=[True, True, False], kind='stable')
+    rank = mix.groupby(['YEAR', 'TRADE'], observed=True).cumcount()
+    mix['EQUIPMENT'] = mix['EQUIPMENT'].where(rank < top_n, 'Other')
+    mix = mix.groupby(['YEAR', 'TRADE', 'EQUIPMENT'], observed=True, sort=False)['TOTAL TEU'].sum().reset_index()
+    mix = mix.sort_values(['YEAR', 'TRADE', 'TOTAL TEU'], ascending=[True, True, False], kind='stable', 
+                          ignore_index=True)
+    mix['SHARE'] = mix['TOTAL TEU'] / mix.groupby(['YEAR', 'TRADE'], observed=True)['TOTAL TEU'].transform('sum') * 100
+    mix['TRADE'] = mix['TRADE'].astype(str)
+    return mix
+
+def _equipment_doughnut(ax, plot_data, colors, fontsize=None):
+    # Doughnut of one cell of equipment_mix_data
+    if not plot_data.empty:
+        wedges, texts, autotexts = ax.pie(x=plot_data['TOTAL TEU'], labels=plot_data['EQUIPMENT'], 
+                                         autopct='%1.1f%%', colors=colors)
+        # Make some labels smaller if needed
+        if fontsize is not None:
+            for text in texts + autotexts:
+                text.set_fontsize(fontsize)
     
     # Create a donut by adding a white circle at the center
     centre_circle = plt.Circle((0, 0), 0.65, fc='white')
@@ -29,116 +81,70 @@ def equipment_doughnut_single_plot(ax, csv_path, year, week, title=None):
     
     # Set aspect ratio to be equal so it's a circle
     ax.set_aspect('equal')
+
+# Doughnut showing the distribution of equipment types
+def equipment_doughnut_single_plot(ax, df, year, week, title=None):
+    mix = equipment_mix_data(df, [year], week, trades=[])
+    
+    stage('plot')
+    _equipment_doughnut(ax, mix[mix['TRADE'] == 'TOTAL'], equipment_colors)
     
     if title:
         ax.set_title(title)
 
-def equipment_comparison_yoy(csv_path, year_first, year_second, week):
+@instrumented
+def equipment_comparison_yoy(df, year_first, year_second, week):
     # Create a single figure with two subplots arranged vertically
+    stage('plot')
     fig, axs = plt.subplots(2, 1, figsize=(10, 12))
     
     # Create donuts in each subplot
-    equipment_doughnut_single_plot(axs[0], csv_path, year_first, week, f"Equipment YTD W{week} {year_first}")
-    equipment_doughnut_single_plot(axs[1], csv_path, year_second, week, f"Equipment YTD W{week} {year_second}")
+    equipment_doughnut_single_plot(axs[0], df, year_first, week, f"Equipment YTD W{week} {year_first}")
+    equipment_doughnut_single_plot(axs[1], df, year_second, week, f"Equipment YTD W{week} {year_second}")
     
     # Add an overall title
     fig.suptitle(f"Equipment - YTD W{week} {year_first} vs {year_second}", fontsize=16)
     
+    stage('layout')
     plt.tight_layout()
-    plt.show()
+    return fig
 
 #Create 12 charts for comparison between trades and between years
 
-def equipment_doughnut_multiple_trades(csv_path, year_first, year_second, week):
-    # Read data
-    df = pd.read_csv(csv_path, encoding="latin1")
-    df = df[(df['YEAR'].isin([year_first, year_second]))&(df['WEEK']<=week)&(df['TRADE']!="OUT OF SCOPE")&(df['TOTAL TEU'].notna())]
+@instrumented
+def equipment_doughnut_multiple_trades(df, year_first, year_second, week):
+    # Equipment mix of the 12 doughnuts in one computation
+    mix = equipment_mix_data(df, [year_first, year_second], week)
     
-    # Get unique trades (assuming there are 5 trades as mentioned)
-    unique_trades = df['TRADE'].unique()
+    # First 5 trades of the data, then the total
+    unique_trades = [trade for trade in mix['TRADE'].unique() if trade != 'TOTAL'][:5]
     
     # Create a figure with 2 rows (years) and 6 columns (5 trades + total)
+    stage('plot')
     fig, axs = plt.subplots(2, 6, figsize=(24, 10))
     
     # Process each year (current and previous)
     for year_idx, year in enumerate([year_first, year_second]):
-        year_df = df[df['YEAR'] == year]
+        year_mix = mix[mix['YEAR'] == year]
         
-        # Process each trade
-        for trade_idx, trade in enumerate(unique_trades[:5]):  # First 5 trades
-            trade_df = year_df[year_df['TRADE'] == trade]
-            ax = axs[year_idx, trade_idx]
-            
-            # Find top categories for this trade
-            grouped = trade_df.groupby('EQUIPMENT')['TOTAL TEU'].sum().reset_index()
-            top_categories = grouped.sort_values('TOTAL TEU', ascending=False).head(5)['EQUIPMENT'].tolist()
-            
-            # Map categories
-            def map_category(cat):
-                return cat if cat in top_categories else 'Other'
-            
-            trade_df['MAPPED EQUIPMENT'] = trade_df['EQUIPMENT'].apply(map_category)
-            
-            # Create the donut chart
-            plot_data = trade_df.groupby('MAPPED EQUIPMENT')['TOTAL TEU'].sum().reset_index()
-            plot_data = plot_data.sort_values('TOTAL TEU', ascending=False)
-            
-            if not plot_data.empty:
-                wedges, texts, autotexts = ax.pie(x=plot_data['TOTAL TEU'], labels=plot_data['MAPPED EQUIPMENT'], 
-                                               autopct='%1.1f%%', colors=equipment_colors[:len(plot_data)])
-                # Make some labels smaller if needed
-                for text in texts:
-                    text.set_fontsize(8)
-                for autotext in autotexts:
-                    autotext.set_fontsize(8)
-            
-            # Create the donut hole
-            centre_circle = plt.Circle((0, 0), 0.65, fc='white')
-            ax.add_patch(centre_circle)
-            ax.set_aspect('equal')
+        # Process each trade, then the "Total" chart for this year (last column)
+        for trade_idx, trade in enumerate(unique_trades + ['TOTAL']):
+            ax = axs[year_idx, 5 if trade == 'TOTAL' else trade_idx]
+            plot_data = year_mix[year_mix['TRADE'] == trade]
+            _equipment_doughnut(ax, plot_data, equipment_colors[:len(plot_data)], fontsize=8)
             
             # Set title for this subplot
             ax.set_title(f"{trade} {year}")
-        
-        # Create the "Total" chart for this year (last column)
-        ax = axs[year_idx, 5]
-        
-        # Find top categories for the total
-        grouped = year_df.groupby('EQUIPMENT')['TOTAL TEU'].sum().reset_index()
-        top_categories = grouped.sort_values('TOTAL TEU', ascending=False).head(5)['EQUIPMENT'].tolist()
-        
-        # Map categories
-        def map_category(cat):
-            return cat if cat in top_categories else 'Other'
-        
-        year_df['MAPPED EQUIPMENT'] = year_df['EQUIPMENT'].apply(map_category)
-        
-        # Create the donut chart for total
-        plot_data = year_df.groupby('MAPPED EQUIPMENT')['TOTAL TEU'].sum().reset_index()
-        plot_data = plot_data.sort_values('TOTAL TEU', ascending=False)
-        
-        wedges, texts, autotexts = ax.pie(x=plot_data['TOTAL TEU'], labels=plot_data['MAPPED EQUIPMENT'], 
-                                       autopct='%1.1f%%', colors=equipment_colors[:len(plot_data)])
-        # Make some labels smaller if needed
-        for text in texts:
-            text.set_fontsize(8)
-        for autotext in autotexts:
-            autotext.set_fontsize(8)
-        
-        # Create the donut hole
-        centre_circle = plt.Circle((0, 0), 0.65, fc='white')
-        ax.add_patch(centre_circle)
-        ax.set_aspect('equal')
-        
-        # Set title for this total subplot
-        ax.set_title(f"TOTAL {year}")
     
     # Set main title
     fig.suptitle(f"Equipment Distribution by Trade - YTD W{week} Comparison", fontsize=16)
     
+    stage('layout')
     plt.tight_layout()
     plt.subplots_adjust(top=0.90)  # Make room for the suptitle
-    plt.show()
+    return fig
 
 # Call the function
-equipment_doughnut_multiple_trades(csv_path, current_year, current_year-1, current_week)
\ No newline at end of file
+if __name__ == "__main__":
+    fig = equipment_doughnut_multiple_trades(config.dataset, current_year, current_year-1, current_week)
+    plt.show()
@@ -0,0 +1,192 @@
+import hashlib
+import inspect
+import json
+import os
+import shutil
+
+from data_loader import dataset_partitions
+
+# Content-addressed cache of rendered figures.
+# A figure is stored under a key made of the builder (name, and source code of its module and of
+# the local modules it uses), its arguments, the output format and a fingerprint of the YEAR/WEEK
+# partitions it reads. Rerunning a report with the same cutoff on unchanged data finds every
+# figure in the cache without calling matplotlib.
+# Several report workers can share one cache folder: entries are written under a temporary name
+# and renamed, and an entry deleted by another worker in the meantime is simply skipped.
+
+# Default size limit of the cache folder, least recently used figures are evicted beyond it
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+
+# Bump to invalidate every cached figure, e.g. after a change outside the chart modules
+CACHE_VERSION = 1
+
+# Builder arguments that name the years and the week cutoff a figure reads
+YEAR_ARGUMENTS = ['current_year', 'previous_year', 'year', 'year_first', 'year_second', 'years']
+WEEK_ARGUMENTS = ['current_week', 'week']
+
+
+def slice_fingerprint(df, kwargs):
+    """
+    Fingerprints the YEAR/WEEK partitions of `df` that a builder called with `kwargs` reads.
+
+    The years and the week cutoff are taken from the usual argument names (YEAR_ARGUMENTS,
+    WEEK_ARGUMENTS); when a builder has none of them every partition counts.
+    """
+    years = set()
+    for name in YEAR_ARGUMENTS:
+        value = kwargs.get(name)
+        if value is not None:
+            years.update(value if isinstance(value, (list, tuple, set)) else [value])
+    weeks = [kwargs[name] for name in WEEK_ARGUMENTS if kwargs.get(name) is not None]
+    max_week = max(weeks) if weeks else None
+
+    selected = []
+    for key, value in sorted(dataset_partitions(df).items()):
+        year, week = (int(part) for part in key.split("-"))
+        if (not years or year in years) and (max_week is None or week <= max_week):
+            selected.append(f"{key}={value}")
+    return hashlib.sha256("\n".join(selected).encode()).hexdigest()
+
+
+def _local_modules(module):
+    # `module` and the modules of the same folder it uses, directly or through each other
+    # (e.g. weekly_cube, comparisons, yoy_panels for a chart module)
+    folder = os.path.dirname(os.path.abspath(module.__file__))
+    found, pending = {}, [module]
+    while pending:
+        current = pending.pop()
+        path = getattr(current, '__file__', None)
+        if current.__name__ in found or path is None or os.path.dirname(os.path.abspath(path)) != folder:
+            continue
+        found[current.__name__] = current
+        for value in vars(current).values():
+            used = value if inspect.ismodule(value) else inspect.getmodule(value)
+            if used is not None:
+                pending.append(used)
+    return [found[name] for name in sorted(found)]
+
+
+def _source_hash(builder):
+    # Source of the builder's module and of the local modules it depends on, so changing an
+    # aggregation helper invalidates the figures built on it
+    digest = hashlib.sha256(f"v{CACHE_VERSION}".encode())
+    module = inspect.getmodule(builder)
+    try:
+        for dependency in _local_modules(module):
+            digest.update(dependency.__name__.encode())
+            digest.update(inspect.getsource(dependency).encode())
+    except (OSError, TypeError, AttributeError):
+        digest.update(builder.__qualname__.encode())
+    return digest.hexdigest()
+
+
+class FigureCache:
+    """
+    Stores rendered figures in `cache_dir`, evicting the least recently used ones above `max_bytes`.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, builder, kwargs, data_fingerprint, fmt='png', dpi=100):
+        """
+        Returns the cache key of a figure.
+
+        Parameters:
+        -----------
+        builder : callable
+            Figure builder, the source of its module and of the local modules it uses is part of
+            the key
+        kwargs : dict
+            Arguments of the builder besides the DataFrame
+        data_fingerprint : str
+            Fingerprint of the data the figure reads (see slice_fingerprint)
+        fmt : str
+            Image format
+        dpi : int
+            Resolution of raster images
+        """
+        description = json.dumps({
+            'builder': f"{builder.__module__}:{builder.__qualname__}",
+            'source': _source_hash(builder),
+            'kwargs': kwargs,
+            'data': data_fingerprint,
+            'format': fmt,
+            'dpi': dpi,
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _path(self, key, fmt):
+        return os.path.join(self.cache_dir, f"{key}.{fmt}")
+
+    def get(self, key, fmt='png'):
+        """
+        Returns the path of the cached figure, or None on a miss.
+        """
+        path = self._path(key, fmt)
+        try:
+            # The modification time doubles as the last access time for the LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, image_path, fmt='png'):
+        """
+        Copies a rendered image into the cache, then evicts old entries if the cache is too big.
+
+        Returns:
+        --------
+        str
+            Path of the cached copy
+        """
+        path = self._path(key, fmt)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        shutil.copyfile(image_path, tmp_path)
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        """
+        Deletes the least recently used figures until the cache fits in max_bytes.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".tmp") or not os.path.isfile(path):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # Evicted by another worker
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    @property
+    def stats(self):
+        """
+        {'bytes': int, 'figures': int} for this cache. The hits and misses of a report run are
+        given by the 'cached' flags of its results (see report_runner.run_report).
+        """
+        sizes = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".tmp"):
+                continue
+            try:
+                sizes.append(os.path.getsize(os.path.join(self.cache_dir, name)))
+            except FileNotFoundError:
+                pass
+        return {'bytes': sum(sizes), 'figures': len(sizes)}
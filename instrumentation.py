@@ -0,0 +1,270 @@
+import atexit
+import functools
+import json
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+
+# Stage-level timing and memory instrumentation of the chart builders.
+# Off by default, switched on by the VOL_PROFILE environment variable (or enable()). A builder
+# decorated with @instrumented opens a run, and stage('aggregate') inside it closes the current
+# stage and starts the next one, so the stages of a builder are marked with one line each:
+#
+#     @instrumented
+#     def contrib_comparison(df, ...):
+#         stage('filter')
+#         ...
+#         stage('aggregate')
+#         ...
+#
+# Code outside the builders (reading the data, saving the image) is measured with
+# `with measure('read'):`. When off, every entry point returns after one flag check.
+# VOL_PROFILE=1 records time and allocations (tracemalloc, which slows Python code down),
+# VOL_PROFILE=time records time only. At exit the per-run summary tables are printed to stderr
+# and the trace is written as Chrome trace events (open it in chrome://tracing or
+# https://ui.perfetto.dev) to VOL_PROFILE_TRACE. After enable(), call report() yourself.
+
+PROFILE_ENV_VAR = "VOL_PROFILE"
+TRACE_ENV_VAR = "VOL_PROFILE_TRACE"
+DEFAULT_TRACE_PATH = "vol_profile_trace.json"
+
+# Stages in the order they happen in a builder, used to order the summary columns
+STAGES = ['read', 'filter', 'aggregate', 'plot', 'layout', 'save']
+
+enabled = os.environ.get(PROFILE_ENV_VAR, "") not in ("", "0")
+
+# Recorded stages: {'run', 'stage', 'start', 'seconds', 'alloc_bytes', 'pid'}
+events = []
+
+# Open runs and measured blocks, innermost last
+_frames = []
+_epoch = time.perf_counter()
+
+
+class _Frame:
+    def __init__(self, run, stage_name):
+        self.run = run
+        self.opened = time.perf_counter()
+        self._start(stage_name)
+
+    def _start(self, stage_name):
+        self.stage = stage_name
+        self.started = time.perf_counter()
+        self.nested = 0.0
+        self.traced_start = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        self.peak = self.traced_start
+        if self.traced_start is not None:
+            tracemalloc.reset_peak()
+
+    def fold_peak(self):
+        # Keeps this stage's peak before a nested block resets the tracemalloc peak
+        if self.traced_start is not None:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+
+    def close(self):
+        end = time.perf_counter()
+        alloc = None
+        if self.traced_start is not None:
+            self.fold_peak()
+            alloc = self.peak - self.traced_start
+        # Time spent in measured blocks nested in this stage is reported by those blocks only
+        seconds = end - self.started - self.nested
+        events.append({'run': self.run, 'stage': self.stage, 'start': self.started - _epoch,
+                       'seconds': seconds, 'alloc_bytes': alloc, 'pid': os.getpid()})
+
+
+def _open(run, stage_name):
+    if _frames:
+        _frames[-1].fold_peak()
+    frame = _Frame(run, stage_name)
+    _frames.append(frame)
+    return frame
+
+
+def _close(frame):
+    _frames.remove(frame)
+    frame.close()
+    if _frames:
+        _frames[-1].nested += time.perf_counter() - frame.opened
+        if frame.traced_start is not None:
+            tracemalloc.reset_peak()
+
+
+def instrumented(builder):
+    """
+    Decorator of the chart builders: records the stages marked with stage() while it runs.
+
+    The first stage is 'filter' until another one is marked.
+    """
+    @functools.wraps(builder)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return builder(*args, **kwargs)
+        frame = _open(builder.__qualname__, 'filter')
+        try:
+            return builder(*args, **kwargs)
+        finally:
+            _close(frame)
+    return wrapper
+
+
+def stage(name):
+    """
+    Ends the current stage of the running builder and starts stage `name` (see STAGES).
+    """
+    if not enabled or not _frames:
+        return
+    frame = _frames[-1]
+    frame.close()
+    frame._start(name)
+
+
+class measure:
+    """
+    Context manager recording the enclosed block as stage `name`, e.g. `with measure('read'):`.
+
+    The block counts towards run `run`, by default the builder it runs in (if any).
+    """
+
+    def __init__(self, name, run=None):
+        self.name = name
+        self.run = run
+        self.frame = None
+
+    def __enter__(self):
+        if enabled:
+            run = self.run
+            if run is None and _frames:
+                run = _frames[-1].run
+            self.frame = _open(run, self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.frame is not None:
+            _close(self.frame)
+            self.frame = None
+        return False
+
+
+def enable(trace_memory=True):
+    """
+    Switches the instrumentation on for this process and the worker processes it starts.
+
+    trace_memory starts tracemalloc, which measures allocations but slows Python code down.
+    """
+    global enabled
+    enabled = True
+    os.environ[PROFILE_ENV_VAR] = "1" if trace_memory else "time"
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    """
+    Switches the instrumentation off. Recorded events are kept.
+    """
+    global enabled
+    enabled = False
+    os.environ.pop(PROFILE_ENV_VAR, None)
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def add_events(new_events):
+    """
+    Adds events recorded in another process (see report_runner).
+    """
+    events.extend(new_events)
+
+
+def summary(recorded=None):
+    """
+    Returns the seconds spent per run (rows) and stage (columns), with a total column.
+
+    Events recorded outside any builder are reported under run '-'.
+    """
+    import pandas as pd
+
+    recorded = events if recorded is None else recorded
+    if not recorded:
+        return pd.DataFrame(columns=STAGES + ['total'])
+
+    table = pd.DataFrame(recorded)
+    table['run'] = table['run'].fillna('-')
+    seconds = table.pivot_table(index='run', columns='stage', values='seconds', aggfunc='sum', fill_value=0.0)
+    columns = [name for name in STAGES if name in seconds.columns]
+    columns += [name for name in seconds.columns if name not in STAGES]
+    seconds = seconds[columns]
+    seconds['total'] = seconds.sum(axis=1)
+    return seconds.sort_values('total', ascending=False)
+
+
+def allocation_summary(recorded=None):
+    """
+    Returns the largest allocation peak (bytes) per run and stage, like summary().
+
+    Empty unless memory was traced.
+    """
+    import pandas as pd
+
+    recorded = [event for event in (events if recorded is None else recorded) if event['alloc_bytes'] is not None]
+    if not recorded:
+        return pd.DataFrame(columns=STAGES)
+
+    table = pd.DataFrame(recorded)
+    table['run'] = table['run'].fillna('-')
+    peaks = table.pivot_table(index='run', columns='stage', values='alloc_bytes', aggfunc='max')
+    return peaks[[name for name in STAGES if name in peaks.columns]
+                 + [name for name in peaks.columns if name not in STAGES]]
+
+
+def write_trace(path, recorded=None):
+    """
+    Writes the events as a Chrome trace (JSON), one row per process.
+    """
+    recorded = events if recorded is None else recorded
+    trace = [{
+        'name': event['stage'],
+        'cat': event['run'] or '-',
+        'ph': 'X',
+        'ts': event['start'] * 1e6,
+        'dur': event['seconds'] * 1e6,
+        'pid': event['pid'],
+        'tid': 0,
+        'args': {'run': event['run'], 'alloc_bytes': event['alloc_bytes']},
+    } for event in recorded]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+    return path
+
+
+def report(trace_path=None, stream=None):
+    """
+    Prints the summary tables and writes the trace (default: VOL_PROFILE_TRACE or
+    vol_profile_trace.json). Does nothing when no event was recorded.
+    """
+    if not events:
+        return
+    stream = stream or sys.stderr
+    print("Stage timings (seconds)", file=stream)
+    print(summary().round(3).to_string(), file=stream)
+    allocations = allocation_summary()
+    if not allocations.empty:
+        print("Stage allocation peaks (MiB)", file=stream)
+        print((allocations / 2**20).round(1).to_string(), file=stream)
+    path = write_trace(trace_path or os.environ.get(TRACE_ENV_VAR) or DEFAULT_TRACE_PATH)
+    print(f"Trace written to {path}", file=stream)
+
+
+def _report_at_exit():
+    # Worker processes of the report runner hand their events to the parent instead
+    if multiprocessing.parent_process() is None:
+        report()
+
+
+if enabled:
+    if os.environ.get(PROFILE_ENV_VAR) != "time":
+        tracemalloc.start()
+    atexit.register(_report_at_exit)
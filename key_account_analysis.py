@@ -1,11 +1,90 @@
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
-import matplotlib.gridspec as gridspec
-from matplotlib.ticker import PercentFormatter
 
-from variables import trades, current_year, df
+from plotting import plt, gridspec, ticker
+from variables import trades, current_year
+from weekly_cube import get_cube
+from instrumentation import instrumented, stage
 
+def client_pareto_data(df, year, week, trades, top_n=15):
+    """
+    Returns the client TEU distribution of one week for every trade and for the TOTAL (all
+    trades but OUT OF SCOPE), from a single grouped pass over the client cube.
+    
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        DataFrame containing the trade data
+    year : int
+        Year to analyze
+    week : int
+        Week number to analyze
+    trades : list
+        List of trade names to analyze
+    top_n : int
+        Number of clients kept per trade, the others are collapsed into one "Others" row
+        (default: 15)
+    
+    Returns:
+    --------
+    tuple
+        (distribution, summary):
+        - distribution: one row per TRADE (trades, then 'TOTAL') and client by decreasing TEU,
+          with RANK, CLEAN BUSINESS PARTNER, TOTAL TEU, Percentage and Cumulative Percentage
+          (the "Others" row has the RANK top_n + 1 and a cumulative percentage of 100)
+        - summary: indexed by TRADE, with CLIENTS (number of clients), TOTAL TEU, and the
+          TOP 5 and TOP 10 shares (%)
+    """
+    # Weekly TEU by trade and client come from the precomputed cube (see weekly_cube.py)
+    stage('aggregate')
+    cube = get_cube(df, 'CLEAN BUSINESS PARTNER')
+    week_rows = cube[(cube['YEAR'] == year) & (cube['WEEK'] == week)]
+    
+    # One grouped pass by trade and client, the TOTAL is summed from its result
+    by_trade = week_rows.groupby(['TRADE', 'CLEAN BUSINESS PARTNER'], observed=True)['TOTAL TEU'].sum().reset_index()
+    by_trade['TRADE'] = by_trade['TRADE'].astype(str)
+    in_scope = by_trade[by_trade['TRADE'] != "OUT OF SCOPE"]
+    total = in_scope.groupby('CLEAN BUSINESS PARTNER', observed=True)['TOTAL TEU'].sum().reset_index()
+    total['TRADE'] = 'TOTAL'
+    
+    all_categories = list(trades) + ['TOTAL']
+    clients = pd.concat([by_trade[by_trade['TRADE'].isin(trades)], total], ignore_index=True)
+    clients['CLEAN BUSINESS PARTNER'] = clients['CLEAN BUSINESS PARTNER'].astype(str)
+    clients['TRADE'] = pd.Categorical(clients['TRADE'], categories=all_categories)
+    
+    # Rank, share and cumulative share of every client within its trade
+    clients = clients.sort_values(['TRADE', 'TOTAL TEU'], ascending=[True, False], kind='stable', ignore_index=True)
+    grouped = clients.groupby('TRADE', observed=True)
+    clients['RANK'] = grouped.cumcount() + 1
+    clients['Percentage'] = clients['TOTAL TEU'] / grouped['TOTAL TEU'].transform('sum') * 100
+    clients['Cumulative Percentage'] = clients.groupby('TRADE', observed=True)['Percentage'].cumsum()
+    
+    summary = pd.DataFrame({
+        'CLIENTS': grouped.size(),
+        'TOTAL TEU': grouped['TOTAL TEU'].sum(),
+        'TOP 5': clients[clients['RANK'] <= 5].groupby('TRADE', observed=True)['Percentage'].sum(),
+        'TOP 10': clients[clients['RANK'] <= 10].groupby('TRADE', observed=True)['Percentage'].sum(),
+    }).reindex(all_categories)
+    summary.index = summary.index.astype(str)
+    summary.index.name = 'TRADE'
+    summary['CLIENTS'] = summary['CLIENTS'].fillna(0).astype(int)
+    
+    # Collapse the clients after the top_n of each trade into an "Others" row
+    tail = clients[clients['RANK'] > top_n]
+    others = tail.groupby('TRADE', observed=True)[['TOTAL TEU', 'Percentage']].sum().reset_index()
+    others['CLEAN BUSINESS PARTNER'] = 'Others'
+    others['RANK'] = top_n + 1
+    others['Cumulative Percentage'] = 100.0  # Always 100%
+    distribution = pd.concat([clients[clients['RANK'] <= top_n], others], ignore_index=True)
+    distribution['TRADE'] = pd.Categorical(distribution['TRADE'], categories=all_categories)
+    distribution = distribution.sort_values(['TRADE', 'RANK'], ignore_index=True)
+    distribution = distribution[['TRADE', 'RANK', 'CLEAN BUSINESS PARTNER', 'TOTAL TEU', 
+                                 'Percentage', 'Cumulative Percentage']]
+    distribution['TRADE'] = distribution['TRADE'].astype(str)
+    
+    return distribution, summary
+
+@instrumented
 def client_pareto_analysis(df, year, week, trades):
     """
     Creates Pareto charts showing the importance of top 5 and top 10 clients in TEU distribution.
@@ -26,12 +105,13 @@ def client_pareto_analysis(df, year, week, trades):
     fig : matplotlib.figure.Figure
         Figure with 6 subplots (5 trades + total) arranged in 2 rows and 3 columns
     """
-    # Filter data for the specified year and week
-    filtered_df = df[(df['YEAR'] == year) & (df['WEEK'] == week)]
+    # Client distribution of every trade and of the TOTAL, in one aggregation
+    distribution, summary = client_pareto_data(df, year, week, trades)
     
     # Add 'TOTAL' to the list of trades for plotting
     all_categories = trades + ['TOTAL']
     
+    stage('plot')
     # Create figure with adjustments for better handling of long client names
     # Changed to 2 rows and 3 columns layout
     fig = plt.figure(figsize=(24, 16))  # Adjusted width and height for new layout
@@ -41,51 +121,15 @@ def client_pareto_analysis(df, year, week, trades):
     for i, trade in enumerate(all_categories):
         ax = fig.add_subplot(gs[i//3, i%3])  # Position based on grid - adjusted for new layout
         
-        if trade == 'TOTAL':
-            # For TOTAL, use all trades data
-            trade_df = filtered_df[filtered_df['TRADE'] != "OUT OF SCOPE"]
-        else:
-            # For specific trade
-            trade_df = filtered_df[filtered_df['TRADE'] == trade]
+        # Top clients of this trade (plus "Others"), by decreasing TEU
+        client_teu = distribution[distribution['TRADE'] == trade].reset_index(drop=True)
         
-        if trade_df.empty:
+        if client_teu.empty:
             ax.text(0.5, 0.5, f"No data available for {trade} in Week {week}, {year}",
                    ha='center', va='center', fontsize=12)
             ax.set_title(f'{trade} - Client Distribution', fontsize=12, fontweight='bold')
             continue
         
-        # Group by client and calculate TEU sum
-        client_teu = trade_df.groupby('CLEAN BUSINESS PARTNER')['TOTAL TEU'].sum().reset_index()
-        
-        # Sort by TEU in descending order
-        client_teu = client_teu.sort_values('TOTAL TEU', ascending=False)
-        
-        # Calculate total TEU
-        total_teu = client_teu['TOTAL TEU'].sum()
-        
-        # Calculate percentage and cumulative percentage
-        client_teu['Percentage'] = client_teu['TOTAL TEU'] / total_teu * 100
-        client_teu['Cumulative Percentage'] = client_teu['Percentage'].cumsum()
-        
-        # Number of clients to show in the bar chart (rest will be grouped as "Others")
-        top_n = 15
-        
-        # Create "Others" category if there are more than top_n clients
-        if len(client_teu) > top_n:
-            top_clients = client_teu.iloc[:top_n].copy()
-            others_teu = client_teu.iloc[top_n:]['TOTAL TEU'].sum()
-            others_pct = client_teu.iloc[top_n:]['Percentage'].sum()
-            
-            others_row = pd.DataFrame({
-                'CLEAN BUSINESS PARTNER': ['Others'],
-                'TOTAL TEU': [others_teu],
-                'Percentage': [others_pct],
-                'Cumulative Percentage': [100.0]  # Always 100%
-            })
-            
-            # Concatenate top clients with Others
-            client_teu = pd.concat([top_clients, others_row], ignore_index=True)
-        
         # Format client names for better display (if too long)
         client_teu['Short Name'] = client_teu['CLEAN BUSINESS PARTNER'].apply(
             lambda x: x[:15] + '...' if len(str(x)) > 15 else x)  # Reduced from 20 to 15 characters
@@ -124,8 +168,8 @@ def client_pareto_analysis(df, year, week, trades):
         ax.set_ylim(0, max(client_teu['Percentage']) * 1.15)  # Add some padding at the top
         ax2.set_ylim(0, 101)  # Percentage axis
         
-        ax.yaxis.set_major_formatter(PercentFormatter())
-        ax2.yaxis.set_major_formatter(PercentFormatter())
+        ax.yaxis.set_major_formatter(ticker.PercentFormatter())
+        ax2.yaxis.set_major_formatter(ticker.PercentFormatter())
         
         # Rotate x-axis labels for better readability and adjust vertical position
         plt.setp(ax.get_xticklabels(), rotation=45, ha='right', va='top', fontsize=6)  # Reduced font size
@@ -158,16 +202,173 @@ def client_pareto_analysis(df, year, week, trades):
             ax.set_title(f'{trade}', fontsize=12, fontweight='bold')  # Simple trade name only
         
         # Add count of total clients (keep this for all charts)
-        client_count = len(trade_df['CLEAN BUSINESS PARTNER'].unique())
+        client_count = summary.loc[trade, 'CLIENTS']
         ax.text(0.02, 0.98, f'Total Clients: {client_count}', transform=ax.transAxes,
                fontsize=9, va='top')
         
         # Add grid for readability
         ax.grid(axis='y', alpha=0.3)
     
+    stage('layout')
     plt.tight_layout(rect=[0, 0.05, 1, 0.95])
     plt.suptitle(f'Client Importance Analysis - Week {week}, {year}', fontsize=16, y=0.98)
     
     return fig
 
+# Example usage (only the partition of the analysed week is read):
+# week_df = config.use(years=[current_year], min_week=current_week, max_week=current_week).dataset
+# fig = client_pareto_analysis(week_df, current_year, current_week, trades)
+
 #Adapt the function for commodities
+
+# Client concentration of every trade across all the weeks of the data
+
+# Metrics of client_concentration_data, with their chart labels
+CONCENTRATION_METRICS = {
+    'HHI': 'Herfindahl index (0-10,000)',
+    'GINI': 'Gini coefficient',
+    'TOP 5': 'Share of the top 5 clients (%)',
+    'TOP 10': 'Share of the top 10 clients (%)',
+    'TOP 20': 'Share of the top 20 clients (%)',
+}
+
+def client_concentration_data(df, trades=None, years=None, max_week=None):
+    """
+    Returns client concentration metrics of the TEU for every YEAR x WEEK x TRADE, plus the
+    TOTAL of all trades but OUT OF SCOPE.
+    
+    All the weeks are computed together: the client TEU totals of the cube are sorted once by
+    (week and trade, decreasing TEU) and each metric is a segmented sum over that order
+    (np.bincount on the segment number), without a loop over the weeks.
+    
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        DataFrame containing the trade data
+    trades : list, optional
+        Trades to include (default: every trade but OUT OF SCOPE)
+    years : list, optional
+        Years to include (default: all)
+    max_week : int, optional
+        Maximum week number to include (default: all weeks)
+    
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per YEAR, WEEK and TRADE with:
+        - CLIENTS: number of clients, TOTAL TEU
+        - HHI: Herfindahl index, sum of the squared client shares in % (0 to 10,000)
+        - GINI: Gini coefficient of the client TEU (0 when all clients weigh the same)
+        - TOP 5, TOP 10, TOP 20: share of the TEU held by the largest clients (%)
+    """
+    # Weekly TEU by trade and client come from the precomputed cube (see weekly_cube.py)
+    stage('aggregate')
+    cube = get_cube(df, 'CLEAN BUSINESS PARTNER')
+    mask = cube['TRADE'] != "OUT OF SCOPE"
+    if years is not None:
+        mask &= cube['YEAR'].isin(years)
+    if max_week is not None:
+        mask &= cube['WEEK'] <= max_week
+    rows = cube.loc[mask, ['YEAR', 'WEEK', 'TRADE', 'CLEAN BUSINESS PARTNER', 'TOTAL TEU']]
+    rows = rows.astype({'TRADE': str})
+    
+    total = rows.groupby(['YEAR', 'WEEK', 'CLEAN BUSINESS PARTNER'], observed=True)['TOTAL TEU'].sum().reset_index()
+    total['TRADE'] = 'TOTAL'
+    if trades is not None:
+        rows = rows[rows['TRADE'].isin(trades)]
+    rows = pd.concat([rows, total], ignore_index=True)
+    
+    # Segment = one YEAR x WEEK x TRADE, clients by decreasing TEU inside each segment
+    segment = rows.groupby(['YEAR', 'WEEK', 'TRADE'], sort=True).ngroup().to_numpy()
+    teu = np.nan_to_num(rows['TOTAL TEU'].to_numpy(dtype=float, na_value=np.nan))
+    order = np.lexsort((-teu, segment))
+    segment, teu = segment[order], teu[order]
+    
+    starts = np.flatnonzero(np.r_[True, segment[1:] != segment[:-1]]) if len(segment) else np.array([], dtype=int)
+    counts = np.diff(np.r_[starts, len(segment)])
+    rank = np.arange(len(segment)) - np.repeat(starts, counts) + 1
+    n_segments = len(starts)
+    
+    segment_teu = np.bincount(segment, weights=teu, minlength=n_segments)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        share = teu / segment_teu[segment] * 100
+        # Gini from the clients sorted by increasing TEU: 2 * sum(i * x_i) / (n * sum(x)) - (n + 1) / n
+        ascending = counts[segment] - rank + 1
+        weighted = np.bincount(segment, weights=ascending * teu, minlength=n_segments)
+        gini = 2 * weighted / (counts * segment_teu) - (counts + 1) / counts
+    
+    first = rows.iloc[order[starts]]
+    metrics = pd.DataFrame({
+        'YEAR': first['YEAR'].to_numpy(),
+        'WEEK': first['WEEK'].to_numpy(),
+        'TRADE': first['TRADE'].to_numpy(),
+        'CLIENTS': counts,
+        'TOTAL TEU': segment_teu,
+        'HHI': np.bincount(segment, weights=np.nan_to_num(share) ** 2, minlength=n_segments),
+        'GINI': gini,
+    })
+    for top in (5, 10, 20):
+        metrics[f'TOP {top}'] = np.bincount(segment, weights=np.where(rank <= top, np.nan_to_num(share), 0.0),
+                                            minlength=n_segments)
+    
+    # Weeks without any TEU have no shares
+    metrics.loc[metrics['TOTAL TEU'] == 0, ['HHI', 'GINI', 'TOP 5', 'TOP 10', 'TOP 20']] = np.nan
+    return metrics
+
+@instrumented
+def plot_client_concentration(df, trades, metric='HHI', years=None, max_week=None):
+    """
+    Creates charts of the weekly client concentration of each trade, one line per year.
+    
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        DataFrame containing the trade data
+    trades : list
+        List of trade names to analyze
+    metric : str
+        One of CONCENTRATION_METRICS (default: 'HHI')
+    years : list, optional
+        Years to show (default: every year of the data)
+    max_week : int, optional
+        Maximum week number to include (default: all weeks)
+    
+    Returns:
+    --------
+    fig : matplotlib.figure.Figure
+        Figure with 6 subplots (5 trades + total) arranged in 2 rows and 3 columns
+    """
+    metrics = client_concentration_data(df, trades, years, max_week)
+    
+    all_categories = trades + ['TOTAL']
+    shown_years = sorted(metrics['YEAR'].unique(), reverse=True)
+    colors = ['#0D173F', '#FF0000', '#16C47F', '#FFD65A', '#4A06FF']
+    
+    stage('plot')
+    fig = plt.figure(figsize=(24, 12))
+    gs = gridspec.GridSpec(2, 3, figure=fig)
+    
+    for i, trade in enumerate(all_categories):
+        ax = fig.add_subplot(gs[i//3, i%3])
+        trade_metrics = metrics[metrics['TRADE'] == trade]
+        
+        for j, year in enumerate(shown_years):
+            year_metrics = trade_metrics[trade_metrics['YEAR'] == year]
+            ax.plot(year_metrics['WEEK'], year_metrics[metric], marker='o', markersize=3, linewidth=2,
+                    label=f'{year}', color=colors[j % len(colors)])
+        
+        ax.set_title(f'{trade}', fontsize=12, fontweight='bold')
+        ax.set_xlabel('Week')
+        ax.xaxis.set_major_locator(ticker.MaxNLocator(integer=True))
+        ax.set_ylabel(CONCENTRATION_METRICS[metric], fontsize=10)
+        ax.grid(True, alpha=0.3)
+        ax.legend(loc='best')
+    
+    stage('layout')
+    plt.suptitle(f'Client Concentration by Week: {CONCENTRATION_METRICS[metric]}', fontsize=16)
+    plt.tight_layout(rect=[0, 0, 1, 0.96])
+    return fig
+
+# Example usage:
+# metrics = client_concentration_data(config.dataset, trades)
+# fig = plot_client_concentration(config.dataset, trades, 'GINI', years=[current_year, current_year-1])
@@ -0,0 +1,455 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from plotting import plt
+from data_loader import changed_partitions, dataset_info, dataset_partitions
+from query import select
+from instrumentation import instrumented, stage
+
+# Lane graph of the bookings: origin -> destination flows at port (POL -> POD), zone (ZOL -> ZOD)
+# or country level, kept as one sparse adjacency matrix (scipy.sparse CSR) per YEAR/WEEK and
+# measure:
+#
+#     graph = lane_graph(df, 'port')
+#     graph.top_lanes(20, 'TEU', years=[2025], max_week=20)
+#     graph.port_totals('TONS', years=[2025], max_week=20)       # outbound / inbound per port
+#     graph.centrality('TEU', 'pagerank', years=[2025], max_week=20)
+#
+# The weekly matrices are built in one vectorized pass over the bookings (np.unique on a
+# period x origin x destination key, np.bincount for the sums). A window (years, weeks) is the
+# sum of its weekly matrices, computed once and reused by every query on that window.
+# graph.update(df, partitions) re-aggregates only the given weeks, and lane_graph() uses it to
+# follow a new version of a loaded dataset by rebuilding only the weeks that changed.
+
+# Origin and destination columns of each level of the graph
+LANE_LEVELS = {
+    'port': ('POL', 'POD'),
+    'zone': ('ZOL', 'ZOD'),
+    'country': ('COUNTRY ORIGIN', 'COUNTRY DESTINATION'),
+}
+
+# Measures summed on the lanes; WEIGHTED is TOTAL TEU x AVG CONTRIBUTION
+LANE_MEASURES = ['TEU', 'TONS', 'WEIGHTED', 'BOOKINGS']
+
+# Lane graphs followed across dataset versions, keyed by (CSV path, partition selection, level,
+# exclude_out_of_scope), with the partition hashes and the data version they were built from.
+# Only the latest data version of each CSV is kept.
+_graphs = {}
+
+
+def _resized(matrix, n):
+    # Copy of `matrix` grown to n x n
+    matrix = matrix.copy()
+    matrix.resize((n, n))
+    return matrix
+
+
+def _period_of(key):
+    # (year, week) of a partition key such as '2025-07'
+    year, week = key.split("-")
+    return int(year), int(week)
+
+
+class LaneGraph:
+    """
+    Weekly origin -> destination flow matrices of one level of LANE_LEVELS.
+
+    Parameters:
+    -----------
+    level : str
+        'port', 'zone' or 'country' (default: 'port')
+    exclude_out_of_scope : bool
+        Leave out the bookings with TRADE "OUT OF SCOPE" (default: True)
+
+    Attributes:
+    -----------
+    nodes : pandas.Index
+        Labels of the matrix rows and columns; new labels are appended, so positions never change
+    weeks : dict
+        (year, week) -> {measure: scipy.sparse.csr_matrix}
+    """
+
+    def __init__(self, level='port', exclude_out_of_scope=True):
+        self.level = level
+        self.origin, self.destination = LANE_LEVELS[level]
+        self.exclude_out_of_scope = exclude_out_of_scope
+        self.nodes = pd.Index([], dtype=str)
+        self.weeks = {}
+        self._windows = {}
+
+    def _node_positions(self, values):
+        # Node position of every value (-1 when missing), labels not seen before become nodes
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes, labels = values.cat.codes.to_numpy(), values.cat.categories
+        else:
+            codes, labels = pd.factorize(values)
+        used = np.bincount(codes[codes >= 0], minlength=len(labels)) > 0
+        new = labels[used].difference(self.nodes, sort=False)
+        if len(new):
+            self.nodes = self.nodes.append(pd.Index(new.astype(str)))
+        lookup = np.append(self.nodes.get_indexer(labels.astype(str)), -1)
+        return lookup[codes]
+
+    def _measure_values(self, rows):
+        teu = rows['TOTAL TEU'].to_numpy(dtype=float, na_value=np.nan)
+        contribution = rows['AVG CONTRIBUTION'].to_numpy(dtype=float, na_value=np.nan)
+        return {
+            'TEU': np.nan_to_num(teu),
+            'TONS': np.nan_to_num(rows['TONS'].to_numpy(dtype=float, na_value=np.nan)),
+            'WEIGHTED': np.nan_to_num(teu * contribution),
+            'BOOKINGS': np.ones(len(rows)),
+        }
+
+    def _lane_sums(self, bookings):
+        # One row per week and lane summed in SQL, with the same measures as _measure_values
+        keys = ['YEAR', 'WEEK', self.origin, self.destination]
+        sums = bookings.sums(keys, ['TOTAL TEU', 'TONS'])
+        weighted = bookings.weighted_sums('AVG CONTRIBUTION', 'TOTAL TEU', keys)['WEIGHTED_SUM']
+        rows = sums.join(weighted, how='left').reset_index()
+        values = {
+            'TEU': rows['TOTAL TEU'].fillna(0.0).to_numpy(dtype=float),
+            'TONS': rows['TONS'].fillna(0.0).to_numpy(dtype=float),
+            'WEIGHTED': rows['WEIGHTED_SUM'].fillna(0.0).to_numpy(dtype=float),
+            'BOOKINGS': rows['BOOKINGS'].to_numpy(dtype=float),
+        }
+        return rows, values
+
+    def update(self, df, partitions=None):
+        """
+        Aggregates the bookings of `df` into the weekly matrices.
+
+        Parameters:
+        -----------
+        df : pandas.DataFrame or sqlite_backend.SqliteBookings
+            DataFrame containing the booking data (for SqliteBookings the bookings are summed
+            by week and lane in SQL)
+        partitions : list, optional
+            Partition keys (see data_loader.partition_key) of the weeks to aggregate again,
+            e.g. the changed weeks of data_loader.changed_partitions (default: every week of
+            `df`, replacing the whole graph)
+
+        Returns:
+        --------
+        LaneGraph
+            self
+        """
+        columns = ['YEAR', 'WEEK', self.origin, self.destination, 'TOTAL TEU', 'TONS', 'AVG CONTRIBUTION']
+        rows = select(df, columns, exclude_out_of_scope=self.exclude_out_of_scope)
+        if isinstance(rows, pd.DataFrame):
+            values = self._measure_values(rows)
+        else:
+            rows, values = self._lane_sums(rows)
+        periods = rows['YEAR'].to_numpy().astype(np.int64) * 100 + rows['WEEK'].to_numpy().astype(np.int64)
+
+        if partitions is None:
+            self.weeks = {}
+        else:
+            wanted = [year * 100 + week for year, week in map(_period_of, partitions)]
+            for year, week in map(_period_of, partitions):
+                self.weeks.pop((year, week), None)
+            keep = np.isin(periods, wanted)
+            rows, periods = rows[keep], periods[keep]
+            values = {measure: weights[keep] for measure, weights in values.items()}
+
+        origins = self._node_positions(rows[self.origin])
+        destinations = self._node_positions(rows[self.destination])
+        n = len(self.nodes)
+
+        # One key per period x origin x destination, sorted by period then lane
+        valid = (origins >= 0) & (destinations >= 0)
+        keys = (periods[valid] * n + origins[valid]) * n + destinations[valid]
+        lanes, inverse = np.unique(keys, return_inverse=True)
+        sums = {measure: np.bincount(inverse, weights=values[measure][valid], minlength=len(lanes))
+                for measure in LANE_MEASURES}
+        lane_periods, lane_cells = np.divmod(lanes, n * n)
+        lane_origins, lane_destinations = np.divmod(lane_cells, n)
+
+        bounds = np.flatnonzero(np.diff(lane_periods)) + 1
+        for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(lanes)]):
+            if start == end:
+                continue
+            period = int(lane_periods[start])
+            cells = (lane_origins[start:end], lane_destinations[start:end])
+            self.weeks[(period // 100, period % 100)] = {
+                measure: sp.csr_matrix((sums[measure][start:end], cells), shape=(n, n)) for measure in LANE_MEASURES
+            }
+
+        # Weeks built before new nodes appeared get the new (empty) rows and columns
+        for period, matrices in self.weeks.items():
+            if any(matrix.shape != (n, n) for matrix in matrices.values()):
+                self.weeks[period] = {measure: _resized(matrix, n) for measure, matrix in matrices.items()}
+        self._windows.clear()
+        return self
+
+    def copy(self):
+        """
+        Returns a copy of the graph that can be updated without changing this one.
+        """
+        graph = LaneGraph(self.level, self.exclude_out_of_scope)
+        graph.nodes = self.nodes
+        graph.weeks = dict(self.weeks)
+        return graph
+
+    def matrix(self, measure='TEU', years=None, min_week=None, max_week=None):
+        """
+        Returns the origin -> destination matrix of `measure` summed over the weeks of the window.
+
+        Returns:
+        --------
+        scipy.sparse.csr_matrix
+            nodes x nodes. Treat it as read-only: it is shared by the queries on the same window.
+        """
+        years = tuple(sorted(int(year) for year in years)) if years is not None else None
+        key = (measure, years, min_week, max_week)
+        if key not in self._windows:
+            n = len(self.nodes)
+            parts = [matrices[measure].tocoo() for (year, week), matrices in self.weeks.items()
+                     if (years is None or year in years) and (min_week is None or week >= min_week)
+                     and (max_week is None or week <= max_week)]
+            if parts:
+                # Duplicate cells of the weeks are summed by the conversion
+                total = sp.coo_matrix((np.concatenate([part.data for part in parts]),
+                                       (np.concatenate([part.row for part in parts]),
+                                        np.concatenate([part.col for part in parts]))), shape=(n, n)).tocsr()
+            else:
+                total = sp.csr_matrix((n, n))
+            self._windows[key] = total
+        return self._windows[key]
+
+    def top_lanes(self, n=20, measure='TEU', **window):
+        """
+        Returns the `n` largest lanes of the window (years, min_week, max_week, see matrix).
+
+        Returns:
+        --------
+        pandas.DataFrame
+            RANK, origin, destination (named after the level's columns), `measure` and SHARE
+            (% of the window total), largest first; ties keep the node order
+        """
+        matrix = self.matrix(measure, **window).tocoo()
+        shown = matrix.data > 0
+        rows, cols, data = matrix.row[shown], matrix.col[shown], matrix.data[shown]
+        if len(data) > n:
+            # Partial selection of the n largest lanes, only those are sorted
+            kept = np.argpartition(-data, n - 1)[:n]
+            threshold = data[kept].min()
+            kept = data >= threshold
+            rows, cols, data = rows[kept], cols[kept], data[kept]
+        order = np.lexsort((cols, rows, -data))[:n]
+
+        return pd.DataFrame({
+            'RANK': np.arange(1, len(order) + 1),
+            self.origin: self.nodes[rows[order]],
+            self.destination: self.nodes[cols[order]],
+            measure: data[order],
+            'SHARE': data[order] / matrix.data.sum() * 100 if len(order) else np.array([]),
+        })
+
+    def port_totals(self, measure='TEU', **window):
+        """
+        Returns the outbound and inbound totals of every node with flows in the window.
+
+        Returns:
+        --------
+        pandas.DataFrame
+            Indexed by node, with OUTBOUND, INBOUND, NET (outbound - inbound), THROUGHPUT
+            (outbound + inbound), LANES OUT and LANES IN (number of lanes), by decreasing
+            THROUGHPUT
+        """
+        matrix = self.matrix(measure, **window)
+        outbound = np.asarray(matrix.sum(axis=1)).ravel()
+        inbound = np.asarray(matrix.sum(axis=0)).ravel()
+        totals = pd.DataFrame({
+            'OUTBOUND': outbound,
+            'INBOUND': inbound,
+            'NET': outbound - inbound,
+            'THROUGHPUT': outbound + inbound,
+            'LANES OUT': np.diff(matrix.indptr),
+            'LANES IN': np.bincount(matrix.indices, minlength=len(self.nodes)),
+        }, index=pd.Index(self.nodes, name=self.level.upper()))
+        active = (totals['LANES OUT'] > 0) | (totals['LANES IN'] > 0)
+        return totals[active].sort_values('THROUGHPUT', ascending=False, kind='stable')
+
+    def centrality(self, measure='TEU', method='pagerank', damping=0.85, tol=1e-10, max_iter=100, **window):
+        """
+        Returns the centrality of every node with flows in the window.
+
+        Parameters:
+        -----------
+        measure : str
+            Measure weighting the lanes (one of LANE_MEASURES)
+        method : str
+            - 'degree': number of distinct partners (in + out) / (2 x (nodes - 1))
+            - 'strength': share of the window total flowing through the node (in + out) / 2
+            - 'pagerank': PageRank of the weighted graph (default)
+        damping : float
+            PageRank damping factor (default: 0.85)
+        tol, max_iter :
+            PageRank convergence: L1 change below `tol`, at most `max_iter` iterations
+
+        Returns:
+        --------
+        pandas.Series
+            Centrality by node, highest first
+        """
+        matrix = self.matrix(measure, **window)
+        active = (np.diff(matrix.indptr) > 0) | (np.bincount(matrix.indices, minlength=len(self.nodes)) > 0)
+        matrix = matrix[active][:, active]
+        n = matrix.shape[0]
+
+        if method == 'degree':
+            pattern = (matrix != 0).astype(float)
+            partners = np.asarray(pattern.sum(axis=1)).ravel() + np.asarray(pattern.sum(axis=0)).ravel()
+            values = partners / (2 * (n - 1)) if n > 1 else partners
+        elif method == 'strength':
+            total = matrix.sum()
+            flows = np.asarray(matrix.sum(axis=1)).ravel() + np.asarray(matrix.sum(axis=0)).ravel()
+            values = flows / (2 * total) if total else flows
+        elif method == 'pagerank':
+            outbound = np.asarray(matrix.sum(axis=1)).ravel()
+            # Row-stochastic transitions; nodes without outbound flows jump uniformly
+            transitions = sp.diags(np.divide(1.0, outbound, out=np.zeros(n), where=outbound > 0)) @ matrix
+            dangling = outbound <= 0
+            values = np.full(n, 1.0 / n) if n else np.zeros(0)
+            for _ in range(max_iter):
+                previous = values
+                values = damping * (transitions.T @ values + previous[dangling].sum() / n) + (1 - damping) / n
+                if np.abs(values - previous).sum() < tol:
+                    break
+        else:
+            raise ValueError(f"Unknown centrality method: {method}")
+
+        centrality = pd.Series(values, index=pd.Index(self.nodes[active], name=self.level.upper()), name=method)
+        return centrality.sort_values(ascending=False, kind='stable')
+
+
+def lane_graph(df, level='port', exclude_out_of_scope=True):
+    """
+    Returns the LaneGraph of `df` at `level`, built only once per dataset.
+
+    For datasets returned by data_loader.load_dataset the graph is kept and follows the new
+    versions of the dataset: only the weeks whose content changed are aggregated again (see
+    data_loader.changed_partitions). For any other DataFrame it is built on every call.
+    """
+    info = dataset_info(df)
+    if info is None:
+        return LaneGraph(level, exclude_out_of_scope).update(df)
+
+    memo = info.setdefault('lane_graphs', {})
+    key = (level, exclude_out_of_scope)
+    if key not in memo:
+        partitions = dataset_partitions(df)
+        data_version, _, selection = info['version'].partition("-")
+        followed = (info['source'], selection, level, exclude_out_of_scope)
+        previous = _graphs.get(followed)
+        # Graphs of older versions of this CSV are never followed again once a newer one is built
+        for other in [other for other, (_, _, version) in _graphs.items()
+                      if other[0] == info['source'] and version != data_version]:
+            del _graphs[other]
+
+        if previous is not None:
+            graph, previous_partitions, _ = previous
+            graph = graph.copy()
+            changed, removed = changed_partitions(previous_partitions, partitions)
+            for period in map(_period_of, removed):
+                graph.weeks.pop(period, None)
+            graph.update(df, changed)
+        else:
+            graph = LaneGraph(level, exclude_out_of_scope).update(df)
+        _graphs[followed] = (graph, partitions, data_version)
+        memo[key] = graph
+    return memo[key]
+
+
+def lane_tables(df, year, max_week, level='port', n=20, measure='TEU'):
+    """
+    Returns the YTD top lanes and the totals per node of `year` (see LaneGraph.top_lanes and
+    LaneGraph.port_totals).
+
+    Returns:
+    --------
+    tuple
+        (top_lanes, totals)
+    """
+    stage('aggregate')
+    graph = lane_graph(df, level)
+    window = {'years': [year], 'max_week': max_week}
+    return graph.top_lanes(n, measure, **window), graph.port_totals(measure, **window)
+
+
+@instrumented
+def plot_top_lanes(df, current_year, previous_year, current_week, level='port', n=15, measure='TEU'):
+    """
+    Creates a bar chart of the `n` largest YTD lanes of the current year, next to the same lanes
+    in the previous year.
+
+    Returns:
+    --------
+    fig : matplotlib.figure.Figure
+    """
+    stage('aggregate')
+    graph = lane_graph(df, level)
+    top = graph.top_lanes(n, measure, years=[current_year], max_week=current_week)
+    previous = graph.matrix(measure, years=[previous_year], max_week=current_week)
+    origins = graph.nodes.get_indexer(top[graph.origin])
+    destinations = graph.nodes.get_indexer(top[graph.destination])
+    previous_values = np.asarray(previous[origins, destinations]).ravel() if len(top) else np.zeros(0)
+
+    stage('plot')
+    fig, ax = plt.subplots(figsize=(14, max(6, 0.45 * len(top) + 2)))
+    index = np.arange(len(top))[::-1]
+    bar_height = 0.4
+    ax.barh(index + bar_height/2, top[measure], bar_height, color='#0D173F', label=f'{current_year}')
+    ax.barh(index - bar_height/2, previous_values, bar_height, color='#FF0000', label=f'{previous_year}')
+
+    ax.set_yticks(index)
+    ax.set_yticklabels(top[graph.origin] + ' → ' + top[graph.destination])
+    ax.set_xlabel(f'YTD {measure}', fontsize=12)
+    ax.set_title(f'Top {len(top)} {level.capitalize()} Lanes by {measure} - YTD W{current_week} '
+                 f'{current_year} vs {previous_year}', fontsize=14)
+    ax.legend(loc='lower right')
+    ax.grid(True, axis='x', alpha=0.3)
+    ax.get_xaxis().set_major_formatter(plt.matplotlib.ticker.StrMethodFormatter('{x:,.0f}'))
+
+    stage('layout')
+    plt.tight_layout()
+    return fig
+
+
+@instrumented
+def plot_port_balance(df, current_year, current_week, level='port', n=15, measure='TEU'):
+    """
+    Creates a bar chart of the outbound and inbound YTD flows of the `n` busiest nodes.
+
+    Returns:
+    --------
+    fig : matplotlib.figure.Figure
+    """
+    stage('aggregate')
+    totals = lane_graph(df, level).port_totals(measure, years=[current_year], max_week=current_week).head(n)
+
+    stage('plot')
+    fig, ax = plt.subplots(figsize=(14, 8))
+    index = np.arange(len(totals))
+    bar_width = 0.4
+    ax.bar(index - bar_width/2, totals['OUTBOUND'], bar_width, color='steelblue', label='Outbound')
+    ax.bar(index + bar_width/2, totals['INBOUND'], bar_width, color='lightcoral', label='Inbound')
+
+    ax.set_xticks(index)
+    ax.set_xticklabels(totals.index, rotation=45, ha='right')
+    ax.set_ylabel(f'YTD {measure}', fontsize=12)
+    ax.set_title(f'Outbound vs Inbound {measure} by {level.capitalize()} - YTD W{current_week} {current_year}',
+                 fontsize=14)
+    ax.legend()
+    ax.grid(True, axis='y', alpha=0.3)
+    ax.get_yaxis().set_major_formatter(plt.matplotlib.ticker.StrMethodFormatter('{x:,.0f}'))
+
+    stage('layout')
+    plt.tight_layout()
+    return fig
+
+
+# graph = lane_graph(config.dataset, 'zone')
+# graph.centrality('WEIGHTED', 'pagerank', years=[current_year], max_week=current_week)
+# fig = plot_top_lanes(config.dataset, current_year, current_year-1, current_week)
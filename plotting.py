@@ -0,0 +1,47 @@
+import importlib
+import os
+import sys
+
+# Lazy access to matplotlib for the chart modules.
+# Importing a chart module does not import any plotting library: pyplot, gridspec and ticker are
+# imported the first time a chart is drawn, so the aggregation functions (the *_data functions
+# of the chart modules, weekly_cube, aggregations) run at the cost of importing pandas.
+# Before pyplot is first imported the backend is pinned to MPLBACKEND when set (Jupyter sets it
+# to its inline backend), otherwise to the non-interactive Agg. Set MPLBACKEND (e.g. TkAgg) to
+# get windows from plt.show() when running the scripts from a terminal.
+
+DEFAULT_BACKEND = "Agg"
+
+
+def pin_backend():
+    """
+    Selects the matplotlib backend unless pyplot was already imported (then it is left alone).
+    """
+    if 'matplotlib.pyplot' in sys.modules:
+        return
+    import matplotlib
+
+    matplotlib.use(os.environ.get('MPLBACKEND') or DEFAULT_BACKEND)
+
+
+class _LazyModule:
+    # Stands for a module and imports it on first attribute access
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            pin_backend()
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+plt = _LazyModule('matplotlib.pyplot')
+gridspec = _LazyModule('matplotlib.gridspec')
+ticker = _LazyModule('matplotlib.ticker')
@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+
+from data_loader import dataset_info
+
+# Row selections for the filters every chart repeats on the bookings:
+#
+#     rows = select_rows(df, years=[current_year], max_week=current_week,
+#                        exclude_out_of_scope=True, notna=['AVG CONTRIBUTION'])
+#     df_current = select(df, years=[current_year], max_week=current_week, ...)
+#
+# The YEAR/WEEK range is found by binary search (np.searchsorted) on the rows ordered by
+# period (YEAR * 100 + WEEK). The ordering is computed once per dataset and is free when the
+# rows already come sorted. TRADE is compared on its categorical codes, and the remaining
+# predicates are only evaluated on the rows of the range.
+# For datasets returned by data_loader.load_dataset the selections are memoized with the
+# dataset, so charts asking for the same filter share one array of row positions.
+
+# Selections kept per dataset, the oldest are dropped first
+MAX_SELECTIONS = 64
+
+
+def _memo(df):
+    # Memo of a loaded dataset (None for any other DataFrame), dropped with the dataset
+    info = dataset_info(df)
+    if info is None:
+        return None
+    return info.setdefault('selections', {})
+
+
+def period_index(df):
+    """
+    Returns the row positions of `df` ordered by period, and the periods in that order.
+
+    Returns:
+    --------
+    tuple
+        (order, periods): order[i] is the position of the i-th row by YEAR * 100 + WEEK and
+        periods[i] its period. order is a range when the rows are already sorted.
+    """
+    memo = _memo(df)
+    if memo is not None and 'period_index' in memo:
+        return memo['period_index']
+
+    periods = df['YEAR'].to_numpy().astype(np.int32) * 100 + df['WEEK'].to_numpy().astype(np.int32)
+    if len(periods) < 2 or (periods[1:] >= periods[:-1]).all():
+        result = (np.arange(len(periods)), periods)
+    else:
+        order = np.argsort(periods, kind='stable')
+        result = (order, periods[order])
+
+    if memo is not None:
+        memo['period_index'] = result
+    return result
+
+
+def _period_rows(df, years, min_week, max_week):
+    order, periods = period_index(df)
+    if years is None:
+        if min_week is None and max_week is None:
+            return np.arange(len(df))
+        years = np.unique(periods // 100)
+    low_week = 0 if min_week is None else min_week
+    high_week = 99 if max_week is None else max_week
+
+    slices = []
+    for year in sorted(set(int(year) for year in years)):
+        low = np.searchsorted(periods, year * 100 + low_week, side='left')
+        high = np.searchsorted(periods, year * 100 + high_week, side='right')
+        slices.append(order[low:high])
+    return np.sort(np.concatenate(slices)) if slices else np.array([], dtype=np.int64)
+
+
+def _in_scope(trade, rows):
+    # True for the rows whose TRADE is not "OUT OF SCOPE" (missing trades included)
+    if isinstance(trade.dtype, pd.CategoricalDtype):
+        out_of_scope = trade.cat.categories.get_indexer(["OUT OF SCOPE"])[0]
+        if out_of_scope < 0:
+            # No such category: missing trades have code -1 too and must not match
+            return np.ones(len(rows), dtype=bool)
+        return trade.cat.codes.to_numpy()[rows] != out_of_scope
+    return trade.to_numpy()[rows] != "OUT OF SCOPE"
+
+
+def select_rows(df, years=None, min_week=None, max_week=None, exclude_out_of_scope=False, notna=()):
+    """
+    Returns the positions of the rows of `df` matching the predicates, in row order.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        DataFrame containing the booking data
+    years : list, optional
+        Years to keep (default: all)
+    min_week, max_week : int, optional
+        Inclusive week range to keep (default: all weeks)
+    exclude_out_of_scope : bool
+        Drop the bookings with TRADE "OUT OF SCOPE" (default: False)
+    notna : list
+        Columns that must be non-null, e.g. ['AVG CONTRIBUTION', 'TOTAL TEU']
+
+    Returns:
+    --------
+    numpy.ndarray
+        Row positions, usable with df.iloc / df.take. Treat it as read-only: for loaded
+        datasets it is shared with the other callers asking for the same selection.
+    """
+    years = tuple(sorted(int(year) for year in years)) if years is not None else None
+    notna = tuple(notna)
+    key = (years, min_week, max_week, bool(exclude_out_of_scope), notna)
+    memo = _memo(df)
+    if memo is not None and key in memo:
+        return memo[key]
+
+    if notna:
+        # Refine the selection without the null checks, which other filters share
+        rows = select_rows(df, years, min_week, max_week, exclude_out_of_scope)
+        keep = np.ones(len(rows), dtype=bool)
+        for column in notna:
+            keep &= ~pd.isna(df[column].to_numpy()[rows])
+        rows = rows[keep]
+    elif exclude_out_of_scope:
+        rows = select_rows(df, years, min_week, max_week)
+        rows = rows[_in_scope(df['TRADE'], rows)]
+    else:
+        rows = _period_rows(df, years, min_week, max_week)
+
+    if memo is not None:
+        if len(memo) >= MAX_SELECTIONS:
+            memo.pop(next(oldest for oldest in memo if oldest != 'period_index'))
+        rows.setflags(write=False)
+        memo[key] = rows
+    return rows
+
+
+def select(df, columns=None, **predicates):
+    """
+    Returns the rows of `df` matching `predicates` (see select_rows), only with `columns`.
+
+    Only the requested columns are copied, e.g. select(df, ['WEEK', 'TRADE', 'AVG CONTRIBUTION'],
+    years=[2025], max_week=20, exclude_out_of_scope=True). The result is always a new frame,
+    so changing it never changes `df`.
+
+    For a sqlite_backend.SqliteBookings the predicates become its WHERE clause and the
+    filtered SqliteBookings is returned, for the functions of aggregations.py to group in SQL.
+    """
+    if not isinstance(df, pd.DataFrame):
+        return df.where(**predicates)
+    rows = select_rows(df, **predicates)
+    if columns is not None:
+        df = df[list(columns)]
+    if len(rows) == len(df):
+        # Every row matches: a copy-on-write copy, no data is copied until it is modified
+        return df.copy(deep=False)
+    return df.take(rows)
@@ -0,0 +1,333 @@
+import heapq
+
+import numpy as np
+import pandas as pd
+
+from data_loader import build_schema
+from weekly_cube import DEFAULT_CHUNKSIZE, measure_column
+
+# Top-N rankings of commodities, clients or any other key by a summed measure, with the weekly
+# series of the ranked keys only.
+#
+#     top, series = top_n_series(get_cube(df, 'CLEAN BUSINESS PARTNER'), 'CLEAN BUSINESS PARTNER',
+#                                'WEIGHTED', 21, current_year, current_week,
+#                                years=[current_year, current_year-1], cumulative=True)
+#
+# The rows are read once: the key codes are summed per key with np.bincount, the top N are
+# picked with a partial selection (np.partition, only the N winners are sorted), and the weekly
+# series of the winners come from the same key codes through a code -> rank lookup table
+# instead of filtering the frame again with .isin(labels).
+# For input that does not fit in memory, stream_top_n feeds the chunks of the CSV to a
+# Space-Saving sketch, which keeps a bounded number of counters.
+
+# Counters kept by the Space-Saving sketch per ranked key when no capacity is given
+DEFAULT_CAPACITY_FACTOR = 20
+
+
+def _key_codes(keys):
+    # Integer codes (-1 for missing) and labels of a key column, categories are used as-is
+    if isinstance(keys.dtype, pd.CategoricalDtype):
+        return keys.cat.codes.to_numpy(), keys.cat.categories
+    codes, labels = pd.factorize(keys, sort=True)
+    return codes, labels
+
+
+def _measure_values(rows, measure):
+    # Values of `measure` for cube rows or bookings (where WEIGHTED is TOTAL TEU x AVG CONTRIBUTION)
+    column = measure_column(measure)
+    if column not in rows.columns and measure == 'WEIGHTED':
+        return rows['TOTAL TEU'] * rows['AVG CONTRIBUTION']
+    return rows[column]
+
+
+def _select_top(codes, totals, n):
+    # Partial selection of the n largest totals; ties keep the lower code first, like
+    # groupby(...).sum().nlargest(n) which sees the keys in code order
+    if len(totals) > n:
+        threshold = np.partition(totals, len(totals) - n)[len(totals) - n]
+        kept = totals >= threshold
+        codes, totals = codes[kept], totals[kept]
+    order = np.lexsort((codes, -totals))[:n]
+    return codes[order], totals[order]
+
+
+def top_keys(keys, values, n, mask=None):
+    """
+    Ranks the values of `keys` by the sum of `values` and returns the `n` largest.
+
+    Parameters:
+    -----------
+    keys : pandas.Series
+        Key of each row (categorical or not)
+    values : array-like
+        Value of each row, missing values count as 0
+    n : int
+        Number of keys to return
+    mask : array-like of bool, optional
+        Rows to rank on (default: all)
+
+    Returns:
+    --------
+    pandas.Series
+        Sum of `values` of the top keys, largest first, indexed by key (as str). Only keys
+        with at least one row are ranked.
+    """
+    codes, labels = _key_codes(keys)
+    values = np.nan_to_num(np.asarray(values, dtype=float))
+    valid = codes >= 0
+    if mask is not None:
+        valid &= np.asarray(mask, dtype=bool)
+    codes, values = codes[valid], values[valid]
+
+    totals = np.bincount(codes, weights=values, minlength=len(labels))
+    present = np.flatnonzero(np.bincount(codes, minlength=len(labels)))
+    top, top_totals = _select_top(present, totals[present], n)
+    return pd.Series(top_totals, index=pd.Index(np.asarray(labels)[top].astype(str), name=keys.name))
+
+
+def top_n_series(rows, key, measure, n, year, max_week, years=None, cumulative=False):
+    """
+    Ranks `key` by `measure` over weeks 1 to `max_week` of `year` and returns the weekly series
+    of the top `n` keys for each year of `years`.
+
+    Parameters:
+    -----------
+    rows : pandas.DataFrame
+        Cube returned by weekly_cube.get_cube(df, key), or bookings with YEAR, WEEK and `key`
+        (where 'WEIGHTED' is TOTAL TEU x AVG CONTRIBUTION)
+    key : str
+        Column to rank, e.g. 'COMMODITY HS CHAPTER' or 'CLEAN BUSINESS PARTNER'
+    measure : str
+        Column (or alias, see weekly_cube.MEASURE_ALIASES) to sum, e.g. 'TEU', 'TONS',
+        'WEIGHTED' or 'WEIGHTED CONTRIB'
+    n : int
+        Number of keys to return
+    year : int
+        Year the ranking is based on
+    max_week : int
+        Maximum week number to include
+    years : list, optional
+        Years to return the series of (default: [year])
+    cumulative : bool
+        Return YTD cumulative sums instead of weekly sums (default: False)
+
+    Returns:
+    --------
+    tuple
+        (top, series): the ranked keys (list of str, largest first) and a dict year ->
+        WEEK x `key` table indexed by every week from 1 to `max_week`, one column per ranked key
+        with data in that year. Weekly sums are NaN where a key has no data; cumulative sums
+        carry the previous value forward (0 before the first week with data), like
+        weekly_cube.cumulative_matrix.
+    """
+    years = [year] if years is None else list(years)
+
+    # One pass over the selected rows: key codes, week and year slot of every row
+    selected = (rows['WEEK'] <= max_week) & rows['YEAR'].isin(years + [year])
+    selected = selected.to_numpy()
+    codes, labels = _key_codes(rows[key])
+    codes = codes[selected]
+    values = _measure_values(rows, measure).to_numpy(dtype=float, na_value=np.nan)[selected]
+    weeks = rows['WEEK'].to_numpy()[selected].astype(np.int64)
+    row_years = rows['YEAR'].to_numpy()[selected]
+
+    ranked = _ranked_codes(codes, values, row_years == year, len(labels), n)
+
+    # Code -> rank lookup, -1 for the keys that are not ranked
+    rank_of = np.full(len(labels) + 1, -1, dtype=np.int64)
+    rank_of[ranked] = np.arange(len(ranked))
+    ranks = rank_of[codes]
+    top = np.asarray(labels)[ranked].astype(str).tolist()
+
+    series = {}
+    for series_year in years:
+        in_year = (ranks >= 0) & (row_years == series_year)
+        series[series_year] = _week_matrix(ranks[in_year], weeks[in_year], values[in_year],
+                                           top, max_week, cumulative, key)
+    return top, series
+
+
+def _ranked_codes(codes, values, ranking_rows, n_labels, n):
+    # Codes of the n keys with the largest totals on the ranking rows (missing keys are -1)
+    valid = ranking_rows & (codes >= 0)
+    totals = np.bincount(codes[valid], weights=np.nan_to_num(values[valid]), minlength=n_labels)
+    present = np.flatnonzero(np.bincount(codes[valid], minlength=n_labels))
+    return _select_top(present, totals[present], n)[0]
+
+
+def _week_matrix(ranks, weeks, values, top, max_week, cumulative, key):
+    # WEEK x ranked key table from the rank and week of each row
+    shape = (max_week + 1, len(top))
+    cells = weeks * len(top) + ranks
+    sums = np.bincount(cells, weights=np.nan_to_num(values), minlength=shape[0] * shape[1]).reshape(shape)
+    counts = np.bincount(cells[~np.isnan(values)], minlength=shape[0] * shape[1]).reshape(shape)
+    present = np.bincount(ranks, minlength=len(top)) > 0
+
+    if cumulative:
+        matrix = sums.cumsum(axis=0)
+    else:
+        matrix = np.where(counts > 0, sums, np.nan)
+    matrix = pd.DataFrame(matrix[1:], index=pd.RangeIndex(1, max_week + 1, name='WEEK'),
+                          columns=pd.Index(top, name=key))
+    return matrix.loc[:, present]
+
+
+class SpaceSaving:
+    """
+    Space-Saving sketch of the keys with the largest totals in a stream of weighted updates.
+
+    At most `capacity` keys are monitored. When an unmonitored key arrives and the sketch is
+    full, it replaces the key with the smallest count and inherits that count as its error.
+    A monitored key's count overestimates its true total by at most its error, and every key
+    whose total exceeds total / capacity is monitored. With `n_weeks`, each monitored key also
+    keeps its weekly sums since it entered the sketch (exact when its error is 0).
+
+    The guarantees hold for non-negative weights (TEU, TONS). With signed measures (weighted
+    contribution), an unmonitored key only enters the sketch with a positive update.
+
+    Parameters:
+    -----------
+    capacity : int
+        Number of counters kept
+    n_weeks : int, optional
+        Keep per-week sums for weeks 1 to `n_weeks`
+    """
+
+    def __init__(self, capacity, n_weeks=None):
+        self.capacity = capacity
+        self.n_weeks = n_weeks
+        self.total = 0.0
+        # key -> [count, error, weekly sums or None]
+        self.counters = {}
+        # (count, key) entries, stale entries are skipped when popped
+        self._heap = []
+
+    def update(self, keys, weights, weeks=None):
+        """
+        Adds a chunk of updates: one key and weight per row (and week, with n_weeks).
+
+        The chunk is summed per key first, so the sketch sees each key once per chunk.
+        """
+        frame = pd.DataFrame({'key': np.asarray(keys), 'weight': np.nan_to_num(np.asarray(weights, dtype=float))})
+        if self.n_weeks is not None:
+            frame['week'] = np.asarray(weeks)
+            frame = frame[frame['week'].between(1, self.n_weeks)]
+        frame = frame[frame['key'].notna()]
+        if frame.empty:
+            return
+
+        totals = frame.groupby('key', sort=False)['weight'].sum().sort_values(ascending=False)
+        weekly = None
+        if self.n_weeks is not None:
+            weekly = frame.groupby(['key', 'week'], sort=False)['weight'].sum()
+        self.total += totals.sum()
+
+        for chunk_key, weight in totals.items():
+            counter = self.counters.get(chunk_key)
+            if counter is None:
+                if weight <= 0:
+                    continue
+                counter = self._admit(chunk_key)
+            counter[0] += weight
+            heapq.heappush(self._heap, (counter[0], chunk_key))
+            if weekly is not None:
+                key_weeks = weekly.loc[chunk_key]
+                np.add.at(counter[2], key_weeks.index.to_numpy(dtype=np.int64), key_weeks.to_numpy())
+
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(counter[0], key) for key, counter in self.counters.items()]
+            heapq.heapify(self._heap)
+
+    def _admit(self, key):
+        error = 0.0
+        if len(self.counters) >= self.capacity:
+            error, evicted = self._pop_min()
+            del self.counters[evicted]
+        weeks = np.zeros(self.n_weeks + 1) if self.n_weeks is not None else None
+        counter = [error, error, weeks]
+        self.counters[key] = counter
+        return counter
+
+    def _pop_min(self):
+        while True:
+            count, key = heapq.heappop(self._heap)
+            counter = self.counters.get(key)
+            if counter is not None and counter[0] == count:
+                return count, key
+
+    def top(self, n):
+        """
+        Returns the `n` monitored keys with the largest counts.
+
+        Returns:
+        --------
+        pandas.DataFrame
+            Indexed by key, largest first, with columns 'count' (upper bound of the total),
+            'error' and 'guaranteed' (count - error, lower bound of the total)
+        """
+        table = pd.DataFrame([(key, counter[0], counter[1]) for key, counter in self.counters.items()],
+                             columns=['key', 'count', 'error']).set_index('key')
+        table['guaranteed'] = table['count'] - table['error']
+        return table.sort_values('count', ascending=False, kind='stable').head(n)
+
+    def weekly(self, keys, cumulative=False):
+        """
+        Returns the weekly sums of monitored `keys` as a WEEK x key table (needs n_weeks).
+        """
+        matrix = pd.DataFrame({key: self.counters[key][2][1:] for key in keys},
+                              index=pd.RangeIndex(1, self.n_weeks + 1, name='WEEK'))
+        return matrix.cumsum() if cumulative else matrix
+
+
+def stream_top_n(csv_path, key, measure, n, year, max_week, capacity=None,
+                 exclude_out_of_scope=True, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Ranks `key` by `measure` over weeks 1 to `max_week` of `year`, reading the CSV in chunks.
+
+    Memory stays bounded by `chunksize` and `capacity` whatever the number of distinct keys.
+    The ranking and the series are exact when no key had to be evicted (fewer distinct keys
+    than `capacity`); otherwise see SpaceSaving for the error bounds.
+
+    Parameters:
+    -----------
+    csv_path : str
+        Path to the CSV file with contribution data
+    key : str
+        Column to rank
+    measure : str
+        'TEU', 'TONS', 'WEIGHTED' (TOTAL TEU x AVG CONTRIBUTION) or any summable column
+    n : int
+        Number of keys to return
+    year : int
+        Year to rank
+    max_week : int
+        Maximum week number to include
+    capacity : int, optional
+        Counters kept (default: DEFAULT_CAPACITY_FACTOR x n)
+    exclude_out_of_scope : bool
+        Drop the bookings with TRADE "OUT OF SCOPE" (default: True)
+    chunksize : int
+        Number of rows parsed at a time (default: weekly_cube.DEFAULT_CHUNKSIZE)
+
+    Returns:
+    --------
+    tuple
+        (ranking, weekly): the ranking table of SpaceSaving.top and the WEEK x key weekly sums
+        of the ranked keys
+    """
+    sketch = SpaceSaving(capacity or DEFAULT_CAPACITY_FACTOR * n, n_weeks=max_week)
+    columns = {'TOTAL TEU', 'AVG CONTRIBUTION'} if measure == 'WEIGHTED' else {measure_column(measure)}
+    needed = {'YEAR', 'WEEK', 'TRADE', key} | columns
+    schema = {column: dtype for column, dtype in build_schema().items() if column in needed}
+
+    reader = pd.read_csv(csv_path, encoding="latin1", dtype=schema, usecols=lambda column: column in needed,
+                         chunksize=chunksize)
+    for chunk in reader:
+        mask = (chunk['YEAR'] == year) & (chunk['WEEK'] <= max_week)
+        if exclude_out_of_scope:
+            mask &= chunk['TRADE'] != "OUT OF SCOPE"
+        chunk = chunk[mask]
+        sketch.update(chunk[key].astype(object), _measure_values(chunk, measure), chunk['WEEK'])
+
+    ranking = sketch.top(n)
+    return ranking, sketch.weekly(ranking.index)
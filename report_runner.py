@@ -0,0 +1,361 @@
+import importlib
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import instrumentation
+
+# Renders a list of figures concurrently, one worker process per core, and writes the images.
+# A figure is described by a spec dict:
+#   {'name': 'teu_cumulative',                                   # output file name
+#    'family': 'cumulative',                                     # figure family, see FAMILIES
+#    'builder': 'cumsums_teu_tons_contrib:plot_cumulative_comparison',
+#    'kwargs': {'current_year': 2025, ...}}                      # everything but the DataFrame
+# Every builder is called as builder(df, **kwargs), df being the dataset described by `data`
+# (the keyword arguments of data_loader.load_dataset), loaded once per worker. Before starting
+# the workers, the parent process builds the columnar cache and the weekly cubes (see
+# prepare_dataset), so on a cold cache the workers only read finished files.
+# With a cache folder, figures already rendered for the same builder, arguments and data are
+# copied from the figure cache (see figure_cache.py) instead of being rendered again.
+
+# Figure families of the weekly pack, the unit of selection of weekly_report.py
+FAMILIES = ['contribution', 'volume', 'cumulative', 'clients', 'commodities', 'equipment', 'lost_slots', 'lanes']
+
+
+def weekly_pack_specs(current_year, current_week, trades, previous_year=None, history_years=None):
+    """
+    Returns the figure specs of the weekly report pack.
+
+    Parameters:
+    -----------
+    current_year : int
+        Current year to analyze
+    current_week : int
+        Maximum week number to include in analysis
+    trades : list
+        List of trade names to analyze
+    previous_year : int, optional
+        Previous year to compare against (default: current_year - 1)
+    history_years : list, optional
+        Years of the multi-year overlays (default: no multi-year figures)
+
+    Returns:
+    --------
+    list
+        Figure specs, see the module comment
+    """
+    if previous_year is None:
+        previous_year = current_year - 1
+
+    yoy = {'current_year': current_year, 'previous_year': previous_year, 'current_week': current_week}
+    yoy_trades = dict(yoy, trades=trades)
+
+    specs = [
+        {'name': 'contrib_comparison', 'family': 'contribution',
+         'builder': 'trade_contribution:contrib_comparison', 'kwargs': yoy_trades},
+        {'name': 'weighted_contrib_comparison', 'family': 'contribution',
+         'builder': 'trade_contribution:weighted_contrib_comparison', 'kwargs': yoy_trades},
+        {'name': 'teu_comparison', 'family': 'volume', 'builder': 'trade_teu_tons:contrib_comparison',
+         'kwargs': dict(yoy_trades, teus_or_tons='TEU')},
+        {'name': 'tons_comparison', 'family': 'volume', 'builder': 'trade_teu_tons:contrib_comparison',
+         'kwargs': dict(yoy_trades, teus_or_tons='TONS')},
+        {'name': 'teu_cumulative', 'family': 'cumulative',
+         'builder': 'cumsums_teu_tons_contrib:plot_cumulative_comparison', 'kwargs': dict(yoy_trades, metric_type='TEU')},
+        {'name': 'tons_cumulative', 'family': 'cumulative',
+         'builder': 'cumsums_teu_tons_contrib:plot_cumulative_comparison', 'kwargs': dict(yoy_trades, metric_type='TONS')},
+        {'name': 'weighted_cumulative', 'family': 'cumulative',
+         'builder': 'cumsums_teu_tons_contrib:plot_cumulative_comparison',
+         'kwargs': dict(yoy_trades, metric_type='WEIGHTED')},
+        {'name': 'client_pareto', 'family': 'clients', 'builder': 'key_account_analysis:client_pareto_analysis',
+         'kwargs': {'year': current_year, 'week': current_week, 'trades': trades}},
+        {'name': 'client_concentration', 'family': 'clients', 'builder': 'key_account_analysis:plot_client_concentration',
+         'kwargs': {'trades': trades, 'metric': 'HHI', 'years': [current_year, previous_year], 'max_week': current_week}},
+        {'name': 'commodity_cumulative', 'family': 'commodities',
+         'builder': 'commodities_clients_cumsum:plot_commodity_cumulative_comparison', 'kwargs': yoy},
+        {'name': 'client_cumulative', 'family': 'clients',
+         'builder': 'commodities_clients_cumsum:plot_client_cumulative_comparison', 'kwargs': yoy},
+        {'name': 'equipment_yoy', 'family': 'equipment', 'builder': 'equipment_analysis:equipment_comparison_yoy',
+         'kwargs': {'year_first': current_year, 'year_second': previous_year, 'week': current_week}},
+        {'name': 'equipment_by_trade', 'family': 'equipment',
+         'builder': 'equipment_analysis:equipment_doughnut_multiple_trades',
+         'kwargs': {'year_first': current_year, 'year_second': previous_year, 'week': current_week}},
+        {'name': 'lost_slots_by_trade', 'family': 'lost_slots', 'builder': 'teu_lost_slots:create_teu_area_chart',
+         'kwargs': {'current_week': current_week, 'current_year': current_year, 'previous_year': previous_year}},
+        {'name': 'lost_slots_cumulative', 'family': 'lost_slots',
+         'builder': 'teu_lost_slots:create_ytd_comparison_chart',
+         'kwargs': {'current_week': current_week, 'current_year': current_year, 'previous_year': previous_year}},
+        {'name': 'lost_slots_trade_comparison', 'family': 'lost_slots',
+         'builder': 'teu_lost_slots:create_ytd_trade_comparison_chart',
+         'kwargs': {'current_week': current_week, 'current_year': current_year, 'previous_year': previous_year}},
+        {'name': 'lost_slots_worst_voyages', 'family': 'lost_slots', 'builder': 'teu_lost_slots:plot_worst_voyages',
+         'kwargs': {'current_year': current_year, 'current_week': current_week}},
+        {'name': 'top_port_lanes', 'family': 'lanes', 'builder': 'lane_graph:plot_top_lanes', 'kwargs': yoy},
+        {'name': 'port_balance', 'family': 'lanes', 'builder': 'lane_graph:plot_port_balance',
+         'kwargs': {'current_year': current_year, 'current_week': current_week}},
+    ]
+    if history_years:
+        history = {'years': list(history_years), 'current_week': current_week, 'trades': trades}
+        specs += [
+            {'name': f'{metric.lower()}_multi_year', 'family': 'cumulative',
+             'builder': 'cumsums_teu_tons_contrib:plot_multi_year_comparison',
+             'kwargs': dict(history, metric_type=metric)}
+            for metric in ['TEU', 'TONS', 'WEIGHTED']
+        ]
+    return specs
+
+
+def weekly_data_specs(current_year, current_week, trades, previous_year=None, history_years=None):
+    """
+    Returns the aggregate tables of the weekly report pack, the data behind weekly_pack_specs.
+
+    A data spec is {'name', 'family', 'function': 'module:function', 'kwargs', 'tables'}: the
+    function is called as function(df, **kwargs) and returns a tuple whose items are named by
+    'tables' (None for items that are not tables, e.g. a ranking list). With `history_years`
+    the multi-year tables of those years are included.
+    """
+    if previous_year is None:
+        previous_year = current_year - 1
+
+    yoy = {'current_year': current_year, 'previous_year': previous_year, 'current_week': current_week}
+    years = [str(current_year), str(previous_year)]
+
+    specs = [
+        {'name': 'contrib_comparison', 'family': 'contribution',
+         'function': 'trade_contribution:contrib_comparison_data', 'kwargs': yoy, 'tables': years},
+        {'name': 'weighted_contrib_comparison', 'family': 'contribution',
+         'function': 'trade_contribution:weighted_contrib_comparison_data', 'kwargs': dict(yoy, trades=trades),
+         'tables': years},
+        {'name': 'teu_comparison', 'family': 'volume', 'function': 'trade_teu_tons:teu_tons_comparison_data',
+         'kwargs': dict(yoy, teus_or_tons='TEU'), 'tables': years},
+        {'name': 'tons_comparison', 'family': 'volume', 'function': 'trade_teu_tons:teu_tons_comparison_data',
+         'kwargs': dict(yoy, teus_or_tons='TONS'), 'tables': years},
+        {'name': 'teu_cumulative', 'family': 'cumulative',
+         'function': 'cumsums_teu_tons_contrib:cumulative_comparison_data', 'kwargs': dict(yoy, metric_type='TEU'),
+         'tables': years},
+        {'name': 'tons_cumulative', 'family': 'cumulative',
+         'function': 'cumsums_teu_tons_contrib:cumulative_comparison_data', 'kwargs': dict(yoy, metric_type='TONS'),
+         'tables': years},
+        {'name': 'weighted_cumulative', 'family': 'cumulative',
+         'function': 'cumsums_teu_tons_contrib:cumulative_comparison_data',
+         'kwargs': dict(yoy, metric_type='WEIGHTED'), 'tables': years},
+        {'name': 'client_pareto', 'family': 'clients', 'function': 'key_account_analysis:client_pareto_data',
+         'kwargs': {'year': current_year, 'week': current_week, 'trades': trades},
+         'tables': ['distribution', 'summary']},
+        {'name': 'client_concentration', 'family': 'clients',
+         'function': 'key_account_analysis:client_concentration_data',
+         'kwargs': {'trades': trades, 'years': [current_year, previous_year], 'max_week': current_week},
+         'tables': ['metrics']},
+        {'name': 'commodity_cumulative', 'family': 'commodities',
+         'function': 'commodities_clients_cumsum:commodity_cumulative_data', 'kwargs': yoy,
+         'tables': [None] + years},
+        {'name': 'client_cumulative', 'family': 'clients',
+         'function': 'commodities_clients_cumsum:client_cumulative_data', 'kwargs': yoy,
+         'tables': [None] + years},
+        {'name': 'equipment_mix', 'family': 'equipment', 'function': 'equipment_analysis:equipment_mix_data',
+         'kwargs': {'years': [current_year, previous_year], 'week': current_week}, 'tables': ['mix']},
+        {'name': 'lost_slots_voyages', 'family': 'lost_slots', 'function': 'teu_lost_slots:lost_slot_data',
+         'kwargs': {'years': [current_year, previous_year], 'max_week': current_week}, 'tables': ['voyages']},
+        {'name': 'lost_slots_worst_voyages', 'family': 'lost_slots', 'function': 'teu_lost_slots:worst_voyages',
+         'kwargs': {'year': current_year, 'max_week': current_week}, 'tables': ['worst']},
+        {'name': 'port_lanes', 'family': 'lanes', 'function': 'lane_graph:lane_tables',
+         'kwargs': {'year': current_year, 'max_week': current_week}, 'tables': ['top', 'ports']},
+    ]
+    if history_years:
+        specs += [
+            {'name': f'{metric.lower()}_multi_year', 'family': 'cumulative',
+             'function': 'cumsums_teu_tons_contrib:multi_year_comparison_data',
+             'kwargs': {'years': list(history_years), 'current_week': current_week, 'metric_type': metric},
+             'tables': ['values', 'deltas']}
+            for metric in ['TEU', 'TONS', 'WEIGHTED']
+        ]
+    return specs
+
+
+def write_data_tables(specs, df, output_dir):
+    """
+    Computes the tables of data `specs` on `df` and writes each one to `output_dir` as
+    <name>_<table>.csv. Never raises: failures are reported in the results.
+
+    Returns:
+    --------
+    list
+        One dict per spec: {'name': str, 'paths': list, 'seconds': float, 'error': str or None}
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    for spec in specs:
+        start = time.perf_counter()
+        result = {'name': spec['name'], 'paths': [], 'seconds': 0.0, 'error': None}
+        try:
+            module_name, function_name = spec['function'].split(':')
+            function = getattr(importlib.import_module(module_name), function_name)
+            output = function(df, **spec.get('kwargs', {}))
+            if not isinstance(output, tuple):
+                output = (output,)
+            for table_name, table in zip(spec['tables'], output):
+                if table_name is None:
+                    continue
+                path = os.path.join(output_dir, f"{spec['name']}_{table_name}.csv")
+                table.to_csv(path)
+                result['paths'].append(path)
+        except Exception:
+            result['error'] = traceback.format_exc()
+        result['seconds'] = time.perf_counter() - start
+        results.append(result)
+    return results
+
+
+def _init_worker():
+    # Headless backend, picked up by matplotlib whenever it gets imported
+    os.environ['MPLBACKEND'] = 'Agg'
+    if 'matplotlib' in sys.modules:
+        sys.modules['matplotlib'].use('Agg')
+
+
+def prepare_dataset(data):
+    """
+    Loads the dataset described by `data` and materializes its weekly cubes, then deletes the
+    cubes of older data versions (see weekly_cube.prune_cubes).
+
+    run_report calls it before starting its workers, so that they find the columnar cache and
+    the cubes already built instead of all building them at once.
+    """
+    from data_loader import load_dataset
+    from weekly_cube import materialize_cubes, prune_cubes
+
+    df = load_dataset(**data)
+    materialize_cubes(df)
+    prune_cubes(df)
+    return df
+
+
+def render_figure(spec, data, output_dir, fmt='png', dpi=100, cache_dir=None, cache_max_bytes=None):
+    """
+    Builds one figure and saves it to `output_dir`. Never raises: failures are reported in the result.
+
+    Returns:
+    --------
+    dict
+        {'name': str, 'path': str or None, 'seconds': float, 'error': str or None,
+         'cached': bool (True when copied from the figure cache),
+         'stages': list (instrumentation events of this figure, only when instrumentation is on)}
+    """
+    from data_loader import load_dataset
+
+    start = time.perf_counter()
+    first_event = len(instrumentation.events)
+    result = {'name': spec['name'], 'path': None, 'seconds': 0.0, 'error': None, 'cached': False}
+    plt = None
+    try:
+        module_name, function_name = spec['builder'].split(':')
+        builder = getattr(importlib.import_module(module_name), function_name)
+        kwargs = spec.get('kwargs', {})
+        df = load_dataset(**data)
+        path = os.path.join(output_dir, f"{spec['name']}.{fmt}")
+
+        cache = key = None
+        if cache_dir is not None:
+            from figure_cache import DEFAULT_MAX_BYTES, FigureCache, slice_fingerprint
+
+            cache = FigureCache(cache_dir, cache_max_bytes or DEFAULT_MAX_BYTES)
+            key = cache.key(builder, kwargs, slice_fingerprint(df, kwargs), fmt, dpi)
+            cached_path = cache.get(key, fmt)
+            if cached_path is not None:
+                shutil.copyfile(cached_path, path)
+                result['path'] = path
+                result['cached'] = True
+                return result
+
+        from plotting import plt
+
+        fig = builder(df, **kwargs)
+        if fig is None:
+            # Some builders draw on the current figure and return nothing
+            fig = plt.gcf()
+
+        with instrumentation.measure('save', run=getattr(builder, '__qualname__', None)):
+            fig.savefig(path, dpi=dpi, bbox_inches='tight')
+        result['path'] = path
+        if cache is not None:
+            cache.put(key, path, fmt)
+    except Exception:
+        result['error'] = traceback.format_exc()
+    finally:
+        if plt is not None:
+            plt.close('all')
+        result['seconds'] = time.perf_counter() - start
+        if instrumentation.enabled:
+            result['stages'] = instrumentation.events[first_event:]
+    return result
+
+
+def run_report(specs, data, output_dir, jobs=None, fmt='png', dpi=100, cache_dir=None,
+               cache_max_bytes=None):
+    """
+    Renders every figure of `specs` in worker processes and writes them to `output_dir`.
+
+    A figure that fails does not stop the others; its error is reported in the results.
+
+    Parameters:
+    -----------
+    specs : list
+        Figure specs (see weekly_pack_specs)
+    data : dict
+        Keyword arguments of data_loader.load_dataset describing the dataset, e.g.
+        {'csv_path': 'vol_contrib_data.csv', 'years': [2025, 2024], 'max_week': 20}
+    output_dir : str
+        Folder the images are written to (created if needed)
+    jobs : int, optional
+        Number of worker processes (default: number of cores). 1 renders in this process.
+    fmt : str
+        Image format, e.g. 'png' or 'svg' (default: 'png')
+    dpi : int
+        Resolution of raster images (default: 100)
+    cache_dir : str, optional
+        Folder of the figure cache (default: no caching)
+    cache_max_bytes : int, optional
+        Size limit of the figure cache (default: figure_cache.DEFAULT_MAX_BYTES)
+
+    Returns:
+    --------
+    list
+        One result dict per spec, in the order of `specs` (see render_figure). The 'cached'
+        flags give the cache hits and misses of the run.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    if jobs == 1:
+        _init_worker()
+        return [render_figure(spec, data, output_dir, fmt, dpi, cache_dir, cache_max_bytes) for spec in specs]
+
+    try:
+        prepare_dataset(data)
+    except Exception:
+        # Every figure then fails on the same error, reported in its result
+        pass
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=min(jobs, len(specs)) or 1, mp_context=context,
+                             initializer=_init_worker) as executor:
+        futures = {executor.submit(render_figure, spec, data, output_dir, fmt, dpi, cache_dir,
+                                   cache_max_bytes): spec['name']
+                   for spec in specs}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+                # Stage timings recorded in the worker join this process's instrumentation report
+                instrumentation.add_events(results[name].get('stages', []))
+            except BrokenProcessPool:
+                # A worker died (e.g. out of memory), the figures it held are lost
+                results[name] = {'name': name, 'path': None, 'seconds': 0.0,
+                                 'error': 'worker process terminated abruptly', 'cached': False}
+    return [results[spec['name']] for spec in specs]
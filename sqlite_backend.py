@@ -0,0 +1,311 @@
+import argparse
+import json
+import os
+import sqlite3
+
+import pandas as pd
+
+from data_loader import (FLOAT_COLUMNS, INTEGER_COLUMNS, build_schema, cache_paths, encode_columns,
+                         file_fingerprint, read_column_names)
+from weekly_cube import BASE_DIMENSIONS, DEFAULT_CHUNKSIZE, SUM_MEASURES
+
+# Optional SQLite copy of the extract, for ad-hoc questions and for running the cube-based
+# charts without loading the bookings into memory (sqlite3 ships with Python, no service needed).
+#
+#     bookings = connect("vol_contrib_data.csv")        # built on first use, rebuilt when the CSV changes
+#     bookings.ytd_total(2025, 20, trade="EUR-US")       # point query, answered from an index
+#     bookings.where(years=[2025], max_week=20).weighted_sums('AVG CONTRIBUTION', 'TOTAL TEU', 'TRADE')
+#     read_sql(bookings, 'SELECT TRADE, COUNT(*) FROM bookings GROUP BY TRADE')
+#     fig = plot_cumulative_comparison(bookings, 2025, 2024, 20, trades)
+#
+# The database is written next to the columnar cache (<cache_dir>/<stem>.sqlite). A
+# SqliteBookings can be passed instead of the DataFrame to aggregations.weighted_sums,
+# weighted_average, weekly_cube.build_cube and get_cube: their group-bys then run as SQL and
+# return the same frames as on the DataFrame (same layout and dtypes, sums equal up to
+# floating-point rounding).
+# From the command line: python sqlite_backend.py vol_contrib_data.csv "SELECT ..."
+
+TABLE_NAME = "bookings"
+
+# Covering indexes: the period index holds the measures, so YTD sums never read the table
+INDEXES = {
+    'idx_period_trade': ['YEAR', 'WEEK', 'TRADE', 'TOTAL TEU', 'TEU (WITHOUT LS)', 'TONS', 'AVG CONTRIBUTION',
+                         'WEIGHTED CONTRIB'],
+    'idx_client': ['CLEAN BUSINESS PARTNER', 'YEAR', 'WEEK', 'TOTAL TEU', 'AVG CONTRIBUTION', 'WEIGHTED CONTRIB'],
+    'idx_commodity': ['COMMODITY HS CHAPTER', 'YEAR', 'WEEK', 'TOTAL TEU', 'AVG CONTRIBUTION', 'WEIGHTED CONTRIB'],
+}
+
+
+def _quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def database_path(csv_path, cache_dir=None):
+    """
+    Returns the path of the SQLite copy of `csv_path` (default: .vol_cache next to the CSV).
+    """
+    data_root = cache_paths(csv_path, cache_dir)[0]
+    return data_root + ".sqlite"
+
+
+def build_database(csv_path, db_path=None, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Bulk-loads the CSV into a new SQLite database, reading it in chunks of `chunksize` rows,
+    then creates the INDEXES.
+
+    The database is written to a temporary file first and renamed when complete.
+
+    Returns:
+    --------
+    str
+        Path of the database
+    """
+    db_path = db_path or database_path(csv_path)
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    # Taken before reading, so a CSV replaced during the load is seen as changed next time
+    fingerprint = file_fingerprint(csv_path)
+    tmp_path = f"{db_path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    columns = read_column_names()
+    types = {column: 'INTEGER' for column in INTEGER_COLUMNS}
+    types.update({column: 'REAL' for column in FLOAT_COLUMNS})
+    definition = ", ".join(f"{_quote(column)} {types.get(column, '')}".strip() for column in columns)
+
+    connection = sqlite3.connect(tmp_path)
+    try:
+        # Nothing to protect during the bulk load: the file is only renamed once complete
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute(f"CREATE TABLE {TABLE_NAME} ({definition})")
+        reader = pd.read_csv(csv_path, encoding="latin1", dtype=build_schema(columns), chunksize=chunksize)
+        for chunk in reader:
+            chunk[columns].to_sql(TABLE_NAME, connection, if_exists='append', index=False)
+        for name, indexed in INDEXES.items():
+            connection.execute(f"CREATE INDEX {name} ON {TABLE_NAME} ({', '.join(map(_quote, indexed))})")
+        connection.execute("ANALYZE")
+        connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        connection.execute("INSERT INTO meta VALUES ('sha256', ?)", (fingerprint['sha256'],))
+        connection.execute("INSERT INTO meta VALUES ('fingerprint', ?)", (json.dumps(fingerprint),))
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(tmp_path, db_path)
+    return db_path
+
+
+def _database_fingerprint(db_path):
+    # Fingerprint of the CSV the database was built from (see data_loader.file_fingerprint)
+    try:
+        connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            meta = dict(connection.execute("SELECT key, value FROM meta").fetchall())
+        finally:
+            connection.close()
+    except sqlite3.Error:
+        return None
+    if 'fingerprint' in meta:
+        return json.loads(meta['fingerprint'])
+    # Databases built before the size and modification time were recorded
+    return {'sha256': meta['sha256']} if 'sha256' in meta else None
+
+
+def connect(csv_path, db_path=None, rebuild=False, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Opens the SQLite copy of `csv_path`, building it when it does not exist, when `rebuild`
+    is True or when the CSV's content changed since it was built. The CSV is only hashed when
+    its size or modification time differ from the ones recorded in the database.
+
+    Returns:
+    --------
+    SqliteBookings
+        Handle on the whole bookings table
+    """
+    db_path = db_path or database_path(csv_path)
+    built_from = _database_fingerprint(db_path) if os.path.exists(db_path) else None
+    if rebuild or built_from is None:
+        build_database(csv_path, db_path, chunksize)
+    else:
+        fingerprint = file_fingerprint(csv_path, known=built_from)
+        if fingerprint['sha256'] != built_from['sha256']:
+            build_database(csv_path, db_path, chunksize)
+        elif fingerprint != built_from:
+            # Same content, touched or built before the fingerprint was recorded: record the
+            # current size and modification time so the next connect does not hash it again
+            connection = sqlite3.connect(db_path)
+            try:
+                connection.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (json.dumps(fingerprint),))
+                connection.commit()
+            finally:
+                connection.close()
+    return SqliteBookings(db_path)
+
+
+def read_sql(bookings, sql, params=()):
+    """
+    Runs an ad-hoc query on the database of `bookings` and returns the result as a DataFrame.
+    """
+    return pd.read_sql_query(sql, bookings.connection, params=params)
+
+
+class SqliteBookings:
+    """
+    The bookings table of a SQLite database, optionally restricted by where().
+
+    Parameters:
+    -----------
+    db_path : str
+        Database written by build_database
+    cache_dir : str, optional
+        Cache folder whose code tables type the key columns of the results (default: the
+        database's folder, see data_loader.encode_columns)
+    """
+
+    def __init__(self, db_path, cache_dir=None, conditions=(), params=(), connection=None):
+        self.db_path = db_path
+        self.cache_dir = cache_dir or os.path.dirname(os.path.abspath(db_path))
+        self.conditions = tuple(conditions)
+        self.params = tuple(params)
+        self.connection = connection or sqlite3.connect(f"file:{db_path}?mode=ro", uri=True,
+                                                        check_same_thread=False)
+        self._cubes = {}
+
+    def where(self, years=None, min_week=None, max_week=None, exclude_out_of_scope=False, notna=(), trades=None):
+        """
+        Returns the bookings matching the predicates (same ones as query.select_rows, plus
+        `trades`, a list of trades to keep).
+        """
+        conditions, params = list(self.conditions), list(self.params)
+        if years is not None:
+            conditions.append(f"YEAR IN ({', '.join('?' * len(years))})")
+            params += [int(year) for year in years]
+        if min_week is not None:
+            conditions.append("WEEK >= ?")
+            params.append(int(min_week))
+        if max_week is not None:
+            conditions.append("WEEK <= ?")
+            params.append(int(max_week))
+        if exclude_out_of_scope:
+            # Like TRADE != "OUT OF SCOPE" in pandas, bookings without a trade are kept
+            conditions.append("(TRADE IS NULL OR TRADE <> 'OUT OF SCOPE')")
+        for column in notna:
+            conditions.append(f"{_quote(column)} IS NOT NULL")
+        if trades is not None:
+            conditions.append(f"TRADE IN ({', '.join('?' * len(trades))})")
+            params += list(trades)
+        return SqliteBookings(self.db_path, self.cache_dir, conditions, params, self.connection)
+
+    def _where_clause(self, extra=()):
+        conditions = list(self.conditions) + list(extra)
+        return ("WHERE " + " AND ".join(conditions)) if conditions else ""
+
+    def _grouped(self, keys, expressions):
+        # Runs a GROUP BY over `keys` (NULL keys are dropped, like pandas) and types the keys
+        # like the DataFrame's columns, in the order of a pandas groupby
+        selected = ", ".join([_quote(key) for key in keys] + [f"{sql} AS {_quote(name)}"
+                                                              for name, sql in expressions.items()])
+        where = self._where_clause([f"{_quote(key)} IS NOT NULL" for key in keys])
+        group = ", ".join(map(_quote, keys))
+        frame = pd.read_sql_query(f"SELECT {selected} FROM {TABLE_NAME} {where} GROUP BY {group}",
+                                  self.connection, params=self.params)
+
+        for key in keys:
+            if key in INTEGER_COLUMNS:
+                frame[key] = frame[key].astype(INTEGER_COLUMNS[key])
+        encode_columns(frame, self.cache_dir, columns=[key for key in keys if key not in INTEGER_COLUMNS])
+        for name in expressions:
+            if name != 'BOOKINGS':
+                frame[name] = frame[name].astype('float64')
+        return frame.sort_values(keys, ignore_index=True)
+
+    def frame(self, columns=None):
+        """
+        Reads the bookings into a DataFrame (all columns by default), typed like
+        data_loader.load_dataset.
+        """
+        columns = columns or read_column_names()
+        frame = pd.read_sql_query(f"SELECT {', '.join(map(_quote, columns))} FROM {TABLE_NAME} {self._where_clause()}",
+                                  self.connection, params=self.params)
+        frame = frame.astype({column: dtype for column, dtype in build_schema(columns).items()
+                              if dtype != 'category'})
+        return encode_columns(frame, self.cache_dir)
+
+    def ytd_total(self, year, max_week, measure='TOTAL TEU', trade=None):
+        """
+        Returns the sum of `measure` over weeks 1 to `max_week` of `year`, for one trade or for
+        all trades but OUT OF SCOPE.
+        """
+        bookings = self.where(years=[year], max_week=max_week, exclude_out_of_scope=trade is None,
+                              trades=[trade] if trade is not None else None)
+        row = self.connection.execute(f"SELECT SUM({_quote(measure)}) FROM {TABLE_NAME} {bookings._where_clause()}",
+                                      bookings.params).fetchone()
+        return row[0]
+
+    def sums(self, by, columns):
+        """
+        Returns the sums of `columns` per group of `by` (NaN when all the rows are missing),
+        plus the number of rows as BOOKINGS.
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        expressions = {column: f"SUM({_quote(column)})" for column in columns}
+        expressions['BOOKINGS'] = "COUNT(*)"
+        sums = self._grouped(by, expressions)
+        sums['BOOKINGS'] = sums['BOOKINGS'].astype('int64')
+        return sums.set_index(by)
+
+    def mean(self, value_col, by):
+        """
+        SQL version of aggregations.group_mean.
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        means = self._grouped(by, {value_col: f"AVG({_quote(value_col)})"})
+        return means.set_index(by)[value_col]
+
+    def weighted_sums(self, value_col, weight_col, by):
+        """
+        SQL version of aggregations.weighted_sums.
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        valid = self.where(notna=[value_col, weight_col])
+        sums = valid._grouped(by, {
+            'WEIGHTED_SUM': f"SUM({_quote(weight_col)} * {_quote(value_col)})",
+            'WEIGHT_SUM': f"SUM({_quote(weight_col)})",
+        })
+        return sums.set_index(by)
+
+    def cube(self, dimension=None):
+        """
+        SQL version of weekly_cube.build_cube, computed once per handle.
+        """
+        if dimension not in self._cubes:
+            keys = BASE_DIMENSIONS + ([dimension] if dimension is not None else [])
+            expressions = {measure: f"SUM({_quote(measure)})" for measure in SUM_MEASURES}
+            expressions['BOOKINGS'] = "COUNT(*)"
+            # Rows with both an AVG CONTRIBUTION and a TOTAL TEU, see aggregations.weighted_sums
+            valid = '"AVG CONTRIBUTION" IS NOT NULL AND "TOTAL TEU" IS NOT NULL'
+            expressions['WEIGHTED_SUM'] = f'COALESCE(SUM(CASE WHEN {valid} THEN "TOTAL TEU" * "AVG CONTRIBUTION" END), 0.0)'
+            expressions['WEIGHT_SUM'] = f'COALESCE(SUM(CASE WHEN {valid} THEN "TOTAL TEU" END), 0.0)'
+            cube = self._grouped(keys, expressions)
+            cube['BOOKINGS'] = cube['BOOKINGS'].astype('int64')
+            self._cubes[dimension] = cube
+        return self._cubes[dimension]
+
+    def __repr__(self):
+        return f"<SqliteBookings {self.db_path} {self._where_clause() or '(all rows)'}>"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the SQLite copy of the extract (built on first use).")
+    parser.add_argument("csv_path")
+    parser.add_argument("sql", nargs="?", help=f"query on table {TABLE_NAME} (default: row count per year)")
+    parser.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args(argv)
+
+    bookings = connect(args.csv_path, rebuild=args.rebuild)
+    sql = args.sql or f"SELECT YEAR, COUNT(*) AS BOOKINGS FROM {TABLE_NAME} GROUP BY YEAR"
+    print(read_sql(bookings, sql).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_loader import read_column_names
+
+# Generates vol_contrib_data-shaped extracts (columns of column_names.txt) of any size, for
+# benchmarking the analyses without the real export. The shape follows the real data:
+# five trades plus OUT OF SCOPE, a handful of clients and commodities carrying most of the
+# volume, 20'/40' equipment, lost-slot TEU on a minority of bookings and a few missing
+# contributions.
+
+# Benchmark sizes, in rows
+SCALES = {'100k': 100_000, '1M': 1_000_000, '10M': 10_000_000, '50M': 50_000_000}
+
+DEFAULT_YEARS = [2023, 2024, 2025]
+DEFAULT_CHUNK_ROWS = 1_000_000
+
+# Share of the bookings, load ports, discharge ports and mean contribution ($/TEU) of each trade
+TRADE_PROFILES = {
+    "EUR-US":       (0.28, ["FRLEH", "BEANR", "DEHAM", "NLRTM"], ["USNYC", "USSAV", "USHOU", "USCHS"], 420.0),
+    "EUR-ANZ":      (0.14, ["FRLEH", "DEHAM", "ITGOA"], ["AUSYD", "AUMEL", "NZAKL"], 610.0),
+    "EUR-FPI":      (0.09, ["FRLEH", "FRMRS"], ["PFPPT", "NCNOU"], 780.0),
+    "US EX":        (0.21, ["USNYC", "USSAV", "USHOU"], ["FRLEH", "BEANR", "DEHAM"], 350.0),
+    "LATAM EX":     (0.16, ["BRSSZ", "ARBUE", "CLSAI"], ["ESALG", "FRLEH", "NLRTM"], 300.0),
+    "OUT OF SCOPE": (0.12, ["CNSHA", "SGSIN", "AEJEA"], ["FRLEH", "MATNG", "EGPSD"], 150.0),
+}
+
+# Equipment type, share of the bookings, TEU per unit
+EQUIPMENT_MIX = [
+    ("40HC", 0.42, 2.0), ("20DV", 0.26, 1.0), ("40DV", 0.14, 2.0), ("40RF", 0.08, 2.0),
+    ("20RF", 0.03, 1.0), ("40OT", 0.03, 2.0), ("40FR", 0.02, 2.0), ("20TK", 0.02, 1.0),
+]
+
+N_CLIENTS = 5000
+N_COMMODITIES = 97
+N_VESSELS = 60
+
+# Zipf exponents of the client and commodity volume shares (higher = more concentrated)
+CLIENT_SKEW = 1.1
+COMMODITY_SKEW = 1.3
+
+# Share of the bookings carrying lost slots, and share with no contribution
+LOST_SLOT_SHARE = 0.07
+MISSING_CONTRIBUTION_SHARE = 0.03
+
+
+def _zipf_weights(n, skew):
+    weights = 1.0 / np.arange(1, n + 1) ** skew
+    return weights / weights.sum()
+
+
+def _codes(n, width):
+    return np.array([str(i).zfill(width) for i in range(n)], dtype=object)
+
+
+def generate_chunk(rng, n_rows, years=None, first_booking=0):
+    """
+    Generates `n_rows` synthetic bookings.
+
+    Parameters:
+    -----------
+    rng : numpy.random.Generator
+        Random generator, reuse the same one across chunks of a dataset
+    n_rows : int
+        Number of rows
+    years : list, optional
+        Years the bookings are spread over (default: DEFAULT_YEARS)
+    first_booking : int
+        Number of the first booking reference
+
+    Returns:
+    --------
+    pandas.DataFrame
+        Columns of column_names.txt, in that order
+    """
+    if years is None:
+        years = DEFAULT_YEARS
+
+    trade_names = list(TRADE_PROFILES)
+    shares = np.array([profile[0] for profile in TRADE_PROFILES.values()])
+    trade_idx = rng.choice(len(trade_names), size=n_rows, p=shares / shares.sum())
+
+    # Ports are picked within the trade of the booking
+    pol = np.empty(n_rows, dtype=object)
+    pod = np.empty(n_rows, dtype=object)
+    contribution_mean = np.empty(n_rows)
+    for i, (_, load_ports, discharge_ports, mean) in enumerate(TRADE_PROFILES.values()):
+        rows = trade_idx == i
+        count = int(rows.sum())
+        pol[rows] = np.asarray(load_ports, dtype=object)[rng.integers(0, len(load_ports), count)]
+        pod[rows] = np.asarray(discharge_ports, dtype=object)[rng.integers(0, len(discharge_ports), count)]
+        contribution_mean[rows] = mean
+
+    equipment_types = np.array([e[0] for e in EQUIPMENT_MIX], dtype=object)
+    equipment_shares = np.array([e[1] for e in EQUIPMENT_MIX])
+    equipment_idx = rng.choice(len(EQUIPMENT_MIX), size=n_rows, p=equipment_shares / equipment_shares.sum())
+    teu_per_unit = np.array([e[2] for e in EQUIPMENT_MIX])[equipment_idx]
+
+    client = rng.choice(N_CLIENTS, size=n_rows, p=_zipf_weights(N_CLIENTS, CLIENT_SKEW))
+    commodity = rng.choice(N_COMMODITIES, size=n_rows, p=_zipf_weights(N_COMMODITIES, COMMODITY_SKEW)) + 1
+
+    year = np.asarray(years)[rng.integers(0, len(years), n_rows)]
+    week = rng.integers(1, 53, n_rows)
+    vessel = rng.integers(0, N_VESSELS, n_rows)
+
+    # Bookings of 1 to 4 units, lost slots (out of gauge, overweight) on a minority of them
+    units = rng.geometric(0.6, n_rows).clip(max=4)
+    teu = units * teu_per_unit
+    lost_slots = np.where(rng.random(n_rows) < LOST_SLOT_SHARE, rng.integers(1, 3, n_rows) * teu_per_unit, 0.0)
+    total_teu = teu + lost_slots
+    tons = units * rng.uniform(4.0, 14.0, n_rows) * teu_per_unit
+
+    contribution = rng.normal(contribution_mean, contribution_mean * 0.35)
+    contribution[rng.random(n_rows) < MISSING_CONTRIBUTION_SHARE] = np.nan
+
+    # Codes are formatted once per distinct value then looked up, much cheaper than per row
+    trade = np.asarray(trade_names, dtype=object)[trade_idx]
+    pol = pd.Series(pol)
+    pod = pd.Series(pod)
+    year_str = pd.Series(year).astype(str)
+    week_str = pd.Series(_codes(53, 2)[week])
+    vessel_str = pd.Series("VSL" + _codes(N_VESSELS, 3)[vessel])
+    client_str = _codes(N_CLIENTS, 4)[client]
+    commodity_str = _codes(N_COMMODITIES + 1, 2)[commodity]
+    booking = np.arange(first_booking, first_booking + n_rows)
+
+    data = {
+        'ORION WEEK': year_str + week_str,
+        'BUSINESS PARTNER': "BP" + client_str,
+        'ZOL': pol.str[:2] + "Z",
+        'POL': pol,
+        'ZOD': pod.str[:2] + "Z",
+        'POD': pod,
+        'FULL/EMPTY': np.where(rng.random(n_rows) < 0.05, "E", "F"),
+        'EQUIPMENT': equipment_types[equipment_idx],
+        'VOYAGE REFERENCE': vessel_str + year_str.str[2:] + week_str,
+        'VESSEL': vessel_str,
+        'BOOKING REFERENCE': np.char.add("BK", np.char.zfill(booking.astype(str), 9)).astype(object),
+        'COMMODITY': "HS " + commodity_str + " GOODS",
+        'TEU (WITHOUT LS)': teu,
+        'TONS': tons.round(2),
+        'AVG CONTRIBUTION': contribution.round(2),
+        'TOTAL TEU': total_teu,
+        'TRADE ZOL': trade,
+        'TRADE ZOD': trade,
+        'TRADE': trade,
+        'CLEAN BUSINESS PARTNER': "CLIENT " + client_str,
+        'COMMODITY HS CHAPTER': "HS " + commodity_str,
+        'COUNTRY ORIGIN': pol.str[:2],
+        'COUNTRY DESTINATION': pod.str[:2],
+        'YEAR': year,
+        'WEEK': week,
+        'WEIGHTED CONTRIB': (total_teu * contribution).round(2),
+    }
+    return pd.DataFrame(data)[read_column_names()]
+
+
+def generate_dataset(n_rows, years=None, seed=0):
+    """
+    Returns a synthetic dataset of `n_rows` rows as a DataFrame (see generate_chunk).
+    """
+    return generate_chunk(np.random.default_rng(seed), n_rows, years)
+
+
+def _write_csv_chunk(chunk, f, header):
+    # pyarrow writes CSV several times faster than pandas. It writes UTF-8, which is the same
+    # bytes as latin1 here since every generated value is ASCII.
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        chunk.to_csv(f, index=False, header=header, encoding="latin1")
+        return
+    table = pa.Table.from_pandas(chunk, preserve_index=False)
+    pa_csv.write_csv(table, f, pa_csv.WriteOptions(include_header=header))
+
+
+def write_dataset(csv_path, n_rows, years=None, seed=0, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Writes a synthetic dataset of `n_rows` rows to `csv_path`, chunk by chunk so that any size
+    fits in memory. The file is written next to its final name and renamed when complete.
+
+    Parameters:
+    -----------
+    csv_path : str
+        Output CSV file, encoded like the real extract (latin1)
+    n_rows : int or str
+        Number of rows, or a key of SCALES such as '10M'
+    years : list, optional
+        Years the bookings are spread over (default: DEFAULT_YEARS)
+    seed : int
+        Random seed, the same seed and size give the same file
+    chunk_rows : int
+        Rows generated per chunk (default: 1,000,000)
+
+    Returns:
+    --------
+    str
+        csv_path
+    """
+    if isinstance(n_rows, str):
+        n_rows = SCALES[n_rows]
+
+    rng = np.random.default_rng(seed)
+    tmp_path = csv_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        for start in range(0, n_rows, chunk_rows):
+            chunk = generate_chunk(rng, min(chunk_rows, n_rows - start), years, first_booking=start)
+            _write_csv_chunk(chunk, f, header=start == 0)
+    os.replace(tmp_path, csv_path)
+    return csv_path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write a synthetic vol_contrib_data-shaped CSV.")
+    parser.add_argument("csv_path")
+    parser.add_argument("rows", help=f"number of rows or one of {', '.join(SCALES)}")
+    parser.add_argument("--years", type=int, nargs="+", default=DEFAULT_YEARS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rows = args.rows if args.rows in SCALES else int(args.rows)
+    write_dataset(args.csv_path, rows, years=args.years, seed=args.seed)
@@ -0,0 +1,19 @@
+import os
+
+from report_runner import run_report, weekly_pack_specs
+from synthetic_data import write_dataset
+from variables import trades
+
+
+def test_run_report_on_cold_cache_with_workers(tmp_path):
+    # A fresh CSV next to no .vol_cache: the columnar cache and the cubes do not exist yet
+    csv_path = write_dataset(str(tmp_path / "bookings.csv"), 20_000, years=[2024, 2025], seed=1)
+    assert not os.path.exists(tmp_path / ".vol_cache")
+
+    specs = weekly_pack_specs(2025, 20, trades)
+    results = run_report(specs, {'csv_path': csv_path}, str(tmp_path / "report"), jobs=2)
+
+    errors = {result['name']: result['error'] for result in results if result['error'] is not None}
+    assert errors == {}
+    assert all(os.path.isfile(result['path']) for result in results)
+    assert len(results) == len(specs)
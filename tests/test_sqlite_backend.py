@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+
+from data_loader import load_dataset
+from lane_graph import LANE_LEVELS, LANE_MEASURES, LaneGraph
+from sqlite_backend import SqliteBookings, connect
+from synthetic_data import write_dataset
+from trade_contribution import contrib_comparison_data, weighted_contrib_comparison_data
+from variables import trades
+
+
+@pytest.fixture(scope="module")
+def bookings(tmp_path_factory):
+    # The same extract as a DataFrame and as a SQLite database
+    csv_path = write_dataset(str(tmp_path_factory.mktemp("sqlite") / "bookings.csv"), 5_000,
+                             years=[2024, 2025], seed=2)
+    return load_dataset(csv_path), connect(csv_path)
+
+
+def assert_tables_equal(tables, other_tables):
+    for table, other in zip(tables, other_tables):
+        pd.testing.assert_frame_equal(table.set_axis(table.columns.astype(str), axis=1),
+                                      other.set_axis(other.columns.astype(str), axis=1),
+                                      check_names=False, check_index_type=False)
+
+
+def test_contrib_comparison_data_on_sqlite(bookings):
+    df, db = bookings
+    assert isinstance(db, SqliteBookings)
+    assert_tables_equal(contrib_comparison_data(df, 2025, 2024, 20),
+                        contrib_comparison_data(db, 2025, 2024, 20))
+
+
+def test_weighted_contrib_comparison_data_on_sqlite(bookings):
+    df, db = bookings
+    assert_tables_equal(weighted_contrib_comparison_data(df, 2025, 2024, 20, trades),
+                        weighted_contrib_comparison_data(db, 2025, 2024, 20, trades))
+
+
+@pytest.mark.parametrize("level", list(LANE_LEVELS))
+def test_lane_graph_on_sqlite(bookings, level):
+    df, db = bookings
+    graph, sql_graph = LaneGraph(level).update(df), LaneGraph(level).update(db)
+    for measure in LANE_MEASURES:
+        matrix = pd.DataFrame(graph.matrix(measure).toarray(), graph.nodes, graph.nodes)
+        sql_matrix = pd.DataFrame(sql_graph.matrix(measure).toarray(), sql_graph.nodes, sql_graph.nodes)
+        pd.testing.assert_frame_equal(matrix, sql_matrix.reindex(index=matrix.index, columns=matrix.columns))
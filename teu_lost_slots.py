@@ -1,21 +1,142 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import numpy as np
 
-from variables import trades, current_year, current_week, csv_path
+from plotting import plt
+from variables import trades, current_year, current_week
+from data_loader import dataset_info
+from weekly_cube import get_cube
+from query import select
+from instrumentation import instrumented, stage
 
+# Lost slots are the TEU of TOTAL TEU not in TEU (WITHOUT LS). The charts below compare them by
+# trade on the weekly cube; lost_slot_data breaks them down by vessel and voyage on the bookings:
+#
+#     lost = lost_slot_data(df, years=[2025], max_week=20)      # one row per voyage and week
+#     worst = worst_voyages(df, 2025, 20, n=20, rank_by='LOST RATIO', min_teu=50)
+
+# Keys of lost_slot_data, outermost first (the YTD values run over WEEK within the others)
+LOST_SLOT_KEYS = ['YEAR', 'TRADE', 'VESSEL', 'VOYAGE REFERENCE', 'WEEK']
+
+def _lost_slot_ratio(lost, total):
+    # Lost TEU as a % of TOTAL TEU, NaN without TEU
+    return lost / total.where(total != 0) * 100
+
+def lost_slot_data(df, years=None, max_week=None, trades=None):
+    """
+    Returns the lost slots of every YEAR x TRADE x VESSEL x VOYAGE REFERENCE x WEEK, weekly and
+    YTD, computed in one grouped pass over the bookings (OUT OF SCOPE excluded).
+    
+    For datasets returned by data_loader.load_dataset the result is kept with the dataset, so
+    refreshing the charts and queries below does not aggregate the bookings again.
+    
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        DataFrame containing the booking data
+    years : list, optional
+        Years to include (default: all)
+    max_week : int, optional
+        Maximum week number to include (default: all weeks)
+    trades : list, optional
+        Trades to include (default: all)
+    
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per key of LOST_SLOT_KEYS, in that order, with TOTAL TEU, TEU (WITHOUT LS),
+        LOST TEU, LOST RATIO (% of TOTAL TEU), and their YTD values per voyage: YTD TOTAL TEU,
+        YTD LOST TEU, YTD LOST RATIO. Treat it as read-only.
+    """
+    years = tuple(sorted(int(year) for year in years)) if years is not None else None
+    info = dataset_info(df)
+    memo = info.setdefault('lost_slots', {}) if info is not None else {}
+    key = (years, max_week)
+    
+    if key not in memo:
+        rows = select(df, LOST_SLOT_KEYS + ['TOTAL TEU', 'TEU (WITHOUT LS)'], years=years, max_week=max_week, 
+                      exclude_out_of_scope=True)
+        lost = rows.groupby(LOST_SLOT_KEYS, observed=True)[['TOTAL TEU', 'TEU (WITHOUT LS)']].sum()
+        lost['LOST TEU'] = lost['TOTAL TEU'] - lost['TEU (WITHOUT LS)']
+        lost['LOST RATIO'] = _lost_slot_ratio(lost['LOST TEU'], lost['TOTAL TEU'])
+        
+        # Rows are sorted by week within each voyage, so a grouped cumsum gives the YTD values
+        ytd = lost[['TOTAL TEU', 'LOST TEU']].groupby(level=LOST_SLOT_KEYS[:-1], observed=True).cumsum()
+        lost['YTD TOTAL TEU'] = ytd['TOTAL TEU']
+        lost['YTD LOST TEU'] = ytd['LOST TEU']
+        lost['YTD LOST RATIO'] = _lost_slot_ratio(lost['YTD LOST TEU'], lost['YTD TOTAL TEU'])
+        memo[key] = lost.reset_index()
+    
+    lost = memo[key]
+    if trades is not None:
+        lost = lost[lost['TRADE'].isin(trades)].reset_index(drop=True)
+    return lost
+
+def worst_voyages(df, year, max_week, n=20, by=('VESSEL', 'VOYAGE REFERENCE'), rank_by='LOST TEU', min_teu=0, 
+                  trades=None):
+    """
+    Ranks the voyages (or vessels, with by=['VESSEL']) by their YTD lost slots.
+    
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        DataFrame containing the booking data
+    year : int
+        Year to analyze
+    max_week : int
+        Maximum week number to include
+    n : int
+        Number of voyages returned (default: 20)
+    by : list
+        Keys ranked, among LOST_SLOT_KEYS (default: VESSEL and VOYAGE REFERENCE)
+    rank_by : str
+        'LOST TEU' or 'LOST RATIO' (default: 'LOST TEU')
+    min_teu : float
+        Minimum YTD TOTAL TEU of a ranked voyage, to keep small voyages out of a ratio ranking
+        (default: 0)
+    trades : list, optional
+        Trades to include (default: all)
+    
+    Returns:
+    --------
+    pandas.DataFrame
+        RANK, the `by` keys, TOTAL TEU, TEU (WITHOUT LS), LOST TEU, LOST RATIO and WEEKS (weeks
+        with bookings), worst first
+    """
+    stage('aggregate')
+    by = [by] if isinstance(by, str) else list(by)
+    lost = lost_slot_data(df, [year], max_week, trades)
+    
+    voyages = lost.groupby(by, observed=True).agg(**{
+        'TOTAL TEU': ('TOTAL TEU', 'sum'),
+        'TEU (WITHOUT LS)': ('TEU (WITHOUT LS)', 'sum'),
+        'LOST TEU': ('LOST TEU', 'sum'),
+        'WEEKS': ('WEEK', 'nunique'),
+    })
+    voyages['LOST RATIO'] = _lost_slot_ratio(voyages['LOST TEU'], voyages['TOTAL TEU'])
+    voyages = voyages[voyages['TOTAL TEU'] >= min_teu]
+    
+    # Partial selection of the n worst, ties keep the key order
+    worst = voyages.nlargest(n, rank_by).reset_index()
+    for column in by:
+        worst[column] = worst[column].astype(str)
+    worst.insert(0, 'RANK', np.arange(1, len(worst) + 1))
+    return worst[['RANK'] + by + ['TOTAL TEU', 'TEU (WITHOUT LS)', 'LOST TEU', 'LOST RATIO', 'WEEKS']]
 
-# Area chart comparing YTD totals by trade
-def create_teu_area_chart(csv_path, current_week, current_year):
-    df = pd.read_csv(csv_path, encoding="latin1")
 
-    filtered_df = df[(df['TRADE']!="OUT OF SCOPE")]
+# Area chart comparing YTD totals by trade
+@instrumented
+def create_teu_area_chart(df, current_week, current_year, previous_year=None):
+    if previous_year is None:
+        previous_year = current_year - 1
+    # YTD sums come from the precomputed weekly cube (see weekly_cube.py)
+    stage('aggregate')
+    cube = get_cube(df)
+    filtered_df = cube[(cube['TRADE']!="OUT OF SCOPE")]
     
     # Create YTD dataframes for current and previous year
     current_ytd_df = filtered_df[(filtered_df['YEAR'] == current_year) & (filtered_df['WEEK'] <= current_week)]
-    prior_ytd_df = filtered_df[(filtered_df['YEAR'] == current_year-1) & (filtered_df['WEEK'] <= current_week)]
+    prior_ytd_df = filtered_df[(filtered_df['YEAR'] == previous_year) & (filtered_df['WEEK'] <= current_week)]
     
+    stage('plot')
     plt.figure(figsize=(12, 8))
     
     # Set up a figure with subplots - one for current year, one for previous year
@@ -23,12 +144,13 @@ def create_teu_area_chart(csv_path, current_week, current_year):
     
     
     #Group by trade
-    current_grouped = current_ytd_df.groupby('TRADE').agg({
+    stage('aggregate')
+    current_grouped = current_ytd_df.groupby('TRADE', observed=True).agg({
         'TEU (WITHOUT LS)': 'sum',
         'TOTAL TEU': 'sum'
     }).reset_index()
     
-    prior_grouped = prior_ytd_df.groupby('TRADE').agg({
+    prior_grouped = prior_ytd_df.groupby('TRADE', observed=True).agg({
         'TEU (WITHOUT LS)': 'sum',
         'TOTAL TEU': 'sum'
     }).reset_index()
@@ -38,6 +160,7 @@ def create_teu_area_chart(csv_path, current_week, current_year):
     prior_grouped = prior_grouped.sort_values('TOTAL TEU', ascending=False)
     
     # Plot for current year
+    stage('plot')
     ax1.bar(current_grouped['TRADE'], current_grouped['TEU (WITHOUT LS)'], 
             color='steelblue', label='TEU (WITHOUT LS)')
     ax1.bar(current_grouped['TRADE'], 
@@ -55,7 +178,7 @@ def create_teu_area_chart(csv_path, current_week, current_year):
     
     # Titles and labels
     ax1.set_title(f'{current_year} YTD TEU Contribution by Trade (Weeks 1-{current_week})', fontsize=14)
-    ax2.set_title(f'{current_year-1} YTD TEU Contribution by Trade (Weeks 1-{current_week})', fontsize=14)
+    ax2.set_title(f'{previous_year} YTD TEU Contribution by Trade (Weeks 1-{current_week})', fontsize=14)
     
     # Rotate x-axis labels for better readability
     plt.setp(ax2.get_xticklabels(), rotation=45, ha='right')
@@ -77,29 +200,34 @@ def create_teu_area_chart(csv_path, current_week, current_year):
     fig.suptitle(f'YTD Comparison: TEU with and without Lost Slots by Trade', fontsize=16, y=0.98)
     
     # Adjust layout
+    stage('layout')
     plt.tight_layout()
     plt.subplots_adjust(top=0.9)
     
     return fig
 
 # Visualization with detailed YTD comparison by trade
-def create_ytd_comparison_chart(csv_path, current_week, current_year):
+@instrumented
+def create_ytd_trade_comparison_chart(df, current_week, current_year, previous_year=None):
+    if previous_year is None:
+        previous_year = current_year - 1
 
-    df = pd.read_csv(csv_path, encoding="latin1")
-    
-    filtered_df = df[(df['TRADE']!="OUT OF SCOPE")]
+    # YTD sums come from the precomputed weekly cube (see weekly_cube.py)
+    stage('aggregate')
+    cube = get_cube(df)
+    filtered_df = cube[(cube['TRADE']!="OUT OF SCOPE")]
     
     # Create YTD dataframes for current and previous year
     current_ytd_df = filtered_df[(filtered_df['YEAR'] == current_year) & (filtered_df['WEEK'] <= current_week)]
-    prior_ytd_df = filtered_df[(filtered_df['YEAR'] == current_year-1) & (filtered_df['WEEK'] <= current_week)]
+    prior_ytd_df = filtered_df[(filtered_df['YEAR'] == previous_year) & (filtered_df['WEEK'] <= current_week)]
     
     # For all trades, compare YTD totals by trade between years
-    current_trade_ytd = current_ytd_df.groupby('TRADE').agg({
+    current_trade_ytd = current_ytd_df.groupby('TRADE', observed=True).agg({
         'TEU (WITHOUT LS)': 'sum',
         'TOTAL TEU': 'sum'
     }).reset_index()
     
-    prior_trade_ytd = prior_ytd_df.groupby('TRADE').agg({
+    prior_trade_ytd = prior_ytd_df.groupby('TRADE', observed=True).agg({
         'TEU (WITHOUT LS)': 'sum',
         'TOTAL TEU': 'sum'
     }).reset_index()
@@ -108,17 +236,18 @@ def create_ytd_comparison_chart(csv_path, current_week, current_year):
     merged_data = current_trade_ytd.merge(
         prior_trade_ytd, 
         on='TRADE', 
-        suffixes=(f'_{current_year}', f'_{current_year-1}')
+        suffixes=(f'_{current_year}', f'_{previous_year}')
     )
     
     # Calculate growth
     merged_data[f'GROWTH_TOTAL'] = ((merged_data[f'TOTAL TEU_{current_year}'] / 
-                                        merged_data[f'TOTAL TEU_{current_year-1}']) - 1) * 100
+                                        merged_data[f'TOTAL TEU_{previous_year}']) - 1) * 100
     
     # Sort by current year total TEU
     merged_data = merged_data.sort_values(f'TOTAL TEU_{current_year}', ascending=False)
     
     # Set up the figure
+    stage('plot')
     fig, ax = plt.subplots(figsize=(14, 10))
     
     # Set width of bars
@@ -134,13 +263,13 @@ def create_ytd_comparison_chart(csv_path, current_week, current_year):
                     bar_width, bottom=merged_data[f'TEU (WITHOUT LS)_{current_year}'], 
                     color='darkred', label=f'{current_year} Lost Slots')
     
-    bars3 = ax.bar(index + bar_width/2, merged_data[f'TEU (WITHOUT LS)_{current_year-1}'], 
-                    bar_width, color='royalblue', label=f'{current_year-1} TEU WITHOUT LS')
+    bars3 = ax.bar(index + bar_width/2, merged_data[f'TEU (WITHOUT LS)_{previous_year}'], 
+                    bar_width, color='royalblue', label=f'{previous_year} TEU WITHOUT LS')
     
     bars4 = ax.bar(index + bar_width/2, 
-                    merged_data[f'TOTAL TEU_{current_year-1}'] - merged_data[f'TEU (WITHOUT LS)_{current_year-1}'], 
-                    bar_width, bottom=merged_data[f'TEU (WITHOUT LS)_{current_year-1}'], 
-                    color='salmon', label=f'{current_year-1} Lost Slots')
+                    merged_data[f'TOTAL TEU_{previous_year}'] - merged_data[f'TEU (WITHOUT LS)_{previous_year}'], 
+                    bar_width, bottom=merged_data[f'TEU (WITHOUT LS)_{previous_year}'], 
+                    color='salmon', label=f'{previous_year} Lost Slots')
     
     # Add labels and title
     ax.set_xlabel('Trade', fontsize=14)
@@ -155,7 +284,7 @@ def create_ytd_comparison_chart(csv_path, current_week, current_year):
     # Add data labels for growth
     for i, v in enumerate(merged_data['GROWTH_TOTAL']):
         ax.text(i, 
-                merged_data[f'TOTAL TEU_{current_year}'][i] + 100, 
+                merged_data[f'TOTAL TEU_{current_year}'].iloc[i] + 100, 
                 f"{v:.1f}%", 
                 color='black', 
                 fontweight='bold', 
@@ -165,20 +294,25 @@ def create_ytd_comparison_chart(csv_path, current_week, current_year):
     ax.grid(True, axis='y', alpha=0.3)
     
     # Tight layout
+    stage('layout')
     plt.tight_layout()
     
     return fig
 
 #YTD cumsum by week of TEU and Lost Slots
-def create_ytd_comparison_chart(csv_path, current_week, current_year):
+@instrumented
+def create_ytd_comparison_chart(df, current_week, current_year, previous_year=None):
+    if previous_year is None:
+        previous_year = current_year - 1
 
-    df = pd.read_csv(csv_path, encoding="latin1")
-    
-    filtered_df = df[(df['TRADE']!="OUT OF SCOPE")]
+    # YTD sums come from the precomputed weekly cube (see weekly_cube.py)
+    stage('aggregate')
+    cube = get_cube(df)
+    filtered_df = cube[(cube['TRADE']!="OUT OF SCOPE")]
     
     # Create YTD dataframes for current and previous year
     current_ytd_df = filtered_df[(filtered_df['YEAR'] == current_year) & (filtered_df['WEEK'] <= current_week)]
-    prior_ytd_df = filtered_df[(filtered_df['YEAR'] == current_year-1) & (filtered_df['WEEK'] <= current_week)]
+    prior_ytd_df = filtered_df[(filtered_df['YEAR'] == previous_year) & (filtered_df['WEEK'] <= current_week)]
     
     current_weekly = current_ytd_df.groupby('WEEK').agg({
         'TEU (WITHOUT LS)': 'sum',
@@ -198,6 +332,7 @@ def create_ytd_comparison_chart(csv_path, current_week, current_year):
     prior_weekly['CUM_TOTAL_TEU'] = prior_weekly['TOTAL TEU'].cumsum()
 
     # Create figure
+    stage('plot')
     fig, ax = plt.subplots(figsize=(14, 8))
 
     # Plot current year data
@@ -211,10 +346,10 @@ def create_ytd_comparison_chart(csv_path, current_week, current_year):
     # Plot previous year data
     ax.plot(prior_weekly['WEEK'], prior_weekly['CUM_TOTAL_TEU'], 
         marker='o', linestyle='--', color='salmon', linewidth=2, 
-        label=f'{current_year-1} TOTAL TEU (Cumulative)')
+        label=f'{previous_year} TOTAL TEU (Cumulative)')
     ax.plot(prior_weekly['WEEK'], prior_weekly['CUM_TEU_NO_LS'], 
         marker='s', linestyle='--', color='royalblue', linewidth=2, 
-        label=f'{current_year-1} TEU WITHOUT LS (Cumulative)')
+        label=f'{previous_year} TEU WITHOUT LS (Cumulative)')
 
     # Fill the gap areas
     ax.fill_between(current_weekly['WEEK'], 
@@ -225,7 +360,7 @@ def create_ytd_comparison_chart(csv_path, current_week, current_year):
     ax.fill_between(prior_weekly['WEEK'], 
                 prior_weekly['CUM_TEU_NO_LS'], 
                 prior_weekly['CUM_TOTAL_TEU'], 
-                alpha=0.3, color='blue', label=f'{current_year-1} Lost Slots Impact')
+                alpha=0.3, color='blue', label=f'{previous_year} Lost Slots Impact')
 
     # Title and labels
     ax.set_title(f'YTD Cumulative TEU Comparison (Weeks 1-{current_week})', fontsize=16)
@@ -240,3 +375,49 @@ def create_ytd_comparison_chart(csv_path, current_week, current_year):
 
     # Ensure x-axis shows all weeks
     ax.set_xticks(range(1, current_week + 1))
+
+    stage('layout')
+    plt.tight_layout()
+
+    return fig
+
+# Worst voyages by YTD lost slots
+@instrumented
+def plot_worst_voyages(df, current_year, current_week, n=15, rank_by='LOST TEU', min_teu=0, trades=None):
+    """
+    Creates a bar chart of the `n` voyages with the most YTD lost slots (see worst_voyages),
+    each bar split into TEU (WITHOUT LS) and lost slots, labelled with the lost-slot ratio.
+    
+    Returns:
+    --------
+    fig : matplotlib.figure.Figure
+    """
+    worst = worst_voyages(df, current_year, current_week, n, rank_by=rank_by, min_teu=min_teu, trades=trades)
+    labels = worst['VESSEL'] + ' / ' + worst['VOYAGE REFERENCE']
+    
+    stage('plot')
+    fig, ax = plt.subplots(figsize=(14, max(6, 0.45 * len(worst) + 2)))
+    
+    # Worst voyage on top
+    index = np.arange(len(worst))[::-1]
+    ax.barh(index, worst['TEU (WITHOUT LS)'], color='steelblue', label='TEU (WITHOUT LS)')
+    ax.barh(index, worst['LOST TEU'], left=worst['TEU (WITHOUT LS)'], color='lightcoral', label='Lost Slots')
+    
+    for i, (total, ratio) in zip(index, zip(worst['TOTAL TEU'], worst['LOST RATIO'])):
+        ax.text(total, i, f" {ratio:.1f}%", va='center', fontsize=9)
+    
+    ax.set_yticks(index)
+    ax.set_yticklabels(labels)
+    ax.set_xlabel('YTD TEU', fontsize=12)
+    ranked_on = 'lost-slot ratio' if rank_by == 'LOST RATIO' else 'lost-slot TEU'
+    ax.set_title(f'Top {len(worst)} Voyages by {ranked_on} - YTD {current_year} (Weeks 1-{current_week})', fontsize=14)
+    ax.legend(loc='lower right')
+    ax.grid(True, axis='x', alpha=0.3)
+    
+    stage('layout')
+    plt.tight_layout()
+    
+    return fig
+
+# worst = worst_voyages(config.dataset, current_year, current_week, n=20, rank_by='LOST RATIO', min_teu=50)
+# fig = plot_worst_voyages(config.dataset, current_year, current_week)
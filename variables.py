@@ -1,12 +1,102 @@
 import datetime
+import os
+
+# Shared settings of the analyses. Importing this module is cheap: the dataset is only loaded
+# the first time config.dataset is used (see data_loader.load_dataset), then kept.
+#
+#     from variables import config, trades, current_year, current_week
+#     fig = contrib_comparison(config.dataset, current_year, current_year-1, current_week, trades)
+#
+# Point it at another extract with config.use('other_extract.csv') or the VOL_CSV_PATH
+# environment variable, or straight at a columnar copy with config.use(parquet_dir=...).
 
 today = datetime.datetime.now()
 current_year, current_week, _ = today.isocalendar()
 
 trades = ["EUR-US","EUR-ANZ","EUR-FPI","US EX", "LATAM EX"]
 
-csv_path = "vol_contrib_data.csv"
+# Extract read by default, overridden by the VOL_CSV_PATH environment variable
+CSV_PATH_ENV_VAR = "VOL_CSV_PATH"
+csv_path = os.environ.get(CSV_PATH_ENV_VAR) or "vol_contrib_data.csv"
 
 equipment_colors = ["#7886C7", "#006A71", "#48A6A7", "#9ACBD0", "#F2EFE7", "#98D2C0"]
 
-df = pd.read_csv(csv_path, encoding = "latin1")
+
+class Config:
+    """
+    Where the data comes from, with the dataset loaded on first use and cached.
+
+    Parameters:
+    -----------
+    csv_path : str
+        CSV extract (default: csv_path above)
+    parquet_dir : str, optional
+        Partitioned columnar copy to read instead of the CSV (a folder written by
+        data_loader.write_partitioned, e.g. .vol_cache/vol_contrib_data)
+    **load_options
+        Keyword arguments of data_loader.load_dataset, e.g. years=[2025, 2024], max_week=20 or
+        cache_dir=...; with parquet_dir only years / min_week / max_week apply
+    """
+
+    def __init__(self, csv_path=csv_path, parquet_dir=None, **load_options):
+        self.csv_path = csv_path
+        self.parquet_dir = parquet_dir
+        self.load_options = load_options
+        self._dataset = None
+        self._reload = False
+
+    @property
+    def dataset(self):
+        """
+        The booking data as a DataFrame, loaded on first access.
+        """
+        if self._dataset is None:
+            if self.parquet_dir is not None:
+                from data_loader import read_partitioned
+
+                selection = {key: self.load_options[key] for key in ('years', 'min_week', 'max_week')
+                             if key in self.load_options}
+                self._dataset = read_partitioned(self.parquet_dir, **selection)
+            else:
+                from data_loader import load_dataset
+
+                self._dataset = load_dataset(self.csv_path, reload=self._reload, **self.load_options)
+            self._reload = False
+        return self._dataset
+
+    @property
+    def loaded(self):
+        """
+        True once the dataset was loaded.
+        """
+        return self._dataset is not None
+
+    def use(self, csv_path=None, parquet_dir=None, **load_options):
+        """
+        Points the configuration at another source and drops the loaded dataset.
+
+        Returns the configuration, so that config.use('other.csv').dataset works.
+        """
+        self.csv_path = csv_path or self.csv_path
+        self.parquet_dir = parquet_dir
+        self.load_options = load_options
+        self._dataset = None
+        return self
+
+    def reload(self):
+        """
+        Drops the loaded dataset; the next access reads the source again (after a data refresh).
+        """
+        self._dataset = None
+        self._reload = True
+        return self
+
+
+config = Config()
+
+
+def __getattr__(name):
+    # `from variables import df` still works, it loads the dataset at that point
+    if name == 'df':
+        return config.dataset
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,479 @@
+import json
+import os
+
+import pandas as pd
+
+from aggregations import weighted_sums
+from data_loader import (build_schema, cache_lock, changed_partitions, dataset_info, dataset_partitions,
+                         partition_mask)
+
+# Precomputed weekly aggregates ("cubes") shared by the chart builders.
+# Each cube holds the sums of the booking measures by YEAR x WEEK x TRADE, optionally with one
+# extra dimension. Charts query these few thousand rows instead of the raw bookings.
+# Cubes are built once per dataset version and stored under <cache_dir>/cubes/<csv stem>/<version>/.
+# When a new version of the data arrives, the cube of the previous version is updated with the
+# YEAR/WEEK partitions that changed instead of being rebuilt from all the bookings.
+
+BASE_DIMENSIONS = ['YEAR', 'WEEK', 'TRADE']
+
+# Extra dimensions a cube can be broken down by (None is the base cube)
+CUBE_DIMENSIONS = [None, 'EQUIPMENT', 'COMMODITY HS CHAPTER', 'CLEAN BUSINESS PARTNER']
+
+# Summed measures taken as-is from the extract
+SUM_MEASURES = ['TOTAL TEU', 'TEU (WITHOUT LS)', 'TONS', 'WEIGHTED CONTRIB']
+
+# Names accepted by cube queries for the computed measures
+MEASURE_ALIASES = {
+    'TEU': 'TOTAL TEU',
+    'WEIGHTED': 'WEIGHTED_SUM',
+}
+
+# Rows read at a time by stream_cubes
+DEFAULT_CHUNKSIZE = 500_000
+
+# Set to 1 to rebuild the cubes from all the bookings instead of updating them
+FULL_REBUILD_ENV_VAR = "VOL_CUBE_FULL_REBUILD"
+
+# Set to 1 to check every incremental update against a full rebuild
+VERIFY_ENV_VAR = "VOL_CUBE_VERIFY"
+
+# Cubes already loaded in this process, keyed by (dataset version, cube name)
+_cubes = {}
+
+# How each cube of _cubes was obtained: 'loaded', 'full', 'incremental' or 'full (verification failed)'
+refresh_log = {}
+
+
+def cube_name(dimension=None):
+    """
+    Returns the file name (without extension) of the cube broken down by `dimension`.
+    """
+    if dimension is None:
+        return "base"
+    return dimension.lower().replace(" ", "_")
+
+
+def build_cube(df, dimension=None):
+    """
+    Aggregates the bookings into weekly sums by YEAR x WEEK x TRADE (x `dimension`).
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame or sqlite_backend.SqliteBookings
+        DataFrame containing the booking data (for SqliteBookings the group-by runs in SQL)
+    dimension : str, optional
+        Extra column to break the cube down by (e.g. 'EQUIPMENT')
+
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per group with the key columns and the measures:
+        - TOTAL TEU, TEU (WITHOUT LS), TONS, WEIGHTED CONTRIB: sums (NaN when all rows are missing)
+        - WEIGHTED_SUM: sum of TOTAL TEU x AVG CONTRIBUTION
+        - WEIGHT_SUM: sum of TOTAL TEU over the rows with an AVG CONTRIBUTION
+        - BOOKINGS: number of rows
+    """
+    if not isinstance(df, pd.DataFrame):
+        return df.cube(dimension)
+    keys = BASE_DIMENSIONS + ([dimension] if dimension is not None else [])
+
+    measures = pd.DataFrame({column: df[column] for column in SUM_MEASURES if column in df.columns})
+    measures['BOOKINGS'] = 1
+    grouped = measures.groupby([df[key] for key in keys], observed=True)
+    cube = grouped.sum(min_count=1)
+    cube['BOOKINGS'] = grouped['BOOKINGS'].sum()
+
+    weighted = weighted_sums(df, 'AVG CONTRIBUTION', 'TOTAL TEU', keys)
+    cube = cube.join(weighted, how='left')
+    cube[['WEIGHTED_SUM', 'WEIGHT_SUM']] = cube[['WEIGHTED_SUM', 'WEIGHT_SUM']].fillna(0.0)
+
+    return cube.reset_index()
+
+
+def _cubes_dir(info):
+    # Cubes of one CSV, the cache folder may be shared by several extracts
+    stem = os.path.splitext(os.path.basename(info['source']))[0]
+    return os.path.join(info['cache_dir'], "cubes", stem)
+
+
+def _cubes_lock(info, shared=False):
+    # Cubes of a CSV are written (and pruned) under an exclusive lock and read under a shared one
+    os.makedirs(_cubes_dir(info), exist_ok=True)
+    return cache_lock(os.path.join(_cubes_dir(info), ".lock"), shared=shared)
+
+
+def _cube_path(info, name):
+    return os.path.join(_cubes_dir(info), info['version'], name + ".parquet")
+
+
+def get_cube(df, dimension=None, incremental=True, verify=False):
+    """
+    Returns the weekly cube of `df`, building it only once per dataset version.
+
+    For datasets returned by data_loader.load_dataset the cube is read from disk when it was
+    already materialized. Otherwise it is derived from the cube of the previous data version by
+    re-aggregating only the YEAR/WEEK partitions that changed (or built from scratch when there
+    is no previous cube), then written to disk. For any other DataFrame it is built in memory
+    on every call.
+
+    `df` can also be a dict of cubes as returned by stream_cubes or materialize_cubes, so the
+    chart builders that only need cubes also run on data streamed from a CSV larger than memory,
+    or a sqlite_backend.SqliteBookings, whose cubes are aggregated in SQL once per handle.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame, dict or sqlite_backend.SqliteBookings
+        DataFrame containing the booking data, or cube name -> cube
+    dimension : str, optional
+        Extra column to break the cube down by (one of CUBE_DIMENSIONS)
+    incremental : bool
+        Update the previous version's cube when possible (default: True, disabled by the
+        VOL_CUBE_FULL_REBUILD environment variable)
+    verify : bool
+        Compare an incremental update with a full rebuild and keep the full rebuild if they
+        differ (default: False, or the VOL_CUBE_VERIFY environment variable)
+
+    Returns:
+    --------
+    pandas.DataFrame
+        See build_cube. Treat it as read-only.
+    """
+    if isinstance(df, dict):
+        # Cubes computed beforehand, e.g. by stream_cubes or materialize_cubes
+        return df[cube_name(dimension)]
+    if not isinstance(df, pd.DataFrame):
+        # Bookings held in SQLite, aggregated by the database
+        return df.cube(dimension)
+
+    info = dataset_info(df)
+    if info is None:
+        return build_cube(df, dimension)
+
+    name = cube_name(dimension)
+    key = (info['version'], name)
+    if key in _cubes:
+        return _cubes[key]
+
+    incremental = incremental and os.environ.get(FULL_REBUILD_ENV_VAR, "") != "1"
+    verify = verify or os.environ.get(VERIFY_ENV_VAR, "") == "1"
+
+    cube = None
+    if info['cache_dir'] is not None:
+        path = _cube_path(info, name)
+        try:
+            with _cubes_lock(info, shared=True):
+                if os.path.exists(path):
+                    cube = pd.read_parquet(path)
+                    refresh_log[key] = 'loaded'
+            if cube is None:
+                with _cubes_lock(info):
+                    # Another process may have written it while this one waited for the lock
+                    if os.path.exists(path):
+                        cube = pd.read_parquet(path)
+                        refresh_log[key] = 'loaded'
+                    else:
+                        cube = _refresh_cube(df, info, dimension, incremental, verify)
+                        _write_cube(cube, path, dataset_partitions(df))
+        except ImportError:
+            # pyarrow is optional, without it cubes only live in memory
+            pass
+    if cube is None:
+        cube = build_cube(df, dimension)
+        refresh_log[key] = 'full'
+
+    _cubes[key] = cube
+    return cube
+
+
+def _refresh_cube(df, info, dimension, incremental, verify):
+    key = (info['version'], cube_name(dimension))
+
+    cube = _update_previous_cube(df, info, dimension) if incremental else None
+    if cube is None:
+        refresh_log[key] = 'full'
+        return build_cube(df, dimension)
+
+    refresh_log[key] = 'incremental'
+    if verify:
+        full = build_cube(df, dimension)
+        if not cubes_match(cube, full):
+            refresh_log[key] = 'full (verification failed)'
+            return full
+    return cube
+
+
+def _previous_cube_dir(info, name):
+    # Most recent cube folder of another data version of the same CSV with the same partition
+    # selection
+    cubes_dir = _cubes_dir(info)
+    selection = info['version'].partition("-")[2]
+    candidates = []
+    for entry in os.listdir(cubes_dir) if os.path.isdir(cubes_dir) else []:
+        folder = os.path.join(cubes_dir, entry)
+        if (entry != info['version'] and entry.partition("-")[2] == selection
+                and os.path.exists(os.path.join(folder, name + ".parquet"))
+                and os.path.exists(os.path.join(folder, "partitions.json"))):
+            candidates.append(folder)
+    return max(candidates, key=os.path.getmtime) if candidates else None
+
+
+def _update_previous_cube(df, info, dimension):
+    name = cube_name(dimension)
+    folder = _previous_cube_dir(info, name)
+    if folder is None:
+        return None
+
+    with open(os.path.join(folder, "partitions.json"), encoding="utf-8") as f:
+        previous_partitions = json.load(f)
+    changed, removed = changed_partitions(previous_partitions, dataset_partitions(df))
+    previous = pd.read_parquet(os.path.join(folder, name + ".parquet"))
+
+    # Drop the rows of changed or removed weeks, then aggregate only the changed weeks again
+    kept = previous[~partition_mask(previous, changed + removed)]
+    fresh = build_cube(df[partition_mask(df, changed)], dimension)
+    cube = pd.concat([kept, fresh], ignore_index=True)
+
+    keys = BASE_DIMENSIONS + ([dimension] if dimension is not None else [])
+    for column in keys[2:]:
+        cube[column] = cube[column].astype(str).astype('category')
+    return cube.sort_values(keys, ignore_index=True)
+
+
+def cubes_match(cube, other, rtol=1e-9):
+    """
+    Returns True when two cubes hold the same groups and measures (up to `rtol`).
+    """
+    def normalized(frame):
+        frame = frame.copy()
+        keys = [column for column in frame.columns if column in BASE_DIMENSIONS + CUBE_DIMENSIONS[1:]]
+        for column in keys[2:]:
+            frame[column] = frame[column].astype(str)
+        frame[['YEAR', 'WEEK']] = frame[['YEAR', 'WEEK']].astype('int64')
+        return frame.sort_values(keys, ignore_index=True)[sorted(frame.columns)]
+
+    try:
+        pd.testing.assert_frame_equal(normalized(cube), normalized(other), check_dtype=False, rtol=rtol)
+    except AssertionError:
+        return False
+    return True
+
+
+def _write_cube(cube, path, partitions):
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    partitions_path = os.path.join(folder, "partitions.json")
+    with open(f"{partitions_path}.{os.getpid()}.tmp", "w", encoding="utf-8") as f:
+        json.dump(partitions, f)
+    os.replace(f"{partitions_path}.{os.getpid()}.tmp", partitions_path)
+    cube.to_parquet(f"{path}.{os.getpid()}.tmp", index=False)
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+
+def prune_cubes(df):
+    """
+    Deletes the stored cubes of older data versions of the CSV behind `df`.
+
+    A cube of an older version is only deleted once the same cube exists for the current
+    version, since it is the starting point of the incremental update. Run it as a maintenance
+    step after materialize_cubes, e.g. once per report before any worker starts; cubes are
+    never deleted while get_cube reads them.
+
+    Returns:
+    --------
+    list
+        Paths of the deleted cubes
+    """
+    info = dataset_info(df)
+    if info is None or info['cache_dir'] is None:
+        return []
+    cubes_dir = _cubes_dir(info)
+    current = info['version'].partition("-")[0]
+
+    removed = []
+    with _cubes_lock(info):
+        folders = [entry for entry in os.listdir(cubes_dir) if os.path.isdir(os.path.join(cubes_dir, entry))]
+        materialized = {file for entry in folders if entry.partition("-")[0] == current
+                        for file in os.listdir(os.path.join(cubes_dir, entry)) if file.endswith(".parquet")}
+        for entry in folders:
+            if entry.partition("-")[0] == current:
+                continue
+            folder = os.path.join(cubes_dir, entry)
+            for file in os.listdir(folder):
+                if file in materialized:
+                    os.remove(os.path.join(folder, file))
+                    removed.append(os.path.join(folder, file))
+            if not any(file.endswith(".parquet") for file in os.listdir(folder)):
+                for file in os.listdir(folder):
+                    os.remove(os.path.join(folder, file))
+                os.rmdir(folder)
+    return removed
+
+
+def materialize_cubes(df, incremental=True, verify=False):
+    """
+    Builds, updates or loads every cube of CUBE_DIMENSIONS for `df`. Run once after each data refresh.
+
+    See get_cube for `incremental` and `verify`; refresh_log records how each cube was obtained.
+    The cubes of older data versions are kept until prune_cubes is called.
+
+    Returns:
+    --------
+    dict
+        Cube name -> cube
+    """
+    return {cube_name(dimension): get_cube(df, dimension, incremental=incremental, verify=verify)
+            for dimension in CUBE_DIMENSIONS}
+
+
+def verify_cubes(df):
+    """
+    Checks every materialized cube of `df` against a full rebuild from the bookings.
+
+    Returns:
+    --------
+    dict
+        Cube name -> True if the stored cube matches the full rebuild
+    """
+    return {cube_name(dimension): cubes_match(get_cube(df, dimension), build_cube(df, dimension))
+            for dimension in CUBE_DIMENSIONS}
+
+
+def combine_cubes(cubes, dimension=None):
+    """
+    Adds up partial cubes of the same dimension (e.g. built from different chunks of bookings).
+
+    Returns:
+    --------
+    pandas.DataFrame
+        Cube with one row per group, same layout as build_cube
+    """
+    keys = BASE_DIMENSIONS + ([dimension] if dimension is not None else [])
+    # Category sets differ between partial cubes, group on the plain labels
+    cubes = [cube.astype({column: str for column in keys[2:]}) for cube in cubes if cube is not None]
+    combined = pd.concat(cubes, ignore_index=True).groupby(keys, observed=True).sum(min_count=1)
+    combined[['WEIGHTED_SUM', 'WEIGHT_SUM']] = combined[['WEIGHTED_SUM', 'WEIGHT_SUM']].fillna(0.0)
+    return combined.reset_index()
+
+
+def stream_cubes(csv_path, dimensions=CUBE_DIMENSIONS, years=None, max_week=None,
+                 exclude_out_of_scope=True, required=(), chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Builds cubes straight from the CSV, reading it in chunks of `chunksize` rows.
+
+    Each chunk is filtered and aggregated into partial cubes before the next one is read, and
+    the partial cubes are added up once at the end, so peak memory depends on `chunksize` (and
+    on the size of the cubes), not on the size of the file. Only the columns the cubes need are
+    parsed. An empty file gives empty cubes with the usual columns.
+
+    Parameters:
+    -----------
+    csv_path : str
+        Path to the CSV file with contribution data
+    dimensions : list
+        Extra dimensions of the cubes to build (default: all of CUBE_DIMENSIONS)
+    years : list, optional
+        Years to keep (default: all)
+    max_week : int, optional
+        Maximum week number to keep (default: all weeks)
+    exclude_out_of_scope : bool
+        Drop the bookings with TRADE "OUT OF SCOPE" (default: True)
+    required : list
+        Columns that must be non-null for a booking to be kept, e.g. ['AVG CONTRIBUTION',
+        'TOTAL TEU']. Bookings without a contribution are already left out of WEIGHTED_SUM and
+        WEIGHT_SUM, so the default keeps them for the TEU and TONS sums.
+    chunksize : int
+        Number of rows parsed at a time (default: DEFAULT_CHUNKSIZE)
+
+    Returns:
+    --------
+    dict
+        Cube name -> cube, usable in place of the DataFrame by get_cube
+    """
+    extra = [dimension for dimension in dimensions if dimension is not None]
+    needed = set(BASE_DIMENSIONS + extra + SUM_MEASURES + ['AVG CONTRIBUTION'] + list(required))
+    schema = {column: dtype for column, dtype in build_schema().items() if column in needed}
+
+    partials = {cube_name(dimension): [] for dimension in dimensions}
+    try:
+        reader = pd.read_csv(csv_path, encoding="latin1", dtype=schema, usecols=lambda column: column in needed,
+                             chunksize=chunksize)
+    except pd.errors.EmptyDataError:
+        reader = []
+    for chunk in reader:
+        mask = pd.Series(True, index=chunk.index)
+        if exclude_out_of_scope:
+            mask &= chunk['TRADE'] != "OUT OF SCOPE"
+        if years is not None:
+            mask &= chunk['YEAR'].isin(years)
+        if max_week is not None:
+            mask &= chunk['WEEK'] <= max_week
+        for column in required:
+            mask &= chunk[column].notna()
+        chunk = chunk[mask]
+
+        for dimension in dimensions:
+            partials[cube_name(dimension)].append(build_cube(chunk, dimension))
+
+    cubes = {}
+    for dimension in dimensions:
+        keys = BASE_DIMENSIONS + ([dimension] if dimension is not None else [])
+        name = cube_name(dimension)
+        if partials[name]:
+            cube = combine_cubes(partials[name], dimension)
+        else:
+            empty = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in schema.items()})
+            cube = build_cube(empty, dimension)
+        cubes[name] = cube
+        for column in keys[2:]:
+            cube[column] = cube[column].astype('category')
+        cube[['YEAR', 'WEEK']] = cube[['YEAR', 'WEEK']].astype({'YEAR': 'int16', 'WEEK': 'int8'})
+    return cubes
+
+
+def measure_column(measure):
+    """
+    Maps a metric name used by the charts ('TEU', 'TONS', 'WEIGHTED', ...) to a cube column.
+    """
+    return MEASURE_ALIASES.get(measure, measure)
+
+
+def weekly_matrix(cube, year, max_week, measure, columns='TRADE'):
+    """
+    Pivots the cube rows of one year into a WEEK x `columns` matrix of `measure`.
+
+    Parameters:
+    -----------
+    cube : pandas.DataFrame
+        Cube returned by get_cube, already filtered on anything else
+    year : int
+        Year to extract
+    max_week : int
+        Maximum week number to include
+    measure : str
+        Cube column (or alias, see MEASURE_ALIASES) to pivot
+    columns : str
+        Cube column spread across the matrix columns (default: 'TRADE')
+
+    Returns:
+    --------
+    pandas.DataFrame
+        Indexed by WEEK (only weeks with data), one column per value of `columns` (as str),
+        NaN where a week has no data for that column
+    """
+    measure = measure_column(measure)
+    rows = cube[(cube['YEAR'] == year) & (cube['WEEK'] <= max_week)]
+    matrix = rows.groupby(['WEEK', columns], observed=True)[measure].sum(min_count=1).unstack(columns)
+    matrix.columns = matrix.columns.astype(str)
+    matrix.index = matrix.index.astype(int)
+    return matrix
+
+
+def cumulative_matrix(cube, year, max_week, measure, columns='TRADE'):
+    """
+    YTD cumulative version of weekly_matrix, for every week from 1 to `max_week`.
+
+    Weeks without data carry the previous cumulative value forward (0 before the first week
+    with data).
+    """
+    weekly = weekly_matrix(cube, year, max_week, measure, columns)
+    return weekly.cumsum().reindex(range(1, max_week + 1)).ffill().fillna(0)
@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from report_runner import FAMILIES, run_report, weekly_data_specs, weekly_pack_specs, write_data_tables
+from variables import csv_path, current_week, current_year, trades
+
+# Command-line entry point of the weekly report pack, for unattended runs:
+#
+#     python weekly_report.py --year 2025 --week 20 --output out/2025-W20 --jobs 4
+#     python weekly_report.py --families cumulative clients --format svg
+#     python weekly_report.py --data-only             # aggregate tables as CSV, no plotting
+#     python weekly_report.py --history 5            # plus the 5-year overlays and deltas
+#
+# Only the compared years up to the week cutoff are read from the data. The images (or
+# tables) are written to the output folder with a report.json listing every output, its
+# timing and its error if any. The exit status is 1 when any output failed.
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Produce the weekly report pack.")
+    parser.add_argument("--data", default=csv_path, help=f"CSV extract (default: {csv_path})")
+    parser.add_argument("--year", type=int, default=current_year, help="current year (default: this year)")
+    parser.add_argument("--previous-year", type=int, help="year compared against (default: year - 1)")
+    parser.add_argument("--week", type=int, default=current_week, help="week cutoff (default: this week)")
+    parser.add_argument("--trades", nargs="+", default=trades, help="trades to show")
+    parser.add_argument("--output", "-o", help="output folder (default: report_<year>_W<week>)")
+    parser.add_argument("--history", type=int, default=0,
+                        help="years in the multi-year overlays, current year included (default: none)")
+    parser.add_argument("--families", nargs="+", choices=FAMILIES, default=FAMILIES,
+                        help="figure families to produce (default: all)")
+    parser.add_argument("--jobs", "-j", type=int, help="rendering processes (default: one per core)")
+    parser.add_argument("--data-only", action="store_true", help="write the aggregate tables, no figures")
+    parser.add_argument("--format", default="png", help="image format (default: png)")
+    parser.add_argument("--dpi", type=int, default=100)
+    parser.add_argument("--figure-cache", help="folder of the figure cache (default: no caching)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Runs the weekly report from the command line. Returns the exit status.
+    """
+    args = parse_args(argv)
+    previous_year = args.previous_year or args.year - 1
+    output_dir = args.output or f"report_{args.year}_W{args.week:02d}"
+    history_years = [args.year - offset for offset in range(args.history)]
+    years = list(dict.fromkeys([args.year, previous_year] + history_years))
+    data = {'csv_path': args.data, 'years': years, 'max_week': args.week}
+
+    start = time.perf_counter()
+    if args.data_only:
+        from data_loader import load_dataset
+
+        specs = [spec for spec in weekly_data_specs(args.year, args.week, args.trades, previous_year, history_years)
+                 if spec['family'] in args.families]
+        without_tables = [family for family in args.families if family not in {spec['family'] for spec in specs}]
+        if without_tables:
+            print(f"No aggregate tables for: {', '.join(without_tables)}", file=sys.stderr)
+        results = write_data_tables(specs, load_dataset(**data), output_dir)
+    else:
+        specs = [spec for spec in weekly_pack_specs(args.year, args.week, args.trades, previous_year, history_years)
+                 if spec['family'] in args.families]
+        results = run_report(specs, data, output_dir, jobs=args.jobs, fmt=args.format, dpi=args.dpi,
+                             cache_dir=args.figure_cache)
+    seconds = time.perf_counter() - start
+
+    failed = [result for result in results if result['error']]
+    for result in results:
+        status = "FAILED" if result['error'] else ("cached" if result.get('cached') else "ok")
+        print(f"{result['name']:<30} {result['seconds']:8.2f}s  {status}")
+    for result in failed:
+        print(f"\n{result['name']}:\n{result['error']}", file=sys.stderr)
+    print(f"{len(results) - len(failed)}/{len(results)} outputs in {seconds:.1f}s "
+          f"({len(results) / seconds if seconds else 0:.2f}/s) -> {output_dir}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "report.json"), "w", encoding="utf-8") as f:
+        json.dump({'arguments': vars(args), 'seconds': seconds, 'results': results}, f, indent=2)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
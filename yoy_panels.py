@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+# Shared renderer for the weekly current-year vs previous-year comparison panels.
+# matplotlib is imported on first use (see plotting.py).
+
+
+def yoy_difference_bands(weeks, current_values, previous_values, alpha=0.3):
+    """
+    Builds the green/red bands between two weekly series as a single collection.
+
+    Each week with both values gets a band one week wide spanning the two values: green when
+    the current year is higher, red when the previous year is higher, nothing when they are equal.
+
+    Parameters:
+    -----------
+    weeks : array-like
+        Week numbers (x positions)
+    current_values, previous_values : array-like
+        Values of both years for each week, NaN when missing
+    alpha : float
+        Transparency of the bands (default: 0.3)
+
+    Returns:
+    --------
+    matplotlib.collections.PolyCollection
+    """
+    from matplotlib.collections import PolyCollection
+
+    weeks = np.asarray(weeks, dtype=float)
+    current_values = np.asarray(current_values, dtype=float)
+    previous_values = np.asarray(previous_values, dtype=float)
+
+    shown = ~np.isnan(current_values) & ~np.isnan(previous_values) & (current_values != previous_values)
+    x, curr, prev = weeks[shown], current_values[shown], previous_values[shown]
+    low, high = np.minimum(curr, prev), np.maximum(curr, prev)
+
+    # One rectangle per week: (w-0.5, low), (w+0.5, low), (w+0.5, high), (w-0.5, high)
+    rectangles = np.stack([
+        np.column_stack([x - 0.5, low]),
+        np.column_stack([x + 0.5, low]),
+        np.column_stack([x + 0.5, high]),
+        np.column_stack([x - 0.5, high]),
+    ], axis=1)
+    colors = np.where(curr > prev, 'green', 'red')
+
+    return PolyCollection(rectangles, facecolors=colors, edgecolors=colors, alpha=alpha)
+
+
+def plot_yoy_panel(ax, current_series, previous_series, current_week, current_label, previous_label):
+    """
+    Draws one comparison panel: both years' weekly lines plus the difference bands.
+
+    Missing weeks are interpolated linearly. Titles and axis labels are left to the caller.
+
+    Parameters:
+    -----------
+    ax : matplotlib.axes.Axes
+        Axes to draw on
+    current_series, previous_series : pandas.Series
+        Weekly values indexed by week number
+    current_week : int
+        Last week shown
+    current_label, previous_label : str
+        Legend labels of both years
+    """
+    weeks = range(1, current_week+1)
+    current_series = current_series.reindex(weeks).interpolate(method='linear')
+    previous_series = previous_series.reindex(weeks).interpolate(method='linear')
+
+    # Plot the lines
+    ax.plot(weeks, current_series, marker='o', markersize=4,
+            linewidth=2, label=current_label, color='#0D173F')
+    ax.plot(weeks, previous_series, marker='o', markersize=4,
+            linewidth=2, label=previous_label, color='#FF0000')
+
+    # Fill the difference, all weeks in one artist
+    ax.add_collection(yoy_difference_bands(weeks, current_series, previous_series))
+    ax.autoscale_view()
+
+    ax.grid(True, alpha=0.3)
+    ax.legend(loc='best')
+
+    # Set x-axis tick marks to whole weeks
+    ax.set_xticks(range(1, current_week+1, 2))  # Every 2 weeks for readability
+
+
+def yoy_series(data, column):
+    """
+    Returns column `column` of a WEEK x category table, or an empty Series when it is missing.
+    """
+    return data.get(column, pd.Series(dtype=float))